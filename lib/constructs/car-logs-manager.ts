@@ -30,6 +30,8 @@ import { CarLogsFetchStepFunction } from './car-logs-fetch';
 
 const MAX_VCPU = 32;
 const MAX_JOB_VCPU = MAX_VCPU / 2;
+// /dev/shm for the rendered frame rings of the concurrent bag analyses (MiB)
+const JOB_SHARED_MEMORY_MIB = 2048;
 
 export interface CarLogsManagerProps {
   logsBucket: s3.IBucket;
@@ -341,6 +343,9 @@ export class CarLogsManager extends Construct {
           { type: 'VCPU', value: MAX_JOB_VCPU.toString() },
           { type: 'MEMORY', value: '32768' },
         ],
+        linuxParameters: {
+          sharedMemorySize: JOB_SHARED_MEMORY_MIB,
+        },
         executionRoleArn: taskExecutionRole.roleArn,
         jobRoleArn: taskRole.roleArn,
         networkConfiguration: {
@@ -595,6 +600,34 @@ export class CarLogsManager extends Construct {
     });
     props.appsyncApi.schema.addType(mediaMetadataInputType);
 
+    const processingMetricsObjectType = new ObjectType('ProcessingMetrics', {
+      definition: {
+        bags: GraphqlType.int(),
+        frames: GraphqlType.int(),
+        processingSeconds: GraphqlType.float(),
+        framesPerSecond: GraphqlType.float(),
+        combineSeconds: GraphqlType.float(),
+        limitingStage: GraphqlType.string(),
+        metricsKey: GraphqlType.string(),
+      },
+      directives: [Directive.iam(), Directive.cognito('racer', 'admin', 'operator')],
+    });
+    props.appsyncApi.schema.addType(processingMetricsObjectType);
+
+    const processingMetricsInputType = new InputType('ProcessingMetricsInput', {
+      definition: {
+        bags: GraphqlType.int(),
+        frames: GraphqlType.int(),
+        processingSeconds: GraphqlType.float(),
+        framesPerSecond: GraphqlType.float(),
+        combineSeconds: GraphqlType.float(),
+        limitingStage: GraphqlType.string(),
+        metricsKey: GraphqlType.string(),
+      },
+      directives: [Directive.iam(), Directive.cognito('racer', 'admin', 'operator')],
+    });
+    props.appsyncApi.schema.addType(processingMetricsInputType);
+
     const carLogsModelRef = new ObjectType('CarLogsModelRef', {
       definition: {
         modelId: GraphqlType.string({ isRequired: true }),
@@ -616,6 +649,7 @@ export class CarLogsManager extends Construct {
         carName: GraphqlType.string(),
         assetMetaData: assetMetadataObjectType.attribute(),
         mediaMetaData: mediaMetadataObjectType.attribute(),
+        processingMetrics: processingMetricsObjectType.attribute(),
         type: carLogsAssetType.attribute({ isRequired: true }),
       },
       directives: [Directive.iam(), Directive.cognito('racer', 'admin', 'operator', 'commentator')], // TODO anyone who is logged in should have access to this
@@ -670,6 +704,7 @@ export class CarLogsManager extends Construct {
           carName: GraphqlType.string(),
           assetMetaData: assetMetadataInputType.attribute(),
           mediaMetaData: mediaMetadataInputType.attribute(),
+          processingMetrics: processingMetricsInputType.attribute(),
           type: carLogsAssetType.attribute(),
         },
         returnType: carLogsAssetObjectType.attribute(),
@@ -96,10 +96,12 @@ export class CarManager extends Construct {
         POWERTOOLS_SERVICE_NAME: 'car_status_update',
         LOG_LEVEL: props.lambdaConfig.layersConfig.powerToolsLogLevel,
         APPSYNC_URL: props.appsyncApi.api.graphqlUrl,
+        CARS_TABLE: carStatusTable.tableName,
       },
     });
 
     props.appsyncApi.api.grantMutation(carStatusUpdateHandler, 'carsUpdateStatus');
+    carStatusTable.grantReadData(carStatusUpdateHandler);
 
     const carStatusUpdateHandlerAdditionalRolePolicy = carStatusUpdateHandler.addAdditionalRolePolicy(
       'carStatusUpdateHandlerPolicy',
@@ -546,6 +548,9 @@ export class CarManager extends Construct {
       // cars list can use it to spot duplicates and track history.
       ChassisSerial: GraphqlType.string(),
       ChassisSerialStatus: GraphqlType.string(),
+      // Hash of the status fields, used by `car_status_update` to only send
+      // cars whose status changed since the last sweep.
+      StatusFingerprint: GraphqlType.string(),
     };
 
     const car_online_object_type = new ObjectType('carOnline', {
@@ -35,6 +35,7 @@ export interface LeaderboardProps {
   eventbus: IEventBus;
   racerProfileObjectType: ObjectType;
   racerProfileTable: dynamodb.ITable;
+  userCacheTable: dynamodb.ITable;
 }
 
 export class Leaderboard extends Construct {
@@ -109,11 +110,13 @@ export class Leaderboard extends Construct {
       environment: {
         DDB_TABLE: ddbTable.tableName,
         USER_POOL_ID: props.userPoolId,
+        USER_CACHE_TABLE: props.userCacheTable.tableName,
         APPSYNC_URL: props.appsyncApi.api.graphqlUrl,
         POWERTOOLS_SERVICE_NAME: 'leaderboard_entry_evb',
       },
     });
     ddbTable.grantReadWriteData(evbLeLambda);
+    props.userCacheTable.grantReadWriteData(evbLeLambda);
     props.appsyncApi.api.grantMutation(evbLeLambda, 'addLeaderboardEntry');
     props.appsyncApi.api.grantMutation(evbLeLambda, 'updateLeaderboardEntry');
     props.appsyncApi.api.grantMutation(evbLeLambda, 'deleteLeaderboardEntry');
@@ -1,4 +1,4 @@
-import { DockerImage, Duration } from 'aws-cdk-lib';
+import { DockerImage, Duration, RemovalPolicy } from 'aws-cdk-lib';
 import * as appsync from 'aws-cdk-lib/aws-appsync';
 import { Distribution } from 'aws-cdk-lib/aws-cloudfront';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
@@ -62,8 +62,34 @@ export class RaceManager extends Construct {
       encryption: dynamodb.TableEncryption.AWS_MANAGED,
       pointInTimeRecovery: true,
     });
+    // Race references by the carName of their laps, for getCarRaceHistory
+    raceTable.addGlobalSecondaryIndex({
+      indexName: 'carName-createdAt-index',
+      partitionKey: {
+        name: 'carName',
+        type: dynamodb.AttributeType.STRING,
+      },
+      sortKey: {
+        name: 'createdAt',
+        type: dynamodb.AttributeType.STRING,
+      },
+      projectionType: dynamodb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ['raceSk'],
+    });
     this.raceTable = raceTable;
 
+    // Settings and markers of the race handler, e.g. whether the car race
+    // index has been backfilled; kept apart from the races of the events
+    const raceConfigTable = new dynamodb.Table(this, 'ConfigTable', {
+      partitionKey: {
+        name: 'configKey',
+        type: dynamodb.AttributeType.STRING,
+      },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
+
     // BACKEND
     const raceLambda = new StandardLambdaPythonFunction(this, 'raceLambda', {
       entry: 'lib/lambdas/race_api/',
@@ -84,10 +110,12 @@ export class RaceManager extends Construct {
         EVENT_BUS_NAME: props.eventbus.eventBusName,
         POWERTOOLS_SERVICE_NAME: 'race_handler',
         CARS_HISTORY_TABLE: props.carsHistoryTable.tableName,
+        RACE_CONFIG_TABLE: raceConfigTable.tableName,
       },
     });
     this.raceTable = raceTable;
     raceTable.grantReadWriteData(raceLambda);
+    raceConfigTable.grantReadWriteData(raceLambda);
     props.carsHistoryTable.grantReadData(raceLambda);
     props.eventbus.grantPutEventsTo(raceLambda);
     props.appsyncApi.api.grantMutation(raceLambda, 'addLeaderboardEntry');
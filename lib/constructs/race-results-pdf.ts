@@ -104,6 +104,8 @@ export class RaceResultsPdf extends NestedStack {
       // neither writable on Lambda — and re-scans every font on every render.
       XDG_CACHE_HOME: '/tmp',
       HOME: '/tmp',
+      // Rendered avatars and flags are kept here for the life of a warm container.
+      RENDER_CACHE_DIR: '/tmp/render-cache',
     };
 
     // Worker: long-running renderer (invoked async by orchestrator)
@@ -1,7 +1,7 @@
 import { Duration, NestedStack, NestedStackProps, RemovalPolicy } from 'aws-cdk-lib';
 import * as appsync from 'aws-cdk-lib/aws-appsync';
 import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
-import { IEventBus, Rule } from 'aws-cdk-lib/aws-events';
+import { IEventBus, Rule, Schedule } from 'aws-cdk-lib/aws-events';
 import { LambdaFunction } from 'aws-cdk-lib/aws-events-targets';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
@@ -38,6 +38,7 @@ export interface StatisticsProps extends NestedStackProps {
   userPoolArn: string;
   raceTable: dynamodb.ITable;
   eventsTable: dynamodb.ITable;
+  userCacheTable: dynamodb.ITable;
 }
 
 export class Statistics extends NestedStack {
@@ -108,10 +109,12 @@ export class Statistics extends NestedStack {
         RACE_TABLE: props.raceTable.tableName,
         EVENTS_TABLE: props.eventsTable.tableName,
         USER_POOL_ID: props.userPoolId,
+        USER_CACHE_TABLE: props.userCacheTable.tableName,
         POWERTOOLS_SERVICE_NAME: 'stats_evb',
       },
     });
     statsTable.grantReadWriteData(evbLambda);
+    props.userCacheTable.grantReadWriteData(evbLambda);
     props.raceTable.grantReadData(evbLambda);
     props.eventsTable.grantReadData(evbLambda);
 
@@ -124,13 +127,28 @@ export class Statistics extends NestedStack {
     );
 
     new Rule(this, 'RaceSummaryEvbRule', {
-      description: 'Listen for race summaries to update statistics',
+      description: 'Listen for race summaries and events to update statistics',
       eventPattern: {
-        detailType: ['raceSummaryAdded', 'raceSummaryUpdated', 'raceSummaryDeleted'],
+        detailType: [
+          'raceSummaryAdded',
+          'raceSummaryUpdated',
+          'raceSummaryDeleted',
+          'eventAdded',
+          'eventUpdated',
+          'eventDeleted',
+        ],
       },
       eventBus: props.eventbus,
     }).addTarget(new LambdaFunction(evbLambda));
 
+    // Race summaries and event changes only mark their event as dirty; this
+    // flush recomputes each dirty event once, coalescing bursts of submitted races.
+    new Rule(this, 'StatsFlushRule', {
+      description: 'Recompute statistics of events with new race summaries',
+      schedule: Schedule.rate(Duration.minutes(1)),
+      targets: [new LambdaFunction(evbLambda)],
+    });
+
     // BACKEND — API Lambda
     const apiLambda = new StandardLambdaPythonFunction(this, 'apiLambda', {
       entry: 'lib/lambdas/stats_api/',
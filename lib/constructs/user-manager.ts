@@ -1,5 +1,6 @@
-import { DockerImage, Duration, NestedStack, NestedStackProps } from 'aws-cdk-lib';
+import { DockerImage, Duration, NestedStack, NestedStackProps, RemovalPolicy } from 'aws-cdk-lib';
 import * as appsync from 'aws-cdk-lib/aws-appsync';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import { IEventBus, Rule } from 'aws-cdk-lib/aws-events';
 import * as targets from 'aws-cdk-lib/aws-events-targets';
 import * as iam from 'aws-cdk-lib/aws-iam';
@@ -44,10 +45,22 @@ export interface UserManagerProps extends NestedStackProps {
 
 export class UserManager extends NestedStack {
   public readonly userApiObject: ObjectType;
+  public readonly userCacheTable: dynamodb.ITable;
 
   constructor(scope: Construct, id: string, props: UserManagerProps) {
     super(scope, id, props);
 
+    // Shared cache of sub -> username / countryCode, read by the Lambdas that
+    // resolve racer names (see helper_functions/user_cache.py)
+    const userCacheTable = new dynamodb.Table(this, 'UserCacheTable', {
+      partitionKey: { name: 'sub', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
+    this.userCacheTable = userCacheTable;
+
     // delete users Function
     const delete_user_function = new StandardLambdaPythonFunction(this, 'delete_user_function', {
       entry: 'lib/lambdas/delete_user_function/',
@@ -63,6 +76,7 @@ export class UserManager extends NestedStack {
         POWERTOOLS_SERVICE_NAME: 'delete_user',
         LOG_LEVEL: props.lambdaConfig.layersConfig.powerToolsLogLevel,
         eventbus_name: props.eventbus.eventBusName,
+        USER_CACHE_TABLE: userCacheTable.tableName,
       },
       bundling: {
         image: props.lambdaConfig.bundlingImage,
@@ -77,6 +91,7 @@ export class UserManager extends NestedStack {
       })
     );
     props.eventbus.grantPutEventsTo(delete_user_function);
+    userCacheTable.grantReadWriteData(delete_user_function);
 
     // API RESOURCES
     // List & create users Function
@@ -406,6 +421,7 @@ export class UserManager extends NestedStack {
       environment: {
         APPSYNC_URL: props.appsyncApi.api.graphqlUrl,
         user_pool_id: props.userPoolId,
+        USER_CACHE_TABLE: userCacheTable.tableName,
         POWERTOOLS_SERVICE_NAME: 'users_function',
       },
       bundling: {
@@ -419,6 +435,7 @@ export class UserManager extends NestedStack {
     });
 
     props.appsyncApi.api.grantMutation(user_created_event_handler, 'userCreated');
+    userCacheTable.grantReadWriteData(user_created_event_handler);
 
     user_created_event_handler.addToRolePolicy(
       new iam.PolicyStatement({
@@ -450,6 +467,8 @@ export class UserManager extends NestedStack {
       architecture: props.lambdaConfig.architecture,
       environment: {
         APPSYNC_URL: props.appsyncApi.api.graphqlUrl,
+        user_pool_id: props.userPoolId,
+        USER_CACHE_TABLE: userCacheTable.tableName,
         POWERTOOLS_SERVICE_NAME: 'users_confirmed_function',
       },
       bundling: {
@@ -463,6 +482,15 @@ export class UserManager extends NestedStack {
     });
 
     props.appsyncApi.api.grantMutation(user_confirmed_event_handler, 'updateUser');
+    userCacheTable.grantReadWriteData(user_confirmed_event_handler);
+
+    user_confirmed_event_handler.addToRolePolicy(
+      new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ['cognito-idp:ListUsers'],
+        resources: [props.userPoolArn],
+      })
+    );
 
     // EventBridge Rule
     const confirmedRule = new Rule(this, 'user_confirmed_event_handler_rule', {
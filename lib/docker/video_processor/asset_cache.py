@@ -0,0 +1,72 @@
+"""
+Cache for the image and font assets used to draw the video cards.
+
+Every output video draws its own title, lap times and divider cards from the
+same background image, logo and fonts. The decoded and resized assets are kept
+in bounded LRU caches, so they are loaded once per job instead of once per card.
+"""
+
+from functools import lru_cache
+
+import cv2
+from PIL import Image, ImageFont
+
+BACKGROUND_CACHE_SIZE = 4
+LOGO_CACHE_SIZE = 4
+FONT_CACHE_SIZE = 32
+
+
+@lru_cache(maxsize=BACKGROUND_CACHE_SIZE)
+def _background(path: str, width: int, height: int) -> Image.Image:
+    background = cv2.imread(path)
+    if background is None:
+        raise FileNotFoundError(f"Could not read background image '{path}'.")
+    background = cv2.resize(background, (width, height))
+    return Image.fromarray(cv2.cvtColor(background, cv2.COLOR_BGR2RGB))
+
+
+def background_image(path: str, width: int, height: int) -> Image.Image:
+    """
+    Get the background image resized to the frame size.
+
+    Args:
+        path (str): The path to the background image.
+        width (int): The width of the frame.
+        height (int): The height of the frame.
+
+    Returns:
+        Image.Image: An RGB copy of the cached background that can be drawn on.
+    """
+    return _background(path, width, height).copy()
+
+
+@lru_cache(maxsize=LOGO_CACHE_SIZE)
+def logo_image(path: str, height: int) -> Image.Image:
+    """
+    Get the logo resized to the given height, keeping its aspect ratio.
+
+    Args:
+        path (str): The path to the logo image.
+        height (int): The height of the logo.
+
+    Returns:
+        Image.Image: The cached RGBA logo, which must not be modified.
+    """
+    logo = Image.open(path).convert("RGBA")
+    width = int(logo.width * (height / logo.height))
+    return logo.resize((width, height), Image.LANCZOS)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Get a TrueType font.
+
+    Args:
+        path (str): The path to the font file.
+        size (int): The font size.
+
+    Returns:
+        ImageFont.FreeTypeFont: The cached font.
+    """
+    return ImageFont.truetype(path, size)
@@ -5,10 +5,15 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"  # or any {'0', '1', '2'}
 
 import argparse
 import datetime
-import heapq
+import hashlib
+import json
 import multiprocessing as mp
 import queue
 import signal
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.connection import Connection, wait
 from typing import Dict, List, Tuple
 
 import cv2
@@ -23,18 +28,31 @@ from deepracer_interfaces_pkg.msg import InferResultsArray  # type: ignore
 from deepracer_viz.gradcam.cam import GradCam
 from deepracer_viz.model.metadata import ModelMetadata
 from deepracer_viz.model.model import Model
+from frame_renderer import FrameRenderer
+from frame_transport import FrameRing, ReorderBuffer
+from metrics import (
+    StageTimer,
+    limiting_stage,
+    merge_stages,
+    metrics_file,
+    write_metrics,
+)
 from matplotlib import font_manager as fm
 from matplotlib import gridspec
 from matplotlib import pyplot as plt
 from matplotlib import rcParams
 from rclpy.serialization import deserialize_message  # type: ignore
 from tqdm.auto import tqdm
+from worker_pool import WorkerPool
 
 matplotlib.use("Agg")
 
 bridge = CvBridge()
 WIDTH = 1280
 HEIGHT = 720
+INFERENCE_TOPIC = "/inference_pkg/rl_results"
+MODEL_CACHE_SIZE = 4
+QUEUE_SAMPLE_INTERVAL = 1.0  # Seconds between samples of the queue depths
 
 # Define global color constants
 COLOR_EDGE = "#a783e1"
@@ -54,11 +72,9 @@ FONT_SMALL = fm.FontProperties(
     fname=os.path.join(SCRIPT_DIR, "resources", "Amazon_Ember_Rg.ttf"), size=15
 )
 
-procs = []
-
 
 def signal_handler(sig, frame):
-    for p in procs:
+    for p in mp.active_children():
         p.terminate()
 
     print("All worker processes stopped.")
@@ -66,102 +82,287 @@ def signal_handler(sig, frame):
 
 
 def process_worker(
+    control_queue: mp.Queue,
     data_queue: mp.Queue,
-    result: Tuple,
-    model_bytes: bytes,
-    metadata: ModelMetadata,
-    bag_info: dict,
-    background: np.ndarray,
-    action_names: List[str],
+    result_conn: Connection,
+    frame_ring: FrameRing,
     error_queue: mp.Queue = None,  # Add error queue parameter
+    batch_size: int = 1,
 ):
     """
     Worker function to process data frames using a machine learning model and Grad-CAM for visualization.
 
+    The worker is part of a WorkerPool and processes one session (bag) after the
+    other, as received on its control queue, until it receives None. Loaded models
+    and their Grad-CAM are kept across sessions, keyed by the MD5 of the model, so
+    bags of the same model don't load it again.
+
     Args:
+        control_queue (mp.Queue): Queue from which to read the session configurations.
         data_queue (mp.Queue): Queue from which to read data frames to process.
-        result_queue (mp.Queue): Queue to which to put processed results.
-        model_bytes (bytes): Model loaded into bytes.
-        metadata (ModelMetadata): Metadata associated with the model.
-        bag_info (dict): Dictionary containing information about the data bag.
-        background (np.ndarray): Background image to use for visualization.
-        action_names (List[str]): List of action names for labeling.
+        result_conn (Connection): Sending end of this worker's result pipe.
+        frame_ring (FrameRing): Shared memory ring the rendered frames are written to.
+        error_queue (mp.Queue): Queue to report errors to.
+        batch_size (int): Maximum number of frames to take from the queue at once.
 
     Raises:
         Exception: If an error occurs during frame processing.
     """
 
+    models = OrderedDict()
     try:
-        result_list, list_lock = result
-        flip_x = bag_info.get("flip_x", False)
-
-        fig = create_plot(
-            action_names,
-            flip_x,
-            HEIGHT,
-            WIDTH,
-            72,
-            transparent=(background is not None),
-        )
+        while True:
+            session = control_queue.get()
+            if session is None:
+                break
+
+            process_session(
+                session,
+                models,
+                data_queue,
+                result_conn,
+                frame_ring,
+                error_queue,
+                batch_size,
+            )
 
-        model = Model.from_bytes(
-            model_bytes=model_bytes, metadata=metadata, log_device_placement=False
+    except Exception as worker_error:
+        # Critical worker initialization/setup errors
+        error_msg = (
+            f"Worker {os.getpid()}: Critical error in worker setup: {worker_error}"
         )
+        print(error_msg)
+        if error_queue:
+            error_queue.put(("worker_error", error_msg))
+        return  # Exit worker process
 
-        with model.session as _:
-            cam = GradCam(model, model.get_conv_outputs())
+    finally:
+        # Cleanup resources
+        try:
+            for model, _ in models.values():
+                model.session.close()
+            frame_ring.close()
+            result_conn.close()
+        except Exception as cleanup_error:
+            print(f"Worker {os.getpid()}: Error during cleanup: {cleanup_error}")
 
-            while True:
-                try:
-                    task_data = data_queue.get(timeout=1)
-                    if task_data is None:
-                        break
 
-                    index, data = task_data
-                    step, img, grad_img = process_input_frame(
-                        data, start_time=bag_info["start_time"], seq=index, cam=cam
-                    )
-                    encimg = create_img(
-                        fig,
-                        step,
-                        bag_info,
-                        img,
-                        grad_img,
-                        action_names,
-                        flip_x,
-                        background,
-                    )
+def process_session(
+    session: dict,
+    models: OrderedDict,
+    data_queue: mp.Queue,
+    result_conn: Connection,
+    frame_ring: FrameRing,
+    error_queue: mp.Queue = None,
+    batch_size: int = 1,
+):
+    """
+    Process the frames of one bag until the termination sentinel is received.
+
+    The worker collects up to `batch_size` frames from the queue, runs the model and
+    Grad-CAM over each of them and then renders each frame straight into its slot in
+    the shared frame ring. Only the frame index and step data are sent through the
+    worker's result pipe; frames that failed are reported with a step of None so the
+    writer can skip them.
 
-                    with list_lock:
-                        result_list.append([index, step, encimg])
+    When the session ends, a summary with the frames rendered and the time spent
+    per stage is sent through the result pipe.
 
+    Args:
+        session (dict): The session configuration, containing the model (model_md5,
+            model_bytes, metadata), bag_info, background and action_names.
+        models (OrderedDict): Cache of loaded models, see get_model.
+        data_queue (mp.Queue): Queue from which to read data frames to process.
+        result_conn (Connection): Sending end of this worker's result pipe.
+        frame_ring (FrameRing): Shared memory ring the rendered frames are written to.
+        error_queue (mp.Queue): Queue to report frame errors to.
+        batch_size (int): Maximum number of frames to take from the queue at once.
+    """
+    bag_info = session["bag_info"]
+    background = session["background"]
+    action_names = session["action_names"]
+    flip_x = bag_info.get("flip_x", False)
+
+    timer = StageTimer()
+    frames_rendered = 0
+
+    fig = create_plot(
+        action_names,
+        flip_x,
+        HEIGHT,
+        WIDTH,
+        72,
+        transparent=(background is not None),
+    )
+    try:
+        renderer = create_renderer(fig, bag_info, action_names, background)
+        model, cam = get_model(
+            models, session["model_md5"], session["model_bytes"], session["metadata"]
+        )
+        setup_seconds = timer.elapsed()
+
+        with model_session(model):
+            finished = False
+            while not finished:
+                try:
+                    with timer.measure("worker_wait", 0):
+                        batch, finished = read_batch(data_queue, batch_size)
                 except queue.Empty:
                     continue
-                except Exception as frame_error:
-                    # Log frame-specific errors but continue processing
-                    error_msg = f"Worker {os.getpid()}: Error processing frame {index if 'index' in locals() else 'unknown'}: {frame_error}"
+
+                if not batch:
+                    continue
+
+                processed = []
+                try:
+                    processed = process_input_frames(
+                        batch, start_time=bag_info["start_time"], cam=cam, timer=timer
+                    )
+                except Exception as batch_error:
+                    error_msg = f"Worker {os.getpid()}: Error processing batch of frames {batch[0][0]}-{batch[-1][0]}: {batch_error}"
                     print(error_msg)
                     if error_queue:
                         error_queue.put(("frame_error", error_msg))
-                    continue
 
-    except Exception as worker_error:
-        # Critical worker initialization/setup errors
-        error_msg = (
-            f"Worker {os.getpid()}: Critical error in worker setup: {worker_error}"
+                rendered = {
+                    index: (step, img, grad_img)
+                    for index, step, img, grad_img in processed
+                }
+                results = []
+                for index, _ in batch:
+                    # Publish what is rendered before blocking on a slot that
+                    # only frees up once the writer has caught up.
+                    if results and not frame_ring.available(index):
+                        result_conn.send(results)
+                        results = []
+                    with timer.measure("worker_wait", 0):
+                        out = frame_ring.acquire(index)
+
+                    if index not in rendered:
+                        results.append([index, None])
+                        continue
+
+                    step, img, grad_img = rendered[index]
+                    try:
+                        with timer.measure("render"):
+                            create_img(
+                                renderer,
+                                step,
+                                bag_info,
+                                img,
+                                grad_img,
+                                action_names,
+                                flip_x,
+                                out=out,
+                            )
+                        results.append([index, step])
+                        frames_rendered += 1
+
+                    except Exception as frame_error:
+                        # Log frame-specific errors but continue processing
+                        error_msg = f"Worker {os.getpid()}: Error processing frame {index}: {frame_error}"
+                        print(error_msg)
+                        if error_queue:
+                            error_queue.put(("frame_error", error_msg))
+                        results.append([index, None])
+
+                result_conn.send(results)
+
+        seconds = timer.elapsed() - setup_seconds
+        result_conn.send(
+            {
+                "pid": os.getpid(),
+                "frames": frames_rendered,
+                "setup_seconds": round(setup_seconds, 3),
+                "seconds": round(seconds, 3),
+                "frames_per_second": (
+                    round(frames_rendered / seconds, 2) if seconds else 0.0
+                ),
+                "stages": timer.to_dict(),
+            }
         )
-        print(error_msg)
-        if error_queue:
-            error_queue.put(("worker_error", error_msg))
-        return  # Exit worker process
 
     finally:
-        # Cleanup resources
+        plt.close(fig)
+
+
+def get_model(
+    models: OrderedDict, model_md5: str, model_bytes: bytes, metadata: ModelMetadata
+) -> Tuple[Model, GradCam]:
+    """
+    Return the loaded model and its Grad-CAM, loading the model if it isn't cached.
+
+    The least recently used model is evicted, and its session closed, once more
+    than MODEL_CACHE_SIZE models are loaded.
+
+    Args:
+        models (OrderedDict): Cache of (Model, GradCam) by model MD5.
+        model_md5 (str): MD5 hex digest of the model bytes.
+        model_bytes (bytes): Model loaded into bytes.
+        metadata (ModelMetadata): Metadata associated with the model.
+
+    Returns:
+        Tuple[Model, GradCam]: The model and its Grad-CAM.
+    """
+    if model_md5 in models:
+        models.move_to_end(model_md5)
+        return models[model_md5]
+
+    model = Model.from_bytes(
+        model_bytes=model_bytes, metadata=metadata, log_device_placement=False
+    )
+    with model_session(model):
+        cam = GradCam(model, model.get_conv_outputs())
+
+    models[model_md5] = (model, cam)
+    while len(models) > MODEL_CACHE_SIZE:
+        _, (evicted, _) = models.popitem(last=False)
+        evicted.session.close()
+
+    return model, cam
+
+
+@contextmanager
+def model_session(model: Model):
+    """
+    Make the model's graph and session the default, without closing the session
+    on exit as `with model.session` would.
+    """
+    with model.session.graph.as_default(), model.session.as_default():
+        yield model.session
+
+
+def read_batch(data_queue: mp.Queue, batch_size: int) -> Tuple[List, bool]:
+    """
+    Read up to `batch_size` frames from the data queue.
+
+    Blocks for the first frame only; subsequent frames are taken if they are
+    already available, so a batch never waits for a slow reader.
+
+    Args:
+        data_queue (mp.Queue): Queue from which to read data frames.
+        batch_size (int): Maximum number of frames in the batch.
+
+    Returns:
+        Tuple[List, bool]: The list of (index, data) tuples and whether the
+        termination sentinel was received.
+
+    Raises:
+        queue.Empty: If no frame arrived within the timeout.
+    """
+    batch = []
+
+    task_data = data_queue.get(timeout=1)
+    while task_data is not None:
+        batch.append(task_data)
+        if len(batch) >= batch_size:
+            return batch, False
         try:
-            if "fig" in locals():
-                plt.close(fig)
-        except Exception as cleanup_error:
-            print(f"Worker {os.getpid()}: Error during cleanup: {cleanup_error}")
+            task_data = data_queue.get_nowait()
+        except queue.Empty:
+            return batch, False
+
+    return batch, True
 
 
 def create_plot(
@@ -251,45 +452,34 @@ def create_plot(
     return fig
 
 
-def create_img(
+def create_renderer(
     fig: matplotlib.figure.Figure,
-    step: Dict,
     bag_info: Dict,
-    img: np.ndarray,
-    grad_img: np.ndarray,
     action_names: List[str],
-    flip_x: bool,
     background: np.ndarray = None,
-) -> np.ndarray:
+) -> FrameRenderer:
     """
-    Create an image with multiple plots and return it as a cv2 MatLike object.
+    Add the titles to the plot and create the renderer that composites the frames.
+
+    The model name is static for the whole bag and is rasterized with the rest of
+    the layout, the start time / timestamp / sequence title is updated per frame.
 
     Args:
         fig (matplotlib.figure.Figure): The matplotlib Figure object containing the plot.
-        step (Dict): A dictionary containing step information.
         bag_info (Dict): A dictionary containing information about the bag file.
-        img (np.ndarray): The input image to be displayed in the first plot.
-        grad_img (np.ndarray): The gradient image to be displayed in the second plot.
         action_names (List[str]): A list of action names.
-        flip_x (bool): Whether to flip the x-axis showing the actions.
         background (np.ndarray): The background image to use for the plot.
 
     Returns:
-        np.ndarray: The resulting image as a cv2 MatLike object.
+        FrameRenderer: The renderer for the frames of this bag.
     """
 
-    timestamp_formatted = "{:02}:{:05.2f}".format(
-        int(step["timestamp"] // 60), step["timestamp"] % 60
-    )
-
     # Split bag_info['name'] into parts
     name_parts = bag_info["name"].split("-")
-    # Create one string with the last two parts
-    start_time = "-".join(name_parts[-2:])
-    # Create another string with the rest
+    # Create one string with the rest, the last two parts are the start time
     model_name = "-".join(name_parts[:-2])
 
-    # Update left-aligned suptitle
+    # Add left-aligned suptitle
     fig.texts.clear()
     fig.text(
         0.025,
@@ -300,143 +490,236 @@ def create_img(
         ha="left",
     )
 
-    # Add right-aligned suptitle
-    fig.text(
+    # Add right-aligned suptitle, content is set per frame
+    status_text = fig.text(
         0.975,
         0.95,
-        "{} {} / {}".format(start_time, timestamp_formatted, step["seq_0"]),
+        "",
         color=COLOR_TEXT_SECONDARY,
         fontproperties=FONT_BIG,
         ha="right",
     )
 
-    x = list(range(0, len(action_names)))
+    ax = fig.get_axes()
+    return FrameRenderer(
+        fig,
+        image_axes=ax[:2],
+        bar_axes=ax[2],
+        bar_count=len(action_names),
+        dynamic_text=status_text,
+        background=background,
+    )
 
-    car_result = pd.DataFrame(step["car_results"])
 
-    ax = fig.get_axes()
-    for a in ax:
-        for p in set(a.containers):
-            p.remove()
-        for i in set(a.images):
-            i.remove()
+def create_img(
+    renderer: FrameRenderer,
+    step: Dict,
+    bag_info: Dict,
+    img: np.ndarray,
+    grad_img: np.ndarray,
+    action_names: List[str],
+    flip_x: bool,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Create an image with multiple plots and return it as a cv2 MatLike object.
+
+    Args:
+        renderer (FrameRenderer): The renderer created by create_renderer.
+        step (Dict): A dictionary containing step information.
+        bag_info (Dict): A dictionary containing information about the bag file.
+        img (np.ndarray): The input image to be displayed in the first plot.
+        grad_img (np.ndarray): The gradient image to be displayed in the second plot.
+        action_names (List[str]): A list of action names.
+        flip_x (bool): Whether to flip the x-axis showing the actions.
+        out (np.ndarray): Optional BGR buffer to render into, e.g. a frame ring slot.
+
+    Returns:
+        np.ndarray: The resulting BGR image as a cv2 MatLike object.
+    """
 
-    ax[0].imshow(img)
-    ax[1].imshow(grad_img)
+    timestamp_formatted = "{:02}:{:05.2f}".format(
+        int(step["timestamp"] // 60), step["timestamp"] % 60
+    )
+
+    # The last two parts of bag_info['name'] are the start time
+    start_time = "-".join(bag_info["name"].split("-")[-2:])
+
+    bar_heights = None
+    bar_colors = None
 
     # If there are action_names it is a discrete action space
     if len(action_names) > 0:
+        bar_heights = [r["probability"] for r in step["car_results"]]
+
         # Highlight the highest bar in a different color
-        bar_colors = [COLOR_EDGE] * len(car_result["probability"])
-        max_index = car_result["probability"].idxmax()
-        bar_colors[max_index] = COLOR_HIGHLIGHT
+        bar_colors = [COLOR_EDGE] * len(bar_heights)
+        bar_colors[int(np.argmax(bar_heights))] = COLOR_HIGHLIGHT
 
         if flip_x:
-            ax[2].bar(x, car_result["probability"][::-1], color=bar_colors[::-1])
-        else:
-            ax[2].bar(x, car_result["probability"], color=bar_colors)
+            bar_heights = bar_heights[::-1]
+            bar_colors = bar_colors[::-1]
+
+    return renderer.render(
+        [img, grad_img],
+        bar_heights=bar_heights,
+        bar_colors=bar_colors,
+        text="{} {} / {}".format(start_time, timestamp_formatted, step["seq_0"]),
+        out=out,
+    )
 
-    fig.canvas.draw()
 
-    # Get the canvas buffer and convert it to a numpy array
-    buf = fig.canvas.buffer_rgba()
-    ncols, nrows = fig.canvas.get_width_height()
-    img = np.frombuffer(buf, dtype=np.uint8).reshape(nrows, ncols, 4)
+def decode_input_frame(
+    data: bytes, start_time: float, seq: int
+) -> Tuple[Dict, np.ndarray]:
+    """
+    Deserialize a message from a bag file and extract the car's inference results.
 
-    # Apply background if available
-    if background is not None:
-        gradient_alpha_rgb_mul, one_minus_gradient_alpha = utils.get_gradient_values(
-            img
-        )
-        img = cv2.cvtColor(
-            utils.apply_gradient(
-                background.copy(), gradient_alpha_rgb_mul, one_minus_gradient_alpha
-            ),
-            cv2.COLOR_RGBA2BGR,
+    Args:
+        data (bytes): The data to process.
+        start_time (float): The start time of the data.
+        seq (int): The sequence number of the frame.
+
+    Returns:
+        Tuple[Dict, np.ndarray]: A tuple containing the step data and the original image.
+    """
+    step = {}
+
+    msg = deserialize_message(data, InferResultsArray)
+
+    # Timestamp
+    timestamp: float = (
+        msg.images[0].header.stamp.sec + msg.images[0].header.stamp.nanosec / 1e9
+    )
+    timestamp = timestamp - start_time
+
+    step["timestamp"] = timestamp
+    step["seq"] = seq  # int(msg.images[0].header.frame_id)
+    step["seq_0"] = seq
+
+    # Extract original image from first camera
+    cv_img = bridge.compressed_imgmsg_to_cv2(
+        msg.images[0], desired_encoding="passthrough"
+    )
+    cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGRA2RGB)
+
+    # Find best OpenVINO Result
+    step["car_action"] = {"action": -1, "probability": -1}
+    step["car_results"] = []
+    for r in msg.results:
+        step["car_results"].append(
+            {"action": r.class_label, "probability": r.class_prob}
         )
-    else:
-        img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+        if r.class_prob > step["car_action"]["probability"]:
+            step["car_action"] = {
+                "action": r.class_label,
+                "probability": r.class_prob,
+            }
 
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 95]  # Adjust the quality as needed
-    _, encimg = cv2.imencode(".jpg", img, encode_param)
-    return encimg
+    return step, cv_img
 
 
-def process_input_frame(
-    data: bytes, start_time: float, seq: int, cam: GradCam
-) -> Tuple[Dict, np.ndarray, np.ndarray]:
+def add_tf_results(step: Dict, tf_result: np.ndarray) -> Dict:
     """
-    Process data from a bag file.
+    Add the Tensorflow inference results to the step data.
 
     Args:
-        data (bytes): The data to process.
-        start_time (float): The start time of the data.
-        seq (int): The sequence number of the frame.
-        cam (GradCam): The GradCam object used for image processing.
+        step (Dict): The step data to update.
+        tf_result (np.ndarray): The action probabilities returned by the model.
 
     Returns:
-        Tuple[Dict, np.ndarray, np.ndarray]: A tuple containing the processed data, the original image, and the processed image.
+        Dict: The updated step data.
+    """
+    step["tf_action"] = {"action": -1, "probability": -1}
+    step["tf_results"] = []
+    for i, r in enumerate(tf_result):
+        step["tf_results"].append({"action": i, "probability": r})
+        if r > step["tf_action"]["probability"]:
+            step["tf_action"] = {"action": i, "probability": r}
 
-    Raises:
-        Exception: If an error occurs during the processing.
+    # Results
+    step["results"] = []
+
+    return step
+
+
+def run_gradcam(
+    cam: GradCam, images: List[np.ndarray]
+) -> List[Tuple[np.ndarray, np.ndarray]]:
     """
-    try:
-        step = {}
+    Run the model and Grad-CAM over a list of images, one session run per image.
 
-        msg = deserialize_message(data, InferResultsArray)
+    The GradCam of deepracer-viz only processes single images; batching frames
+    saves queue reads and result sends, not session runs.
 
-        # Timestamp
-        timestamp: float = (
-            msg.images[0].header.stamp.sec + msg.images[0].header.stamp.nanosec / 1e9
-        )
-        timestamp = timestamp - start_time
+    Args:
+        cam (GradCam): The GradCam object used for image processing.
+        images (List[np.ndarray]): The RGB images to process.
 
-        step["timestamp"] = timestamp
-        step["seq"] = seq  # int(msg.images[0].header.frame_id)
-        step["seq_0"] = seq
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: The action probabilities and Grad-CAM image per input image.
+    """
+    return [cam.process(img) for img in images]
 
-        # Extract original image from first camera
-        cv_img = bridge.compressed_imgmsg_to_cv2(
-            msg.images[0], desired_encoding="passthrough"
-        )
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGRA2RGB)
-
-        # Find best OpenVINO Result
-        step["car_action"] = {"action": -1, "probability": -1}
-        step["car_results"] = []
-        for r in msg.results:
-            step["car_results"].append(
-                {"action": r.class_label, "probability": r.class_prob}
-            )
-            if r.class_prob > step["car_action"]["probability"]:
-                step["car_action"] = {
-                    "action": r.class_label,
-                    "probability": r.class_prob,
-                }
 
-        # Process image with Tensorflow
-        tf_result, grad_img = cam.process(cv_img)
+def process_input_frames(
+    batch: List[Tuple[int, bytes]],
+    start_time: float,
+    cam: GradCam,
+    timer: StageTimer = None,
+) -> List[Tuple[int, Dict, np.ndarray, np.ndarray]]:
+    """
+    Process a batch of messages from a bag file.
+
+    Frames that cannot be deserialized are logged and left out of the batch, so a
+    single corrupt message does not fail the other frames.
+
+    Args:
+        batch (List[Tuple[int, bytes]]): The (sequence number, data) tuples to process.
+        start_time (float): The start time of the data.
+        cam (GradCam): The GradCam object used for image processing.
+        timer (StageTimer, optional): Timer to record the deserialize and
+            inference_gradcam stages in.
+
+    Returns:
+        List[Tuple[int, Dict, np.ndarray, np.ndarray]]: A list of tuples containing the sequence number,
+        the processed data, the original image, and the Grad-CAM image.
+    """
+    if timer is None:
+        timer = StageTimer()
 
-        step["tf_action"] = {"action": -1, "probability": -1}
-        step["tf_results"] = []
-        for i, r in enumerate(tf_result):
-            step["tf_results"].append({"action": i, "probability": r})
-            if r > step["tf_action"]["probability"]:
-                step["tf_action"] = {"action": i, "probability": r}
+    decoded = []
+    with timer.measure("deserialize", len(batch)):
+        for seq, data in batch:
+            try:
+                step, cv_img = decode_input_frame(data, start_time=start_time, seq=seq)
+                decoded.append((seq, step, cv_img))
+            except Exception as e:
+                print(f"Error decoding frame {seq}: {e}")
 
-        # Results
-        step["results"] = []
+    if not decoded:
+        return []
 
-        return step, cv_img, grad_img
+    # Process images with Tensorflow. The model and Grad-CAM run in the same
+    # session call, so they are timed as one stage.
+    with timer.measure("inference_gradcam", len(decoded)):
+        cam_results = run_gradcam(cam, [cv_img for _, _, cv_img in decoded])
 
-    except Exception as e:
-        print(e)
+    return [
+        (seq, add_tf_results(step, tf_result), cv_img, grad_img)
+        for (seq, step, cv_img), (tf_result, grad_img) in zip(decoded, cam_results)
+    ]
 
 
 def analyze_bag(bag_path: str, metadata: ModelMetadata) -> Dict:
     """
     Analyzes a bag file and returns information about the bag.
 
+    Only the first 60 messages are read, to estimate the frame rate and get the
+    image shape. The total number of frames is taken from the bag metadata; if
+    that is unavailable 'total_frames' is None and the count is determined by
+    the stream reader while processing, so the bag is still read only once.
+
     Args:
         bag_path (str): The path to the bag file.
         metadata (ModelMetadata): Metadata of the model.
@@ -447,7 +730,7 @@ def analyze_bag(bag_path: str, metadata: ModelMetadata) -> Dict:
 
     bag_info = {}
 
-    reader = utils.get_reader(bag_path, topics=["/inference_pkg/rl_results"])
+    reader = utils.get_reader(bag_path, topics=[INFERENCE_TOPIC])
 
     first_stamp: float = -1
     steps_data = {"steps": []}
@@ -474,9 +757,18 @@ def analyze_bag(bag_path: str, metadata: ModelMetadata) -> Dict:
 
         s += 1
 
-    while reader.has_next():
-        (_, _, _) = reader.read_next()
-        s += 1
+    reader_has_next = reader.has_next()
+    del reader
+
+    bag_metadata = utils.read_bag_metadata(bag_path, INFERENCE_TOPIC)
+    if bag_metadata is not None:
+        total_frames = bag_metadata["message_count"]
+        bag_info["bag_start_time"] = bag_metadata["starting_time"]
+        bag_info["bag_duration"] = bag_metadata["duration"]
+    elif not reader_has_next:
+        total_frames = s
+    else:
+        total_frames = None
 
     df = pd.json_normalize(steps_data["steps"])
     del steps_data
@@ -489,7 +781,7 @@ def analyze_bag(bag_path: str, metadata: ModelMetadata) -> Dict:
     bag_info["name"] = os.path.basename(bag_path)
     bag_info["start_time"] = first_stamp
     bag_info["fps"] = step_diff / df["timestamp"].max()
-    bag_info["total_frames"] = s
+    bag_info["total_frames"] = total_frames
     bag_info["step_diff"] = step_diff + 1
     bag_info["step_actual"] = len(df.index)
     bag_info["elapsed_time"] = df["timestamp"].max()
@@ -502,12 +794,39 @@ def analyze_bag(bag_path: str, metadata: ModelMetadata) -> Dict:
     return bag_info
 
 
+def default_worker_count(args: argparse.Namespace) -> int:
+    """Number of workers from the command line, or 3/4 of the physical cores."""
+    if args.worker_count:
+        return args.worker_count
+    return max(1, int((psutil.cpu_count(logical=False)) * 3 / 4))
+
+
+def create_worker_pool(args: argparse.Namespace) -> WorkerPool:
+    """
+    Start a worker pool for rendering frames, sized from the command-line arguments.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments.
+
+    Returns:
+        WorkerPool: The started worker pool.
+    """
+    return WorkerPool(
+        process_worker,
+        default_worker_count(args),
+        args.batch_size,
+        (HEIGHT, WIDTH, 3),
+        shm_shares=args.shm_shares,
+    )
+
+
 def process_file(
     bag_path: str,
     model_bytes: bytes,
     metadata: ModelMetadata,
     args: argparse.Namespace,
     frame_limit: int,
+    pool: WorkerPool = None,
 ) -> Dict:
     """
     Processes a bag file and generates a video with the processed frames.
@@ -518,10 +837,14 @@ def process_file(
         metadata (ModelMetadata): Metadata of the model.
         args (argparse.Namespace): Command-line arguments.
         frame_limit (int): Maximum number of frames to process.
+        pool (WorkerPool, optional): Worker pool to render the frames with. A pool is
+            created, and closed again, for this bag if not given. A given pool is
+            closed if processing fails, as it is left in an unknown state.
 
     Returns:
         Dict: A dictionary containing steps data, bag information, action names, and the output file path.
     """
+    timer = StageTimer()
 
     # Prepare action names
     action_names = []
@@ -553,17 +876,25 @@ def process_file(
                     + "%.1f" % action["speed"]
                 )
 
-    bag_info = analyze_bag(bag_path, metadata)
+    with timer.measure("analyze_bag"):
+        bag_info = analyze_bag(bag_path, metadata)
     utils.print_baginfo(bag_info)
 
     # Key data points
-    worker_count = int((psutil.cpu_count(logical=False)) * 3 / 4)
-    frame_limit = int(min(bag_info["total_frames"], frame_limit))
+    if pool is not None:
+        worker_count, batch_size = pool.worker_count, pool.batch_size
+    else:
+        worker_count, batch_size = default_worker_count(args), args.batch_size
+    if bag_info["total_frames"] is not None:
+        frame_limit = min(bag_info["total_frames"], frame_limit)
+    if frame_limit != float("inf"):
+        frame_limit = int(frame_limit)
+    progress_total = frame_limit if frame_limit != float("inf") else None
 
     print("")
     print(
-        "Analysed file. Starting processing of {} frames with {} workers.".format(
-            frame_limit, worker_count
+        "Analysed file. Starting processing of {} frames with {} workers, batch size {}.".format(
+            progress_total or "all", worker_count, batch_size
         )
     )
 
@@ -581,8 +912,9 @@ def process_file(
     if args.output_file:
         output_file = args.output_file
         if not os.path.exists(os.path.dirname(output_file)):
-            print(f"Output directory '{os.path.dirname(output_file)}' does not exist.")
-            exit(1)
+            raise FileNotFoundError(
+                f"Output directory '{os.path.dirname(output_file)}' does not exist."
+            )
     else:
         output_file = "{}.mp4".format(bag_path)
 
@@ -597,43 +929,54 @@ def process_file(
     )
 
     steps_data = {"steps": []}
+    stream_reader = None
+    own_pool = pool is None
+    if own_pool:
+        with timer.measure("pool_start"):
+            pool = create_worker_pool(args)
+    frame_ring = pool.frame_ring
 
     try:
-        # Create queues for data, results, and errors
-        data_queue = mp.Queue()
-        error_queue = mp.Queue()  # Add error queue
-        manager = mp.Manager()
-        result_list = manager.list()
-        list_lock = manager.Lock()
-
-        # Use a separate process to read from the stream
+        print("Frame ring: {} slots".format(frame_ring.slots))
+
+        # Each worker has its own result pipe, the results are put back in order
+        # by the reorder buffer. Frames can't be rendered further ahead of the
+        # writer than the ring size, so that also bounds the reorder buffer.
+        result_conns = list(pool.result_conns)
+        reorder_buffer = ReorderBuffer(frame_ring.slots)
+
+        pool.start_session(
+            {
+                "model_md5": hashlib.md5(model_bytes).hexdigest(),
+                "model_bytes": model_bytes,
+                "metadata": metadata,
+                "bag_info": bag_info,
+                "background": background,
+                "action_names": action_names,
+            }
+        )
+
+        # Use a separate process to read from the stream. It reports the number
+        # of frames read when done, which is the only frame count available
+        # when the bag has no metadata, and the time it spent reading.
+        frames_read = mp.Value("q", -1, lock=False)
+        read_timings = mp.Array("d", 2, lock=False)
         stream_reader = mp.Process(
             target=utils.read_stream,
-            args=(data_queue, bag_path, ["/inference_pkg/rl_results"], frame_limit),
+            args=(
+                pool.data_queue,
+                bag_path,
+                [INFERENCE_TOPIC],
+                frame_limit,
+                frames_read,
+                read_timings,
+            ),
         )
-        procs.append(stream_reader)
         stream_reader.start()
-
-        # Create worker processes with error queue
-        for _ in range(worker_count):
-            p = mp.Process(
-                target=process_worker,
-                args=(
-                    data_queue,
-                    (result_list, list_lock),
-                    model_bytes,
-                    metadata,
-                    bag_info,
-                    background,
-                    action_names,
-                    error_queue,  # Pass error queue
-                ),
-            )
-            p.start()
-            procs.append(p)
+        processing_start = timer.elapsed()
 
         pbar_proc = tqdm(
-            total=frame_limit,
+            total=progress_total,
             desc="Processing messages",
             unit="msgs",
             smoothing=0.1,
@@ -641,7 +984,7 @@ def process_file(
             mininterval=args.update_frequency,
         )
         pbar_write = tqdm(
-            total=min(bag_info["total_frames"], frame_limit),
+            total=progress_total,
             desc="Writing image frames",
             unit="frames",
             smoothing=0.1,
@@ -649,19 +992,21 @@ def process_file(
             mininterval=args.update_frequency,
         )
 
-        # Priority queue to store results
-        pq = []
         expected_index = 1
         received = 0
+        frames_failed = 0
+        queue_depth = []
+        next_sample = processing_start
         error_count = 0
         max_errors = 5  # Set a threshold for maximum errors
+        reported_workers = set()
 
         while True:
             try:
                 # Check for errors from workers
                 try:
-                    while not error_queue.empty():
-                        error_type, error_msg = error_queue.get_nowait()
+                    while not pool.error_queue.empty():
+                        error_type, error_msg = pool.error_queue.get_nowait()
                         print(f"Worker error ({error_type}): {error_msg}")
                         error_count += 1
 
@@ -679,7 +1024,11 @@ def process_file(
 
                 # Check if any worker processes died unexpectedly
                 dead_workers = [
-                    p for p in procs[1:] if not p.is_alive() and p.exitcode != 0
+                    p
+                    for p in pool.workers
+                    if not p.is_alive()
+                    and p.exitcode != 0
+                    and p.pid not in reported_workers
                 ]
                 if dead_workers:
                     print(
@@ -687,31 +1036,56 @@ def process_file(
                     )
                     for worker in dead_workers:
                         print(f"Worker PID {worker.pid} exit code: {worker.exitcode}")
-
-                while len(result_list) > 0:
-                    with list_lock:
-                        result = result_list.pop(0)
-
-                    heapq.heappush(pq, result)
-                    received += 1
-                    pbar_proc.update(1)
+                        reported_workers.add(worker.pid)
+                if not any(p.is_alive() for p in pool.workers):
+                    raise Exception("All worker processes have exited, aborting")
+
+                # Block until any worker has sent results, waking up regularly
+                # to check for errors.
+                with timer.measure("writer_wait", 0):
+                    ready = wait(result_conns, timeout=1.0)
+                for conn in ready:
+                    try:
+                        results = conn.recv()
+                    except EOFError:
+                        result_conns.remove(conn)
+                        continue
+
+                    for index, step in results:
+                        reorder_buffer.put(index, step)
+                    received += len(results)
+                    pbar_proc.update(len(results))
 
                     if received == frame_limit:
                         pbar_proc.refresh()
 
-                # Process results in order
-                if pq and pq[0][0] == expected_index:
-                    _, step, encimg = heapq.heappop(pq)
-                    steps_data["steps"].append(step)
-                    writer.write(
-                        cv2.imdecode(
-                            np.frombuffer(encimg, dtype=np.uint8), cv2.IMREAD_COLOR
-                        )
-                    )
+                # Process results in order, frames that failed are skipped
+                for index, step in reorder_buffer.pop_ready():
+                    if step is not None:
+                        steps_data["steps"].append(step)
+                        with timer.measure("encode_write"):
+                            writer.write(frame_ring.frame(index))
+                    else:
+                        frames_failed += 1
+                    frame_ring.release(index)
                     pbar_write.update(1)
-                    expected_index += 1
+                    expected_index = index + 1
+
+                if timer.elapsed() >= next_sample:
+                    queue_depth.append(
+                        {
+                            "seconds": round(timer.elapsed() - processing_start, 1),
+                            "data_queue": pool.data_queue.qsize(),
+                            "reorder_buffer": len(reorder_buffer),
+                            "frames_received": received,
+                            "frames_written": len(steps_data["steps"]),
+                        }
+                    )
+                    next_sample = timer.elapsed() + QUEUE_SAMPLE_INTERVAL
 
-                if len(steps_data["steps"]) == frame_limit:
+                if expected_index > frame_limit or (
+                    frames_read.value >= 0 and expected_index > frames_read.value
+                ):
                     pbar_write.refresh()
                     pbar_proc.close()
                     pbar_write.close()
@@ -721,15 +1095,47 @@ def process_file(
                 print(f"Error in main processing loop: {e}")
                 raise
 
-        # Wait for the stream reader to finish, then send termination
-        # to the worker processes.
+        processing_seconds = timer.elapsed() - processing_start
+
+        # Wait for the stream reader to finish, then end the session of the
+        # worker processes.
         stream_reader.join()
-        procs.pop(0)
-        for _ in range(worker_count):
-            data_queue.put(None)
+        worker_metrics = pool.end_session()
+
+        if bag_info["total_frames"] is None:
+            bag_info["total_frames"] = frames_read.value
+
+        timer.add("bag_read", read_timings[0], max(frames_read.value, 0))
+        timer.add("reader_queue_wait", read_timings[1], 0)
+        stages = merge_stages(
+            [timer.to_dict()] + [worker["stages"] for worker in worker_metrics]
+        )
+        frames = len(steps_data["steps"])
+        write_metrics(
+            metrics_file(output_file),
+            {
+                "bag_path": bag_path,
+                "output_file": output_file,
+                "frames": frames,
+                "frames_failed": frames_failed,
+                "worker_count": pool.worker_count,
+                "batch_size": pool.batch_size,
+                "seconds": round(timer.elapsed(), 3),
+                "processing_seconds": round(processing_seconds, 3),
+                "frames_per_second": (
+                    round(frames / processing_seconds, 2) if processing_seconds else 0.0
+                ),
+                "limiting_stage": limiting_stage(stages, pool.worker_count),
+                "stages": stages,
+                "workers": worker_metrics,
+                "queue_depth": queue_depth,
+            },
+        )
 
     except Exception as e:
         print(f"Unexpected error: {e}")
+        # The workers may still be busy with this bag
+        pool.close()
         raise
 
     finally:
@@ -739,19 +1145,15 @@ def process_file(
         except:
             pass
 
-        # Terminate all processes gracefully
-        for p in procs:
-            if p.is_alive():
-                p.terminate()
-            try:
-                p.join(timeout=5)  # Wait up to 5 seconds
-            except:
-                pass
+        if stream_reader is not None and stream_reader.is_alive():
+            stream_reader.terminate()
+            stream_reader.join(timeout=5)
+            if stream_reader.is_alive():
+                stream_reader.kill()
+                stream_reader.join()
 
-            # Force kill if still alive
-            if p.is_alive():
-                p.kill()
-                p.join()
+        if own_pool:
+            pool.close()
 
     return steps_data, bag_info, action_names, output_file
 
@@ -773,6 +1175,9 @@ def main():
     9. Releases the video writer.
     10. Performs analysis on the recorded steps and prints the results.
 
+    With --serve, it instead keeps running and analyzes the bags requested on stdin,
+    see serve().
+
     Args:
         None
 
@@ -788,9 +1193,9 @@ def main():
     parser.add_argument(
         "--codec", help="The codec for the video writer", default="avc1"
     )
-    parser.add_argument("--bag_path", help="The path to the rosbag file", required=True)
+    parser.add_argument("--bag_path", help="The path to the rosbag file")
     parser.add_argument(
-        "--model", help="The path to the model directory or tar.gz-file", required=True
+        "--model", help="The path to the model directory or tar.gz-file"
     )
     parser.add_argument(
         "--frame_limit", help="Max number of frames to process", default=None
@@ -817,9 +1222,49 @@ def main():
     parser.add_argument(
         "--output_file", help="The path to the output video file", default=None
     )
+    parser.add_argument(
+        "--batch_size",
+        help="Number of frames each worker takes from the queue at once",
+        default=8,
+        type=int,
+    )
+    parser.add_argument(
+        "--worker_count",
+        help="Number of rendering workers (default: 3/4 of the physical cores)",
+        default=None,
+        type=int,
+    )
+    parser.add_argument(
+        "--shm_shares",
+        help="Number of concurrent analyses sharing /dev/shm",
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--serve",
+        help="Keep running and analyze the bags requested as JSON lines on stdin",
+        default=False,
+        action="store_true",
+    )
 
     args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    elif not args.bag_path or not args.model:
+        parser.error("--bag_path and --model are required unless --serve is given")
+    else:
+        analyze(args)
 
+
+def analyze(args: argparse.Namespace, pool: WorkerPool = None):
+    """
+    Analyze the bag given in the arguments with the given model and create its video.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments, including bag_path, model
+            and output_file.
+        pool (WorkerPool, optional): Worker pool to render the frames with.
+    """
     if os.path.isdir(args.model):
         metadata, model_bytes = utils.load_model_from_dir(args.model)
         print("Using model directory: {}".format(args.model))
@@ -842,7 +1287,7 @@ def main():
 
     ### Main Processing Step ###
     steps_data, bag_info, action_names, output_file = process_file(
-        bag_path, model_bytes, metadata, args, frame_limit
+        bag_path, model_bytes, metadata, args, frame_limit, pool
     )
 
     # Print analysis
@@ -888,6 +1333,53 @@ def main():
     print("Created video file: {}".format(output_file))
 
 
+def serve(args: argparse.Namespace):
+    """
+    Analyze bags one after another as requested on stdin, reusing one worker pool.
+
+    Each request is a JSON line with bag_path, model and output_file, which override
+    the command-line arguments for that bag. A JSON line with the output_file, success
+    and, on failure, error is written to stdout when the bag is done. The service exits
+    when stdin is closed.
+
+    The worker pool, and with it the loaded models, is kept across requests; it is
+    only recreated after a failure that left it unusable. Everything else printed
+    while processing goes to stderr.
+
+    Args:
+        args (argparse.Namespace): Command-line arguments shared by all requests.
+    """
+    sys.stdout.flush()
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    pool = None
+    try:
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+
+            reply = {"success": False}
+            try:
+                request = json.loads(line)
+                reply["output_file"] = request.get("output_file")
+                if pool is None or not pool.healthy:
+                    if pool is not None:
+                        pool.close()
+                    pool = create_worker_pool(args)
+                analyze(argparse.Namespace(**{**vars(args), **request}), pool)
+                reply["success"] = True
+            except Exception as e:
+                print(f"Error: {e}")
+                reply["error"] = str(e)
+
+            sys.stdout.flush()
+            replies.write(json.dumps(reply) + "\n")
+    finally:
+        if pool is not None:
+            pool.close()
+
+
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
 
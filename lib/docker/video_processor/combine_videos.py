@@ -3,12 +3,16 @@
 import datetime
 import os
 import random
+import shutil
 import string
+import subprocess
+import tempfile
 from enum import Enum
 
+import asset_cache
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 from tqdm import tqdm
 
 
@@ -217,16 +221,12 @@ def create_divider_frame(
     Returns:
         np.ndarray: The created divider frame.
     """
-    background = cv2.imread(background_path)
-    background = cv2.resize(background, (width, height))
-
-    # Convert the background to a PIL image
-    background_pil = Image.fromarray(cv2.cvtColor(background, cv2.COLOR_BGR2RGB))
+    background_pil = asset_cache.background_image(background_path, width, height)
     draw = ImageDraw.Draw(background_pil)
 
     # Load custom fonts
-    font_bd = ImageFont.truetype(fonts["bold"], 60)
-    font_rg = ImageFont.truetype(fonts["regular"], 45)
+    font_bd = asset_cache.font(fonts["bold"], 60)
+    font_rg = asset_cache.font(fonts["regular"], 45)
 
     # Calculate text positions using textbbox
     text_bbox_prefix = draw.textbbox((0, 0), prefix, font=font_bd)
@@ -285,22 +285,15 @@ def create_title_frame(
     Returns:
         np.ndarray: The created title frame.
     """
-    background = cv2.imread(background_path)
-    background = cv2.resize(background, (width, height))
-
-    # Convert the background to a PIL image
-    background_pil = Image.fromarray(cv2.cvtColor(background, cv2.COLOR_BGR2RGB))
+    background_pil = asset_cache.background_image(background_path, width, height)
     draw = ImageDraw.Draw(background_pil)
 
     # Add logo to the top left corner if provided
     if logo_path and os.path.exists(logo_path):
         try:
-            logo = Image.open(logo_path).convert("RGBA")
-            
             # Resize logo to appropriate size (height of about 10% of the frame)
             logo_height = int(height * 0.2)  # 10% of frame height
-            logo_width = int(logo.width * (logo_height / logo.height))
-            logo = logo.resize((logo_width, logo_height), Image.LANCZOS)
+            logo = asset_cache.logo_image(logo_path, logo_height)
             
             # Position logo in the top left with some padding
             padding = 20
@@ -328,12 +321,12 @@ def create_title_frame(
             print(f"Error adding logo: {e}")
 
     # Load custom fonts
-    font_bd_50 = ImageFont.truetype(fonts["bold"], 50)  # Title font
-    font_he_80 = ImageFont.truetype(fonts["heavy"], 80)  # Larger for racer name
-    font_he_45 = ImageFont.truetype(fonts["heavy"], 45)  # Headers (Models)
-    font_he_38 = ImageFont.truetype(fonts["heavy"], 38)  # Bold labels for footer
-    font_rg = ImageFont.truetype(fonts["regular"], 40)  # Regular text
-    font_sm = ImageFont.truetype(fonts["regular"], 38)  # Smaller text for models and footer
+    font_bd_50 = asset_cache.font(fonts["bold"], 50)  # Title font
+    font_he_80 = asset_cache.font(fonts["heavy"], 80)  # Larger for racer name
+    font_he_45 = asset_cache.font(fonts["heavy"], 45)  # Headers (Models)
+    font_he_38 = asset_cache.font(fonts["heavy"], 38)  # Bold labels for footer
+    font_rg = asset_cache.font(fonts["regular"], 40)  # Regular text
+    font_sm = asset_cache.font(fonts["regular"], 38)  # Smaller text for models and footer
 
     vertical_start = height // 7  # Start slightly higher for better balance
     line_spacing = 90  # Increased spacing for the larger racer name
@@ -489,20 +482,16 @@ def create_lap_times_frame(
     Returns:
         np.ndarray: The created lap times frame.
     """
-    background = cv2.imread(background_path)
-    background = cv2.resize(background, (width, height))
-
-    # Convert the background to a PIL image
-    background_pil = Image.fromarray(cv2.cvtColor(background, cv2.COLOR_BGR2RGB))
+    background_pil = asset_cache.background_image(background_path, width, height)
     draw = ImageDraw.Draw(background_pil)
 
     # Load custom fonts
-    font_he_32 = ImageFont.truetype(fonts["heavy"], 32)  # Section headers
-    font_he_24 = ImageFont.truetype(fonts["heavy"], 24)  # Top bar labels
-    font_bd_xs = ImageFont.truetype(fonts["bold"], 22)      # Important data
-    font_rg = ImageFont.truetype(fonts["regular"], 36)   # Regular data
-    font_sm = ImageFont.truetype(fonts["regular"], 24)   # Top bar values
-    font_xs = ImageFont.truetype(fonts["light"], 22)   # Items
+    font_he_32 = asset_cache.font(fonts["heavy"], 32)  # Section headers
+    font_he_24 = asset_cache.font(fonts["heavy"], 24)  # Top bar labels
+    font_bd_xs = asset_cache.font(fonts["bold"], 22)      # Important data
+    font_rg = asset_cache.font(fonts["regular"], 36)   # Regular data
+    font_sm = asset_cache.font(fonts["regular"], 24)   # Top bar values
+    font_xs = asset_cache.font(fonts["light"], 22)   # Items
     
     # Define top bar area - make it more compact
     top_bar_height = height * 0.08  # Reduced from 0.1
@@ -512,12 +501,10 @@ def create_lap_times_frame(
     logo_width = 0
     if logo_path and os.path.exists(logo_path):
         try:
-            logo = Image.open(logo_path).convert("RGBA")
-            
             # Resize logo to appropriate size (height of about 10% of the frame)
             logo_height = int(top_bar_height)
-            logo_width = int(logo.width * (logo_height / logo.height))
-            logo = logo.resize((logo_width, logo_height), Image.LANCZOS)
+            logo = asset_cache.logo_image(logo_path, logo_height)
+            logo_width = logo.width
             
             # Position logo in the top left with some padding
             padding = 20
@@ -771,10 +758,16 @@ def combine_videos(
     skip_duration: float = 20.0,
     update_frequency: float = 0.1,
     metadata: dict = None,
+    stream_copy: bool = True,
 ) -> dict:
     """
     Combine multiple video files into a single video file.
 
+    The title, lap times and divider cards are encoded once as short clips. With
+    `stream_copy`, these are joined with the video files by ffmpeg without re-encoding,
+    if all of them share the same codec, resolution and frame rate. Otherwise every
+    frame is decoded and encoded again into the output file.
+
     Args:
         video_files (list): A list of video file paths to combine.
         output_file (str): The path to the output video file.
@@ -784,6 +777,7 @@ def combine_videos(
         skip_duration (float): Skip video files with duration less than the specified value.
         update_frequency (float): Update frequency for the progress bar.
         metadata (dict): Additional race data including username, models, car_name, and event_name.
+        stream_copy (bool): Join the videos without re-encoding when possible.
 
     Returns:
         dict: Information about the combined video file.
@@ -801,12 +795,11 @@ def combine_videos(
     fps = cap.get(cv2.CAP_PROP_FPS)
     cap.release()
 
-    # Create a video writer
-    fourcc = cv2.VideoWriter_fourcc(*codec)
-    out = cv2.VideoWriter(output_file, fourcc, fps, (width, height))
-
+    # The output is made of segments, either a card frame shown for a duration
+    # or a video file.
+    segments = []
     total_duration = 0
-    
+
     # Add title frame at the beginning
     title_duration = 3.0  # Show title frame for 3 seconds
     if metadata and metadata.get('username') and metadata.get('models'):
@@ -821,12 +814,9 @@ def combine_videos(
             logo_path=image_assets.get('logo'),
             fonts=fonts
         )
-        
-        for _ in range(int(fps * title_duration)):
-            out.write(title_frame)
-        
+        segments.append((title_frame, title_duration))
         total_duration += title_duration
-    
+
     # Add lap times frame if race data is available
     if metadata and metadata.get('race_data') and metadata['race_data'].get('laps'):
         lap_times_duration = 4.0  # Show lap times for 4 seconds
@@ -841,15 +831,11 @@ def combine_videos(
             logo_path=image_assets.get('logo'),
             fonts=fonts
         )
-        
-        for _ in range(int(fps * lap_times_duration)):
-            out.write(lap_times_frame)
-        
+        segments.append((lap_times_frame, lap_times_duration))
         total_duration += lap_times_duration
 
     divider_duration = 1.5  # Duration of the divider frame in seconds
 
-    # Rest of the function remains unchanged
     for video_file in video_files:
         # Extract prefix and date_time from the filename
         parts = os.path.basename(video_file).split("-")
@@ -858,14 +844,14 @@ def combine_videos(
 
         cap = cv2.VideoCapture(video_file)
         duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps
+        cap.release()
         if duration < skip_duration:
             print(f"Skipping {video_file} (duration: {duration:.2f} seconds)")
-            cap.release()
             continue
 
         total_duration += duration
 
-        # Create and write divider frame
+        # Create the divider frame shown before the video
         divider_frame = create_divider_frame(
             width,
             height,
@@ -874,17 +860,77 @@ def combine_videos(
             image_assets["background"],
             fonts
         )
-        for _ in range(
-            int(fps * divider_duration)
-        ):  # Display the divider for 1.5 second
-            out.write(divider_frame)
-
+        segments.append((divider_frame, divider_duration))
         total_duration += divider_duration
 
+        segments.append(video_file)
+
+    if not (
+        stream_copy
+        and concat_segments(segments, output_file, codec, fps, (width, height))
+    ):
+        encode_segments(
+            segments, output_file, codec, fps, (width, height), update_frequency
+        )
+
+    print(f"Finished video file: {output_file}")
+
+    return {
+        "output_file": output_file,
+        "resolution": f"{width}x{height}",
+        "duration": total_duration,
+        "codec": codec,
+        "fps": fps,
+    }
+
+
+def write_card(out: cv2.VideoWriter, frame: np.ndarray, fps: float, duration: float):
+    """
+    Write a card frame repeatedly to show it for the given duration.
+
+    Args:
+        out (cv2.VideoWriter): The video writer.
+        frame (np.ndarray): The card frame.
+        fps (float): Frames per second of the video.
+        duration (float): Duration in seconds.
+    """
+    for _ in range(int(fps * duration)):
+        out.write(frame)
+
+
+def encode_segments(
+    segments: list,
+    output_file: str,
+    codec: str,
+    fps: float,
+    size: tuple,
+    update_frequency: float = 0.1,
+):
+    """
+    Write all segments into the output file, decoding and re-encoding every video frame.
+
+    Args:
+        segments (list): Video file paths and (card frame, duration) tuples.
+        output_file (str): The path to the output video file.
+        codec (str): The codec for the video writer.
+        fps (float): Frames per second of the output video.
+        size (tuple): Width and height of the output video.
+        update_frequency (float): Update frequency for the progress bar.
+    """
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    out = cv2.VideoWriter(output_file, fourcc, fps, size)
+
+    for segment in segments:
+        if isinstance(segment, tuple):
+            frame, duration = segment
+            write_card(out, frame, fps, duration)
+            continue
+
+        cap = cv2.VideoCapture(segment)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         with tqdm(
             total=total_frames,
-            desc=f"Processing {os.path.basename(video_file)}",
+            desc=f"Processing {os.path.basename(segment)}",
             unit="frames",
             mininterval=update_frequency,
         ) as pbar:
@@ -897,12 +943,105 @@ def combine_videos(
         cap.release()
 
     out.release()
-    print(f"Finished video file: {output_file}")
 
-    return {
-        "output_file": output_file,
-        "resolution": f"{width}x{height}",
-        "duration": total_duration,
-        "codec": codec,
-        "fps": fps,
-    }
+
+def video_format(video_file: str) -> tuple:
+    """
+    Get the properties that must match to join video files without re-encoding.
+
+    Args:
+        video_file (str): Path to the video file.
+
+    Returns:
+        tuple: The codec fourcc, width, height and frames per second.
+    """
+    cap = cv2.VideoCapture(video_file)
+    try:
+        return (
+            int(cap.get(cv2.CAP_PROP_FOURCC)),
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            round(cap.get(cv2.CAP_PROP_FPS), 3),
+        )
+    finally:
+        cap.release()
+
+
+def concat_segments(
+    segments: list, output_file: str, codec: str, fps: float, size: tuple
+) -> bool:
+    """
+    Join all segments into the output file without re-encoding the video files.
+
+    Each card is encoded once as a short clip with the same codec, resolution and
+    frame rate, and all clips and videos are then joined with ffmpeg's concat demuxer.
+
+    Args:
+        segments (list): Video file paths and (card frame, duration) tuples.
+        output_file (str): The path to the output video file.
+        codec (str): The codec for the video writer.
+        fps (float): Frames per second of the output video.
+        size (tuple): Width and height of the output video.
+
+    Returns:
+        bool: True if the output file was created, False if the segments can't be
+        joined this way and have to be re-encoded.
+    """
+    if shutil.which("ffmpeg") is None:
+        print("ffmpeg not found, re-encoding the videos instead.")
+        return False
+
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        files = []
+        for i, segment in enumerate(segments):
+            if isinstance(segment, tuple):
+                frame, duration = segment
+                card_file = os.path.join(work_dir, f"card-{i}.mp4")
+                out = cv2.VideoWriter(
+                    card_file, cv2.VideoWriter_fourcc(*codec), fps, size
+                )
+                write_card(out, frame, fps, duration)
+                out.release()
+                files.append(card_file)
+            else:
+                files.append(segment)
+
+        formats = {video_format(f) for f in files}
+        if len(formats) != 1:
+            print(f"Videos differ in codec, resolution or frame rate: {formats}")
+            return False
+
+        list_file = os.path.join(work_dir, "concat.txt")
+        with open(list_file, "w") as f:
+            for file in files:
+                escaped = os.path.abspath(file).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_file,
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            output_file,
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(
+                f"ffmpeg concat failed, re-encoding the videos instead: {result.stderr}"
+            )
+            return False
+
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
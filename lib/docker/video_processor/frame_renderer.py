@@ -0,0 +1,309 @@
+from typing import List, Optional, Sequence
+
+import cv2
+import numpy as np
+from matplotlib import colors as mcolors
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+from matplotlib.text import Text
+from PIL import Image, ImageDraw, ImageFont
+
+# Source images upscaled by at least this factor are resampled with nearest
+# neighbour, mirroring matplotlib's 'antialiased' imshow interpolation.
+NEAREST_UPSAMPLE_FACTOR = 3.0
+
+
+class FrameRenderer:
+    """
+    Composites video frames from a matplotlib layout without redrawing the figure.
+
+    The static parts of the figure (background, axes, spines, labels and static
+    texts) are rasterized once. Each frame then only blits the images, the bars
+    and a single dynamic text into a copy of the pre-rendered frame buffer.
+
+    Layers, from back to front:
+        1. base: figure and axes backgrounds and static figure texts, already
+           composited onto the background image (if any).
+        2. dynamic content: one image per image axis and the bars in the bar axis.
+        3. foreground: spines of all axes and texts inside the bar axis, blended
+           only where the layer is non-transparent.
+        4. dynamic text: rendered with PIL from the same font file and size as
+           the matplotlib text artist it replaces.
+    """
+
+    def __init__(
+        self,
+        fig: Figure,
+        image_axes: Sequence[Axes],
+        bar_axes: Optional[Axes] = None,
+        bar_count: int = 0,
+        dynamic_text: Optional[Text] = None,
+        background: Optional[np.ndarray] = None,
+    ):
+        """
+        Args:
+            fig (Figure): The figure created by create_plot.
+            image_axes (Sequence[Axes]): Axes that each show one image per frame.
+            bar_axes (Axes, optional): Axes showing a bar per action.
+            bar_count (int): Number of bars drawn in bar_axes.
+            dynamic_text (Text, optional): Figure text that changes every frame.
+                Its position, alignment, font and color are used for rendering.
+            background (np.ndarray, optional): RGBA background image the transparent
+                figure is composited onto.
+        """
+        self.fig = fig
+        self.image_axes = list(image_axes)
+        self.bar_axes = bar_axes
+        self.bar_count = bar_count if bar_axes is not None else 0
+        self.dynamic_text = dynamic_text
+        self.background = background
+
+        self._image_shapes = None
+        self._base = None
+
+        if dynamic_text is not None:
+            props = dynamic_text.get_fontproperties()
+            self._font = ImageFont.truetype(
+                props.get_file(), int(round(props.get_size()))
+            )
+            self._text_color = (
+                np.array(
+                    mcolors.to_rgb(dynamic_text.get_color())[::-1], dtype=np.float32
+                )
+                * 255
+            )
+            self._text_anchor = {"left": "ls", "center": "ms", "right": "rs"}[
+                dynamic_text.get_horizontalalignment()
+            ]
+
+    def render(
+        self,
+        images: List[np.ndarray],
+        bar_heights: Optional[Sequence[float]] = None,
+        bar_colors: Optional[Sequence[str]] = None,
+        text: Optional[str] = None,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Render one frame.
+
+        Args:
+            images (List[np.ndarray]): One RGB image per image axis.
+            bar_heights (Sequence[float], optional): Bar heights in data units of the bar axis.
+            bar_colors (Sequence[str], optional): Matplotlib color per bar.
+            text (str, optional): Content of the dynamic text.
+            out (np.ndarray, optional): BGR buffer of the figure's size to render into,
+                e.g. a shared memory slot. A new array is allocated if not given.
+
+        Returns:
+            np.ndarray: The frame as a BGR image.
+        """
+        shapes = [img.shape[:2] for img in images]
+        if self._base is None or shapes != self._image_shapes:
+            self._prepare(shapes)
+
+        if out is None:
+            frame = self._base.copy()
+        else:
+            frame = out
+            np.copyto(frame, self._base)
+
+        for img, (top, bottom, left, right) in zip(images, self._image_rects):
+            frame[top:bottom, left:right] = _resize_image(
+                img, right - left, bottom - top
+            )
+
+        if bar_heights is not None and self.bar_count:
+            self._draw_bars(frame, bar_heights, bar_colors)
+
+        if self._fg_index is not None:
+            fg_alpha, fg_bgr = self._fg_alpha, self._fg_bgr
+            frame[self._fg_index] = (
+                fg_bgr + frame[self._fg_index] * (1 - fg_alpha)
+            ).astype(np.uint8)
+
+        if text is not None and self.dynamic_text is not None:
+            self._draw_text(frame, text)
+
+        return frame
+
+    def _prepare(self, image_shapes: List[tuple]):
+        """
+        Lay out the figure for the given image shapes and rasterize the static layers.
+        """
+        fig = self.fig
+        width, height = fig.canvas.get_width_height()
+
+        # Draw once with placeholders so matplotlib settles the axes geometry
+        # (aspect-adjusted image axes, autoscaled bar axis).
+        placeholders = []
+        for ax, shape in zip(self.image_axes, image_shapes):
+            placeholders.append(ax.imshow(np.zeros(shape + (3,), dtype=np.uint8)))
+        bars = None
+        if self.bar_count:
+            bars = self.bar_axes.bar(range(self.bar_count), [0] * self.bar_count)
+        if self.dynamic_text is not None:
+            self.dynamic_text.set_visible(False)
+
+        fig.canvas.draw()
+
+        self._image_rects = []
+        for ax in self.image_axes:
+            self._image_rects.append(_pixel_rect(ax.get_window_extent(), height))
+            _freeze_axes(ax)
+
+        if bars is not None:
+            _freeze_axes(self.bar_axes)
+            trans = self.bar_axes.transData
+            bar_width = bars.patches[0].get_width()
+            lefts = [p.get_x() for p in bars.patches]
+            x0 = trans.transform([(x, 0) for x in lefts])[:, 0]
+            x1 = trans.transform([(x + bar_width, 0) for x in lefts])[:, 0]
+            self._bar_x = np.stack([np.round(x0), np.round(x1)], axis=1).astype(int)
+            y0, y1 = trans.transform([(0, 0), (0, 1)])[:, 1]
+            self._bar_y = (height - y0, height - y1)
+            bars.remove()
+
+        for placeholder in placeholders:
+            placeholder.remove()
+
+        foreground = [spine for ax in fig.get_axes() for spine in ax.spines.values()]
+        if self.bar_axes is not None:
+            foreground += list(self.bar_axes.texts)
+
+        # Base layer: everything except the foreground artists
+        for artist in foreground:
+            artist.set_visible(False)
+        base = _draw_rgba(fig)
+
+        # Foreground layer: only the foreground artists, on a transparent canvas
+        hidden = [fig.patch] + [ax.patch for ax in fig.get_axes()] + list(fig.texts)
+        visibility = [artist.get_visible() for artist in hidden]
+        for artist in hidden:
+            artist.set_visible(False)
+        for artist in foreground:
+            artist.set_visible(True)
+        fg = _draw_rgba(fig)
+        for artist, visible in zip(hidden, visibility):
+            artist.set_visible(visible)
+
+        if self.background is not None:
+            base = _composite(base, self.background)
+        self._base = cv2.cvtColor(base, cv2.COLOR_RGBA2BGR)
+
+        alpha = fg[:, :, 3]
+        if alpha.any():
+            self._fg_index = np.nonzero(alpha)
+            fg_alpha = (alpha[self._fg_index] / 255.0)[:, np.newaxis]
+            self._fg_alpha = fg_alpha
+            self._fg_bgr = fg[self._fg_index][:, 2::-1] * fg_alpha
+        else:
+            self._fg_index = None
+
+        if self.dynamic_text is not None:
+            x, y = self.dynamic_text.get_position()
+            self._text_xy = (x * width, height - y * height)
+
+        self._image_shapes = image_shapes
+
+    def _draw_bars(
+        self,
+        frame: np.ndarray,
+        bar_heights: Sequence[float],
+        bar_colors: Optional[Sequence[str]],
+    ):
+        y_bottom, y_top = self._bar_y
+        for (left, right), value, color in zip(
+            self._bar_x, bar_heights, bar_colors or ["C0"] * self.bar_count
+        ):
+            value = min(max(float(value), 0.0), 1.0)
+            top = int(round(y_bottom - (y_bottom - y_top) * value))
+            bottom = int(round(y_bottom))
+            if bottom > top:
+                frame[top:bottom, left:right] = _bgr(color)
+
+    def _draw_text(self, frame: np.ndarray, text: str):
+        x, y = self._text_xy
+        left, top, right, bottom = self._font.getbbox(text, anchor=self._text_anchor)
+        left = max(int(np.floor(x + left)), 0)
+        top = max(int(np.floor(y + top)), 0)
+        right = min(int(np.ceil(x + right)), frame.shape[1])
+        bottom = min(int(np.ceil(y + bottom)), frame.shape[0])
+        if right <= left or bottom <= top:
+            return
+
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text(
+            (x - left, y - top),
+            text,
+            font=self._font,
+            fill=255,
+            anchor=self._text_anchor,
+        )
+        alpha = (np.asarray(mask, dtype=np.float32) / 255.0)[:, :, np.newaxis]
+        region = frame[top:bottom, left:right]
+        region[:] = (self._text_color * alpha + region * (1 - alpha)).astype(np.uint8)
+
+
+def _draw_rgba(fig: Figure) -> np.ndarray:
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def _freeze_axes(ax: Axes):
+    """Pin position and limits so removing placeholder artists keeps the layout."""
+    ax.set_position(ax.get_position(original=False))
+    ax.set_xlim(ax.get_xlim())
+    ax.set_ylim(ax.get_ylim())
+    ax.set_aspect("auto")
+
+
+def _pixel_rect(bbox, height: int) -> tuple:
+    """Convert a display bbox (origin bottom left) to (top, bottom, left, right) rows/cols."""
+    return (
+        int(round(height - bbox.y1)),
+        int(round(height - bbox.y0)),
+        int(round(bbox.x0)),
+        int(round(bbox.x1)),
+    )
+
+
+def _resize_image(img: np.ndarray, width: int, height: int) -> np.ndarray:
+    img = _to_uint8(img)
+    scale = min(width / img.shape[1], height / img.shape[0])
+    if scale >= NEAREST_UPSAMPLE_FACTOR:
+        interpolation = cv2.INTER_NEAREST_EXACT
+    elif scale < 1:
+        interpolation = cv2.INTER_AREA
+    else:
+        interpolation = cv2.INTER_LINEAR
+    resized = cv2.resize(img, (width, height), interpolation=interpolation)
+    return cv2.cvtColor(resized, cv2.COLOR_RGB2BGR)
+
+
+def _to_uint8(img: np.ndarray) -> np.ndarray:
+    """
+    Convert an RGB image to uint8 the way imshow does: float images, such as the
+    Grad-CAM heatmap, are clipped to [0, 1] and scaled to [0, 255].
+    """
+    if img.dtype == np.uint8:
+        return img
+    if np.issubdtype(img.dtype, np.floating):
+        return (np.clip(img, 0, 1) * 255).astype(np.uint8)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def _composite(foreground: np.ndarray, background: np.ndarray) -> np.ndarray:
+    """Alpha-composite an RGBA foreground onto an RGBA background of the same size."""
+    alpha = foreground[:, :, 3:4] / 255.0
+    return (foreground * alpha + background * (1 - alpha)).astype(np.uint8)
+
+
+_color_cache = {}
+
+
+def _bgr(color: str) -> tuple:
+    if color not in _color_cache:
+        r, g, b = mcolors.to_rgb(color)
+        _color_cache[color] = (int(b * 255), int(g * 255), int(r * 255))
+    return _color_cache[color]
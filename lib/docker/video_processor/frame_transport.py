@@ -0,0 +1,227 @@
+import multiprocessing as mp
+import os
+import shutil
+from multiprocessing import shared_memory
+from typing import Iterator, Tuple
+
+import numpy as np
+
+SHM_PATH = "/dev/shm"
+
+
+class FrameRing:
+    """
+    A ring of raw frame slots in shared memory, shared between the rendering
+    workers and the process writing the video.
+
+    Frame `index` (1-based, as produced by the stream reader) lives in slot
+    `(index - 1) % slots`. A worker acquires the slot before rendering into it,
+    which blocks until the writer has released the frame that previously
+    occupied the slot, i.e. frame `index - slots`. This bounds the number of
+    frames in flight and means frames are never pickled or re-encoded between
+    the workers and the writer.
+
+    A worker must publish the frames it has rendered before blocking in
+    `acquire`, otherwise the writer may wait for a frame held back by a worker
+    that is itself waiting for the writer.
+    """
+
+    def __init__(self, slots: int, frame_shape: Tuple[int, ...]):
+        """
+        Args:
+            slots (int): Number of frame slots in the ring.
+            frame_shape (Tuple[int, ...]): Shape of a frame, e.g. (height, width, 3).
+        """
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=slots * int(np.prod(frame_shape))
+        )
+        self._owner_pid = os.getpid()
+        self._released = mp.Value("q", 0, lock=False)
+        self._condition = mp.Condition()
+        self._attach()
+
+    def _attach(self):
+        self._frames = np.ndarray(
+            (self.slots,) + self.frame_shape, dtype=np.uint8, buffer=self._shm.buf
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_frames"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def available(self, index: int) -> bool:
+        """
+        Whether the slot for frame `index` can be acquired without waiting.
+
+        Args:
+            index (int): The frame index.
+
+        Returns:
+            bool: True if the slot is free.
+        """
+        return self._released.value >= index - self.slots
+
+    def acquire(self, index: int) -> np.ndarray:
+        """
+        Wait until the slot for frame `index` is free and return it for writing.
+
+        Args:
+            index (int): The frame index.
+
+        Returns:
+            np.ndarray: A writable view on the slot.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.available(index))
+        return self.frame(index)
+
+    def frame(self, index: int) -> np.ndarray:
+        """
+        Return the slot for frame `index` without waiting.
+
+        Args:
+            index (int): The frame index.
+
+        Returns:
+            np.ndarray: A view on the slot.
+        """
+        return self._frames[(index - 1) % self.slots]
+
+    def release(self, index: int):
+        """
+        Mark all frames up to and including `index` as consumed, freeing their slots.
+
+        Args:
+            index (int): The frame index.
+        """
+        with self._condition:
+            self._released.value = index
+            self._condition.notify_all()
+
+    def reset(self):
+        """
+        Free all slots so frame indices can restart at 1, e.g. for the next bag.
+
+        Only safe once every frame acquired so far has been released.
+        """
+        self.release(0)
+
+    def close(self):
+        """Release the shared memory; the creating process also unlinks it."""
+        self._frames = None
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+
+
+def ring_slots(
+    frame_shape: Tuple[int, ...],
+    wanted: int,
+    shares: int = 1,
+    shm_fraction: float = 0.8,
+) -> int:
+    """
+    Number of ring slots to allocate, limited by the free space in /dev/shm.
+
+    Containers often run with a small /dev/shm (64 MB by default in Docker), so the
+    ring is shrunk to fit. Pages of a shared memory block are only counted as used
+    once they are written, so analyses running at the same time each size their
+    ring from their share of the budget instead of from all of the free space.
+
+    Args:
+        frame_shape (Tuple[int, ...]): Shape of a frame, e.g. (height, width, 3).
+        wanted (int): The preferred number of slots.
+        shares (int): Number of rings sharing /dev/shm, e.g. concurrent analyses.
+        shm_fraction (float): Fraction of the free shared memory all rings may use.
+
+    Returns:
+        int: The number of slots.
+
+    Raises:
+        RuntimeError: If not even a single frame fits in the budget.
+    """
+    slots = wanted
+    if os.path.isdir(SHM_PATH):
+        frame_size = int(np.prod(frame_shape))
+        free = shutil.disk_usage(SHM_PATH).free
+        budget = int(free * shm_fraction / max(1, shares))
+        slots = min(slots, budget // frame_size)
+        if slots < 1:
+            raise RuntimeError(
+                f"{SHM_PATH} has {free} bytes free, not enough for a {frame_size} byte "
+                f"frame per analysis ({shares} sharing it)"
+            )
+    return slots
+
+
+class ReorderBuffer:
+    """
+    A bounded buffer that releases results in frame index order.
+
+    Results may arrive in any order from the workers, but never further ahead
+    of the next expected index than the capacity; the frame ring guarantees this
+    when the capacity equals the number of ring slots.
+    """
+
+    def __init__(self, capacity: int, first_index: int = 1):
+        """
+        Args:
+            capacity (int): Maximum distance between the next expected index and
+                any buffered index.
+            first_index (int): The first index to release.
+        """
+        self.capacity = capacity
+        self.next_index = first_index
+        self._items = [None] * capacity
+        self._present = [False] * capacity
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def put(self, index: int, item):
+        """
+        Add the result for `index`.
+
+        Args:
+            index (int): The frame index.
+            item: The result for the frame, may be None.
+
+        Raises:
+            ValueError: If the index is outside the buffer window or already buffered.
+        """
+        if not self.next_index <= index < self.next_index + self.capacity:
+            raise ValueError(
+                f"Index {index} outside of reorder window starting at {self.next_index}"
+            )
+        pos = index % self.capacity
+        if self._present[pos]:
+            raise ValueError(f"Index {index} received twice")
+        self._items[pos] = item
+        self._present[pos] = True
+        self._count += 1
+
+    def pop_ready(self) -> Iterator[Tuple[int, object]]:
+        """
+        Release the buffered results that are next in order.
+
+        Yields:
+            Tuple[int, object]: The frame index and its result.
+        """
+        pos = self.next_index % self.capacity
+        while self._present[pos]:
+            item = self._items[pos]
+            self._items[pos] = None
+            self._present[pos] = False
+            self._count -= 1
+            index = self.next_index
+            self.next_index += 1
+            yield index, item
+            pos = self.next_index % self.capacity
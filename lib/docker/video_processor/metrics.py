@@ -0,0 +1,177 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Stages run by every rendering worker in parallel; all other stages run in a
+# single process (the stream reader or the video writer).
+WORKER_STAGES = ("deserialize", "inference_gradcam", "render")
+# Stages that do work on frames, as opposed to waiting for other stages.
+BUSY_STAGES = ("bag_read",) + WORKER_STAGES + ("encode_write",)
+
+
+class StageTimer:
+    """
+    Accumulates the time spent and the number of items processed per pipeline stage.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def measure(self, stage: str, count: int = 1):
+        """
+        Time the enclosed block and add it to the stage.
+
+        Args:
+            stage (str): Name of the stage.
+            count (int): Number of items processed in the block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, count)
+
+    def add(self, stage: str, seconds: float, count: int = 1):
+        """
+        Add time and items to the stage.
+
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): Time spent.
+            count (int): Number of items processed.
+        """
+        totals = self.stages.setdefault(stage, {"seconds": 0.0, "count": 0})
+        totals["seconds"] += seconds
+        totals["count"] += count
+
+    def elapsed(self) -> float:
+        """Seconds since the timer was created."""
+        return time.perf_counter() - self.start
+
+    def to_dict(self) -> Dict[str, dict]:
+        """The totals per stage, with seconds rounded to milliseconds."""
+        return {
+            stage: {"seconds": round(totals["seconds"], 3), "count": totals["count"]}
+            for stage, totals in self.stages.items()
+        }
+
+
+def merge_stages(stage_dicts: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """
+    Sum the per-stage totals of several timers.
+
+    Args:
+        stage_dicts (List[Dict[str, dict]]): Results of StageTimer.to_dict.
+
+    Returns:
+        Dict[str, dict]: The summed totals per stage.
+    """
+    merged = {}
+    for stages in stage_dicts:
+        for stage, totals in stages.items():
+            total = merged.setdefault(stage, {"seconds": 0.0, "count": 0})
+            total["seconds"] = round(total["seconds"] + totals["seconds"], 3)
+            total["count"] += totals["count"]
+    return merged
+
+
+def limiting_stage(stages: Dict[str, dict], worker_count: int) -> Optional[str]:
+    """
+    Find the stage that limits the throughput of the pipeline.
+
+    This is the busy stage with the most time spent per process running it, so
+    the time of the worker stages is divided by the number of workers.
+
+    Args:
+        stages (Dict[str, dict]): Totals per stage.
+        worker_count (int): Number of rendering workers.
+
+    Returns:
+        Optional[str]: Name of the stage, or None if no busy stage was recorded.
+    """
+    busy = {
+        stage: stages[stage]["seconds"]
+        / (max(worker_count, 1) if stage in WORKER_STAGES else 1)
+        for stage in BUSY_STAGES
+        if stage in stages
+    }
+    if not busy:
+        return None
+    return max(busy, key=busy.get)
+
+
+def metrics_file(video_file: str) -> str:
+    """
+    Path of the metrics file that belongs to a video file.
+
+    Args:
+        video_file (str): Path of the video file.
+
+    Returns:
+        str: Path of the JSON metrics file next to the video.
+    """
+    return os.path.splitext(video_file)[0] + ".metrics.json"
+
+
+def write_metrics(path: str, metrics: dict):
+    """
+    Write metrics to a JSON file.
+
+    Args:
+        path (str): Path of the metrics file.
+        metrics (dict): The metrics.
+    """
+    with open(path, "w") as f:
+        json.dump(metrics, f, indent=2)
+
+
+def read_metrics(path: str) -> Optional[dict]:
+    """
+    Read metrics from a JSON file.
+
+    Args:
+        path (str): Path of the metrics file.
+
+    Returns:
+        Optional[dict]: The metrics, or None if the file doesn't exist or is invalid.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(bag_metrics: List[dict], combine_seconds: float = 0.0) -> dict:
+    """
+    Summarize the metrics of the bags that make up a combined video.
+
+    Args:
+        bag_metrics (List[dict]): Metrics of the individual bag analyses.
+        combine_seconds (float): Time spent combining the videos.
+
+    Returns:
+        dict: Frames, processing time and throughput, the merged stage totals and
+        the limiting stage.
+    """
+    frames = sum(m["frames"] for m in bag_metrics)
+    processing_seconds = sum(m["processing_seconds"] for m in bag_metrics)
+    stages = merge_stages([m["stages"] for m in bag_metrics])
+    worker_count = max((m["worker_count"] for m in bag_metrics), default=1)
+
+    return {
+        "bags": len(bag_metrics),
+        "frames": frames,
+        "seconds": round(sum(m["seconds"] for m in bag_metrics), 3),
+        "processing_seconds": round(processing_seconds, 3),
+        "frames_per_second": (
+            round(frames / processing_seconds, 2) if processing_seconds else 0.0
+        ),
+        "combine_seconds": round(combine_seconds, 3),
+        "limiting_stage": limiting_stage(stages, worker_count),
+        "stages": stages,
+    }
@@ -3,17 +3,26 @@ import hashlib
 import json
 import logging
 import os
+import queue
 import random
+import signal
 import string
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import boto3
+import psutil
 from appsync_utils import send_mutation
 from aws_lambda_powertools.utilities.data_classes.appsync import scalar_types_utils
 from combine_videos import VideoGroupingMode, combine_videos, organize_videos
+from metrics import metrics_file, read_metrics, summarize, write_metrics
 
 TMP_DIR = "/tmp"
+DOWNLOAD_THREADS = 4
+BAG_TIMEOUT = 1800.0  # seconds
 
 log_level = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(
@@ -27,7 +36,7 @@ s3 = boto3.client("s3")
 
 def usage():
     logger.info(
-        "Usage: Set the following environment variables: MATCHED_BAGS, CODEC, FRAME_LIMIT, DESCRIBE, RELATIVE_LABELS, BACKGROUND, SKIP_DURATION"
+        "Usage: Set the following environment variables: MATCHED_BAGS, CODEC, FRAME_LIMIT, BATCH_SIZE, MAX_CONCURRENT_BAGS, DESCRIBE, RELATIVE_LABELS, BACKGROUND, SKIP_DURATION, BAG_TIMEOUT"
     )
     sys.exit(1)
 
@@ -70,6 +79,223 @@ def download_bag_from_s3(bag, s3_bucket, input_dir) -> str:
     return bag_dir
 
 
+class BagAnalysisService:
+    """
+    A long-lived `bag_analysis.py --serve` process that analyzes one bag at a time.
+
+    TensorFlow is imported, and the rendering workers are started, once per service
+    instead of once per bag. The workers keep the models they have loaded, so bags
+    of a model that was already used by the service start rendering right away.
+    The process is (re)started on demand, e.g. after it crashed or was killed
+    because a bag took longer than the timeout.
+    """
+
+    def __init__(self, analysis_args: list[str], timeout: float = BAG_TIMEOUT):
+        """
+        Args:
+            analysis_args (list[str]): Command-line arguments shared by all bags.
+            timeout (float): Seconds to wait for the analysis of a bag.
+        """
+        self.analysis_args = analysis_args
+        self.timeout = timeout
+        self._process = None
+        self._replies = None
+
+    def _start(self):
+        cmd = [
+            "python3",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "bag_analysis.py"),
+            "--serve",
+        ] + self.analysis_args
+        logger.info("Starting analysis service: %s", cmd)
+        # A session of its own, so the service can be killed with its workers
+        self._process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            start_new_session=True,
+        )
+        # Replies are read by a thread, so waiting for one can time out
+        self._replies = queue.Queue()
+        threading.Thread(
+            target=self._read_replies,
+            args=(self._process.stdout, self._replies),
+            daemon=True,
+        ).start()
+
+    @staticmethod
+    def _read_replies(stdout, replies: queue.Queue):
+        for line in stdout:
+            replies.put(line)
+        replies.put("")
+
+    def _kill(self):
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self._process.wait()
+        self._process = None
+
+    def analyze(self, bag_path: str, model_path: str, video_file: str) -> bool:
+        """
+        Analyze a bag and wait for its video.
+
+        Args:
+            bag_path (str): The local path of the bag.
+            model_path (str): The local path of the model.
+            video_file (str): The path of the video file to create.
+
+        Returns:
+            bool: True if the analysis succeeded.
+        """
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+        request = {
+            "bag_path": bag_path,
+            "model": model_path,
+            "output_file": video_file,
+        }
+        try:
+            self._process.stdin.write(json.dumps(request) + "\n")
+            self._process.stdin.flush()
+            reply = self._replies.get(timeout=self.timeout)
+        except BrokenPipeError:
+            reply = ""
+        except queue.Empty:
+            logger.error(
+                f"Analysis of {bag_path} did not finish within {self.timeout:.0f}s, killing the analysis service"
+            )
+            self._kill()
+            return False
+
+        if not reply:
+            logger.error(
+                f"Analysis service exited with code {self._process.wait()} while processing {bag_path}"
+            )
+            self._process = None
+            return False
+
+        reply = json.loads(reply)
+        if not reply["success"]:
+            logger.error(f"Error processing {bag_path}: {reply.get('error')}")
+        return reply["success"]
+
+    def close(self, timeout: float = 60.0):
+        """Stop the service once it has finished its current bag."""
+        if self._process is None:
+            return
+        self._process.stdin.close()
+        try:
+            self._process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._kill()
+        self._process = None
+
+
+def plan_concurrency(bag_count: int, max_concurrent_bags: int) -> tuple[int, int]:
+    """
+    Split the physical cores between bag analyses running at the same time.
+
+    A single bag analysis keeps its own default of 3/4 of the physical cores.
+    Concurrent analyses share all physical cores, as each of them spends part
+    of its time loading the model and reading or encoding with idle workers.
+
+    Args:
+        bag_count (int): Number of bags to process.
+        max_concurrent_bags (int): Maximum number of bags to analyze at once.
+
+    Returns:
+        tuple[int, int]: Number of concurrent analyses, and the number of workers
+        per analysis (0 to use the bag_analysis default).
+    """
+    physical_cores = psutil.cpu_count(logical=False) or 1
+    concurrency = max(1, min(bag_count, max_concurrent_bags, physical_cores))
+    if concurrency == 1:
+        return 1, 0
+    return concurrency, max(1, physical_cores // concurrency)
+
+
+def prefetch_downloads(
+    bags: list[dict],
+    pool: ThreadPoolExecutor,
+    models_bucket: str,
+    models_dir: str,
+    logs_bucket: str,
+    input_dir: str,
+) -> list[tuple[Future, Future]]:
+    """
+    Queue the model and bag downloads for all bags, in processing order.
+
+    Each model is downloaded once and shared by all bags with the same user and model id.
+
+    Returns:
+        list[tuple[Future, Future]]: Per bag, the futures of the model path and bag path.
+    """
+    model_futures = {}
+    downloads = []
+    for bag in bags:
+        model_key = (bag["sub"], bag["model"]["id"])
+        if model_key not in model_futures:
+            model_futures[model_key] = pool.submit(
+                download_model_from_s3, bag, models_bucket, models_dir
+            )
+        bag_future = pool.submit(download_bag_from_s3, bag, logs_bucket, input_dir)
+        downloads.append((model_futures[model_key], bag_future))
+    return downloads
+
+
+def run_bag_analysis(
+    bag: dict,
+    model_future: Future,
+    bag_future: Future,
+    output_dir: str,
+    services: queue.Queue,
+) -> str:
+    """
+    Wait for the downloads of a bag and its model, then render the bag's video
+    with the next free analysis service.
+
+    Returns:
+        str: The path of the video file, or None if the bag could not be processed.
+    """
+    try:
+        model_path = model_future.result()
+        bag_path = bag_future.result()
+    except Exception as e:
+        logger.error(f"Error downloading {bag['bag_key']}: {e}")
+        return None
+
+    bag["model"]["local_path"] = model_path
+    bag["bag_local_path"] = bag_path
+
+    video_file = os.path.join(
+        output_dir,
+        bag["sub"],
+        bag["model"]["id"],
+        "intermediate",
+        os.path.basename(bag_path) + ".mp4",
+    )
+
+    os.makedirs(os.path.dirname(video_file), exist_ok=True)
+
+    logger.info(f"Running analysis for {bag_path}")
+    service = services.get()
+    try:
+        success = service.analyze(bag_path, model_path, video_file)
+    finally:
+        services.put(service)
+
+    if success and os.path.isfile(video_file):
+        logger.info(f"Finished processing {bag_path}")
+        return video_file
+
+    logger.error(f"Error processing {bag_path}.")
+    return None
+
+
 def create_dynamodb_entries(
     video_list: list[dict],
     fetch_job_id: str,
@@ -106,6 +332,18 @@ def create_dynamodb_entries(
             "type": "VIDEO",
         }
 
+        processing_metrics = video["info"].get("processing_metrics")
+        if processing_metrics:
+            variables["processingMetrics"] = {
+                "bags": processing_metrics["bags"],
+                "frames": processing_metrics["frames"],
+                "processingSeconds": processing_metrics["processing_seconds"],
+                "framesPerSecond": processing_metrics["frames_per_second"],
+                "combineSeconds": processing_metrics["combine_seconds"],
+                "limitingStage": processing_metrics["limiting_stage"],
+                "metricsKey": processing_metrics["metrics_key"],
+            }
+
         logger.info(f"variables => {variables}")
 
         query = """
@@ -113,6 +351,7 @@ def create_dynamodb_entries(
             $assetId: ID!
             $assetMetaData: AssetMetadataInput
             $mediaMetaData: MediaMetadataInput
+            $processingMetrics: ProcessingMetricsInput
             $models: [CarLogsModelInput]
             $eventId: String
             $eventName: String
@@ -126,6 +365,7 @@ def create_dynamodb_entries(
             assetId: $assetId
             assetMetaData: $assetMetaData
             mediaMetaData: $mediaMetaData
+            processingMetrics: $processingMetrics
             models: $models
             eventId: $eventId
             eventName: $eventName
@@ -147,6 +387,15 @@ def create_dynamodb_entries(
                 fps
                 codec
             }
+            processingMetrics {
+                bags
+                frames
+                processingSeconds
+                framesPerSecond
+                combineSeconds
+                limitingStage
+                metricsKey
+            }
             models {
                 modelId
                 modelName
@@ -169,17 +418,21 @@ def main():
     """
     Main function to process bag files and generate videos.
     This function reads environment variables to get the input directory, output directory,
-    models directory, codec, frame limit, and other options. It then processes each bag file
-    in the input directory, runs analysis using the specified model, and generates videos.
+    models directory, codec, frame limit, and other options. It then downloads the bag files
+    and models ahead of time and runs the analysis of several bags concurrently, generating
+    a video per bag.
     Finally, it combines all the generated videos into a single output.
     Environment variables:
         MATCHED_BAGS (dict): A dictionary containing the matched bags.
         CODEC (str): The codec for the video writer (default: "avc1").
         FRAME_LIMIT (int): Max number of frames to process (default: None).
+        BATCH_SIZE (int): Number of frames each rendering worker takes at once (default: bag_analysis default).
+        MAX_CONCURRENT_BAGS (int): Maximum number of bags analyzed at the same time (default: 2).
         DESCRIBE (bool): Describe the actions (default: False).
         RELATIVE_LABELS (bool): Make labels relative, not fixed to value in action space (default: False).
         BACKGROUND (bool): Add a background to the video (default: True).
         SKIP_DURATION (float): Skip video files with duration less than the specified value (default: 20.0).
+        BAG_TIMEOUT (float): Seconds after which the analysis of a bag is killed and the bag skipped (default: 1800).
     Exits with status 1 if any of the required directories do not exist.
     """
 
@@ -203,10 +456,13 @@ def main():
     models_bucket = os.getenv("MODELS_BUCKET")
     codec = os.getenv("CODEC", "avc1")
     frame_limit = os.getenv("FRAME_LIMIT", None)
+    batch_size = os.getenv("BATCH_SIZE", None)
+    max_concurrent_bags = int(os.getenv("MAX_CONCURRENT_BAGS", 2))
     describe = os.getenv("DESCRIBE", "False").lower() == "true"
     relative_labels = os.getenv("RELATIVE_LABELS", "False").lower() == "true"
     background = os.getenv("BACKGROUND", "True").lower() == "true"
     skip_duration = float(os.getenv("SKIP_DURATION", 20.0))
+    bag_timeout = float(os.getenv("BAG_TIMEOUT", BAG_TIMEOUT))
     job_data_bucket = os.getenv("JOB_DATA_BUCKET")
     job_data_key = os.getenv("JOB_DATA_KEY")
 
@@ -229,6 +485,7 @@ def main():
     race_data = job_data.get("race_data")
 
     user_model_videos_map = []
+    bag_models = []
 
     background = os.path.join(
         script_dir,
@@ -295,60 +552,70 @@ def main():
             for model in current_user["models"]
             if model["modelId"] == bag["model"]["id"]
         )
+        bag_models.append(current_model)
 
-        # Download the model and bag files from S3
-        bag["model"]["local_path"] = download_model_from_s3(
-            bag, models_bucket, models_dir
-        )
-        bag["bag_local_path"] = download_bag_from_s3(bag, logs_bucket, input_dir)
-
-        bag_path = bag["bag_local_path"]
-        model_path = bag["model"]["local_path"]
-        video_file = os.path.join(
-            output_dir,
-            bag["sub"],
-            bag["model"]["id"],
-            "intermediate",
-            os.path.basename(bag_path) + ".mp4",
-        )
+    bags = matched_bags["bags"]
+    concurrency, worker_count = plan_concurrency(len(bags), max_concurrent_bags)
+    logger.info(
+        f"Processing {len(bags)} bags, {concurrency} at a time"
+        + (f" with {worker_count} workers each." if worker_count else ".")
+    )
 
-        os.makedirs(os.path.dirname(video_file), exist_ok=True)
-
-        logger.info(f"Running analysis for {bag_path}")
-        cmd = (
-            [
-                "python3",
-                os.path.join(script_dir, "bag_analysis.py"),
-                "--bag_path",
-                bag_path,
-                "--model",
-                model_path,
-                "--codec",
-                codec,
-                "--update_frequency",
-                "5",
-                "--output_file",
-                video_file,
-            ]
-            + (["--relative_labels"] if relative_labels else [])
-            + (["--background"] if image_assets["background"] else [])
-            + (["--frame_limit", frame_limit] if frame_limit else [])
-            + (["--describe"] if describe else [])
-        )
+    analysis_args = (
+        [
+            "--codec",
+            codec,
+            "--update_frequency",
+            "5",
+        ]
+        + (["--relative_labels"] if relative_labels else [])
+        + (["--background"] if image_assets["background"] else [])
+        + (["--frame_limit", frame_limit] if frame_limit else [])
+        + (["--batch_size", batch_size] if batch_size else [])
+        + (["--worker_count", str(worker_count)] if worker_count else [])
+        + (["--shm_shares", str(concurrency)] if concurrency > 1 else [])
+        + (["--describe"] if describe else [])
+    )
 
-        logger.info("Running command: %s", cmd)
-        result = subprocess.run(cmd)
-        exit_code = result.returncode
-        if exit_code == 0 and os.path.isfile(video_file):
-            logger.info(f"Finished processing {bag_path}")
-            current_model["videos"].append(
-                {
-                    "file": video_file,
-                    "timestamp": bag["timestamp"],
-                }
+    # One analysis service per concurrent bag, each keeps TensorFlow and the
+    # loaded models around for all bags it processes.
+    services = queue.Queue()
+    for _ in range(concurrency):
+        services.put(BagAnalysisService(analysis_args, bag_timeout))
+
+    # Downloads run ahead in their own pool, so the next bags are on disk by the
+    # time an analysis slot frees up.
+    with ThreadPoolExecutor(
+        max_workers=DOWNLOAD_THREADS
+    ) as download_pool, ThreadPoolExecutor(max_workers=concurrency) as analysis_pool:
+        downloads = prefetch_downloads(
+            bags, download_pool, models_bucket, models_dir, logs_bucket, input_dir
+        )
+        analyses = [
+            analysis_pool.submit(
+                run_bag_analysis,
+                bag,
+                model_future,
+                bag_future,
+                output_dir,
+                services,
             )
-        else:
-            logger.error(f"Error processing {bag_path}. Code {exit_code}")
+            for bag, (model_future, bag_future) in zip(bags, downloads)
+        ]
+
+        # Collect in the original bag order to keep the video order deterministic
+        for bag, current_model, analysis in zip(bags, bag_models, analyses):
+            video_file = analysis.result()
+            if video_file is not None:
+                current_model["videos"].append(
+                    {
+                        "file": video_file,
+                        "timestamp": bag["timestamp"],
+                    }
+                )
+
+    while not services.empty():
+        services.get().close()
 
     video_grouping_mode = VideoGroupingMode.USER_MODEL_DATE
     if race_data is not None and race_data.get("eventId") is not None:
@@ -373,6 +640,7 @@ def main():
         os.makedirs(final_output_dir, exist_ok=True)
         output_file = os.path.join(final_output_dir, video["output_file"])
 
+        combine_start = time.perf_counter()
         video_info = combine_videos(
             video["source_videos"],
             output_file,
@@ -389,6 +657,7 @@ def main():
                 "models": video["models"],
             },
         )
+        combine_seconds = time.perf_counter() - combine_start
         logger.info(f"Created video {output_file}.", video_info)
 
         s3_key = os.path.relpath(output_file, final_output_dir)
@@ -397,6 +666,26 @@ def main():
         s3.upload_file(output_file, logs_bucket, s3_key)
         video_info["s3_key"] = s3_key
 
+        # Processing metrics of all bags in the video, stored next to the video
+        bag_metrics = [
+            m
+            for m in (read_metrics(metrics_file(f)) for f in video["source_videos"])
+            if m is not None
+        ]
+        if bag_metrics:
+            processing_metrics = summarize(bag_metrics, combine_seconds)
+            metrics_path = metrics_file(output_file)
+            write_metrics(
+                metrics_path, {**processing_metrics, "bag_metrics": bag_metrics}
+            )
+            metrics_key = metrics_file(s3_key)
+            s3.upload_file(metrics_path, logs_bucket, metrics_key)
+            video_info["processing_metrics"] = {
+                **processing_metrics,
+                "metrics_key": metrics_key,
+            }
+            logger.info(f"Processing metrics: {processing_metrics}")
+
         video["info"] = video_info
 
     create_dynamodb_entries(
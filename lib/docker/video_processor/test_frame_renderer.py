@@ -0,0 +1,66 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+from matplotlib import pyplot as plt  # noqa: E402
+
+from frame_renderer import FrameRenderer  # noqa: E402
+
+
+def _figure():
+    fig, axes = plt.subplots(1, 2, figsize=(6.4, 3.6), dpi=100)
+    fig.patch.set_facecolor("black")
+    for ax in axes:
+        ax.set_xticks([])
+        ax.set_yticks([])
+    return fig, axes
+
+
+def _baseline(images):
+    """The frame as drawn by matplotlib, like create_img did before FrameRenderer."""
+    fig, axes = _figure()
+    for ax, img in zip(axes, images):
+        ax.imshow(img)
+    fig.canvas.draw()
+    frame = np.asarray(fig.canvas.buffer_rgba())
+    plt.close(fig)
+    return cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+
+
+def _images():
+    y, x = np.mgrid[0:120, 0:160]
+    img = np.stack([y * 2, x, 255 - x], axis=2).astype(np.uint8)
+    # Grad-CAM overlays are float heatmaps; include values outside [0, 1]
+    heatmap = np.stack([x / 160, y / 120, 1 - x / 160], axis=2) * 1.2 - 0.1
+    return img, heatmap.astype(np.float32)
+
+
+def test_float_overlay_matches_baseline():
+    images = list(_images())
+    fig, axes = _figure()
+    renderer = FrameRenderer(fig, axes)
+
+    frame = renderer.render(images)
+    expected = _baseline(images)
+
+    for top, bottom, left, right in renderer._image_rects:
+        diff = np.abs(
+            frame[top:bottom, left:right].astype(int)
+            - expected[top:bottom, left:right].astype(int)
+        )
+        assert diff.mean() < 2
+    plt.close(fig)
+
+
+def test_float_overlay_renders_like_its_uint8_equivalent():
+    img, heatmap = _images()
+    fig, axes = _figure()
+    renderer = FrameRenderer(fig, axes)
+
+    from_float = renderer.render([img, heatmap]).copy()
+    from_uint8 = renderer.render([img, (np.clip(heatmap, 0, 1) * 255).astype(np.uint8)])
+
+    assert np.array_equal(from_float, from_uint8)
+    plt.close(fig)
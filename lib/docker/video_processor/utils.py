@@ -2,7 +2,8 @@ import datetime
 import json
 import os
 import tarfile
-from typing import List, Tuple
+import time
+from typing import List, Optional, Tuple
 
 import cv2
 import rosbag2_py
@@ -137,6 +138,62 @@ def get_reader(bag_path: str, topics: List[str]) -> rosbag2_py.SequentialReader:
     return reader
 
 
+def read_bag_metadata(bag_path: str, topic: str) -> Optional[dict]:
+    """
+    Reads the message count and time range of a topic from the bag metadata,
+    without reading any messages.
+
+    Uses rosbag2_py.Info where available, which also covers bags whose
+    metadata.yaml is missing but whose storage has an index, and otherwise
+    parses metadata.yaml directly.
+
+    Args:
+        bag_path (str): The path to the bag directory.
+        topic (str): The topic to count messages for.
+
+    Returns:
+        Optional[dict]: A dictionary with 'message_count', 'starting_time' (Unix
+        timestamp) and 'duration' (seconds), or None if no metadata is available.
+    """
+    try:
+        info = rosbag2_py.Info().read_metadata(bag_path, "")
+        counts = {
+            t.topic_metadata.name: t.message_count
+            for t in info.topics_with_message_count
+        }
+        if topic in counts:
+            return {
+                "message_count": counts[topic],
+                "starting_time": info.starting_time.timestamp(),
+                "duration": info.duration.total_seconds(),
+            }
+    except Exception as e:
+        print(f"Could not read bag metadata through rosbag2_py: {e}")
+
+    metadata_path = os.path.join(bag_path, "metadata.yaml")
+    if not os.path.isfile(metadata_path):
+        return None
+
+    try:
+        import yaml
+
+        with open(metadata_path) as f:
+            info = yaml.safe_load(f)["rosbag2_bagfile_information"]
+
+        for t in info["topics_with_message_count"]:
+            if t["topic_metadata"]["name"] == topic:
+                return {
+                    "message_count": t["message_count"],
+                    "starting_time": info["starting_time"]["nanoseconds_since_epoch"]
+                    / 1e9,
+                    "duration": info["duration"]["nanoseconds"] / 1e9,
+                }
+    except Exception as e:
+        print(f"Could not read bag metadata from {metadata_path}: {e}")
+
+    return None
+
+
 def print_baginfo(bag_info: dict):
     """
     Prints detailed information about a bag file.
@@ -151,7 +208,7 @@ def print_baginfo(bag_info: dict):
             - 'action_space_size' (int): The size of the action space.
             - 'flip_x' (bool): Whether to flip the x-axis horizontally.
             - 'image_shape' (tuple): A tuple representing the shape of the input image (height, width, channels).
-            - 'total_frames' (int): The total number of messages/frames.
+            - 'total_frames' (int): The total number of messages/frames, None if unknown.
     """
 
     print(
@@ -179,14 +236,19 @@ def print_baginfo(bag_info: dict):
             bag_info["image_shape"][2],
         )
     )
-    print(
-        "Total messages: {}, expected duration: {:.1f}".format(
-            bag_info["total_frames"], bag_info["total_frames"] / bag_info["fps"]
+    if bag_info["total_frames"] is not None:
+        print(
+            "Total messages: {}, expected duration: {:.1f}".format(
+                bag_info["total_frames"], bag_info["total_frames"] / bag_info["fps"]
+            )
         )
-    )
+    else:
+        print("Total messages: unknown, no bag metadata available")
 
 
-def read_stream(data_queue, bag_path, topics, frame_limit):
+def read_stream(
+    data_queue, bag_path, topics, frame_limit, frames_read=None, timings=None
+):
     """
     Reads data from a bag file and puts it into a queue.
 
@@ -195,17 +257,35 @@ def read_stream(data_queue, bag_path, topics, frame_limit):
         bag_path (str): The path to the bag file.
         topics (list): The list of topics to read from the bag file.
         frame_limit (int): The maximum number of frames to read.
+        frames_read (multiprocessing.Value, optional): Set to the number of frames
+            read once the reader is done, so consumers know the total even when
+            the bag metadata is unavailable.
+        timings (multiprocessing.Array, optional): Two doubles, set to the seconds
+            spent reading from the bag and waiting for space in the queue once the
+            reader is done.
 
     Returns:
         None
     """
     s = 0
+    read_seconds = 0.0
+    put_seconds = 0.0
     reader = get_reader(bag_path, topics=topics)
 
     while reader.has_next() and s < frame_limit:
+        start = time.perf_counter()
         (_, data, _) = reader.read_next()
+        read = time.perf_counter()
         s += 1
         data_queue.put((s, data))
+        read_seconds += read - start
+        put_seconds += time.perf_counter() - read
+
+    if frames_read is not None:
+        frames_read.value = s
+    if timings is not None:
+        timings[0] = read_seconds
+        timings[1] = put_seconds
 
 
 def load_model_from_dir(model_dir: str) -> Tuple[ModelMetadata, bytes]:
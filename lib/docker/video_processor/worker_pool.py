@@ -0,0 +1,173 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing.connection import wait
+from typing import Callable, List, Tuple
+
+from frame_transport import FrameRing, ring_slots
+
+
+class WorkerPool:
+    """
+    Long-lived worker processes that render the frames of one bag after another.
+
+    Each worker runs `target(control_queue, data_queue, result_conn, frame_ring,
+    error_queue, batch_size)`. A session, i.e. one bag, starts by sending the
+    session configuration to the control queue of every worker. The workers then
+    read frames from the shared data queue until each of them has received a None
+    sentinel, send a summary of the session (a dict) through their result pipe and
+    wait for the next session. A None session stops a worker.
+
+    Keeping the workers alive between bags means the worker processes, and
+    whatever they cache such as loaded models, are set up once per pool instead
+    of once per bag.
+    """
+
+    def __init__(
+        self,
+        target: Callable,
+        worker_count: int,
+        batch_size: int,
+        frame_shape: Tuple[int, ...],
+        shm_shares: int = 1,
+    ):
+        """
+        Args:
+            target (Callable): The worker function.
+            worker_count (int): Number of worker processes.
+            batch_size (int): Maximum number of frames a worker processes at once.
+            frame_shape (Tuple[int, ...]): Shape of a rendered frame, e.g. (height, width, 3).
+            shm_shares (int): Number of pools sharing /dev/shm, see ring_slots().
+        """
+        # Rendered frames are exchanged as raw frames through shared memory
+        slots = ring_slots(
+            frame_shape,
+            wanted=2 * worker_count * batch_size,
+            shares=shm_shares,
+        )
+        self.frame_ring = FrameRing(slots, frame_shape)
+
+        # A worker blocks until it has a slot to render into, so workers beyond
+        # the number of slots would only wait for each other.
+        self.worker_count = min(worker_count, slots)
+        self.batch_size = batch_size
+        self.closed = False
+
+        # The data queue is bounded so the stream reader blocks instead of
+        # buffering the whole bag in memory.
+        self.data_queue = mp.Queue(maxsize=4 * self.worker_count * batch_size)
+        self.error_queue = mp.Queue()
+
+        self.workers = []
+        self.result_conns = []
+        self._control_queues = []
+        for _ in range(self.worker_count):
+            control_queue = mp.Queue()
+            result_recv, result_send = mp.Pipe(duplex=False)
+            p = mp.Process(
+                target=target,
+                args=(
+                    control_queue,
+                    self.data_queue,
+                    result_send,
+                    self.frame_ring,
+                    self.error_queue,
+                    batch_size,
+                ),
+            )
+            p.start()
+            result_send.close()
+            self.workers.append(p)
+            self.result_conns.append(result_recv)
+            self._control_queues.append(control_queue)
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the pool is open and all of its workers are alive."""
+        return not self.closed and all(p.is_alive() for p in self.workers)
+
+    def start_session(self, session: dict):
+        """
+        Start processing a new bag. The previous session must have ended.
+
+        Args:
+            session (dict): The session configuration sent to every worker.
+        """
+        self.frame_ring.reset()
+        try:
+            while True:
+                self.error_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        for control_queue in self._control_queues:
+            control_queue.put(session)
+
+    def end_session(self, timeout: float = 10.0) -> List[dict]:
+        """
+        Signal the workers that all frames of the current session are queued and
+        collect their session summaries. All frame results must have been received.
+
+        Args:
+            timeout (float): Seconds to wait for the summaries.
+
+        Returns:
+            List[dict]: The summaries of the workers that sent one in time.
+        """
+        for _ in self.workers:
+            self.data_queue.put(None)
+
+        summaries = []
+        pending = [
+            conn
+            for conn, p in zip(self.result_conns, self.workers)
+            if p.is_alive() and not conn.closed
+        ]
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for conn in wait(pending, timeout=remaining):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    pending.remove(conn)
+                    continue
+                if isinstance(message, dict):
+                    summaries.append(message)
+                    pending.remove(conn)
+        return summaries
+
+    def close(self, timeout: float = 5.0):
+        """
+        Stop the workers and release the shared resources.
+
+        Idle workers stop on their own; workers still busy with a session are
+        terminated after the timeout.
+
+        Args:
+            timeout (float): Seconds to wait for each worker to stop.
+        """
+        if self.closed:
+            return
+        self.closed = True
+
+        for control_queue in self._control_queues:
+            control_queue.put(None)
+
+        for p in self.workers:
+            p.join(timeout=timeout)
+            if p.is_alive():
+                p.terminate()
+                p.join(timeout=timeout)
+            if p.is_alive():
+                p.kill()
+                p.join()
+
+        for conn in self.result_conns:
+            conn.close()
+        for q in [self.data_queue, self.error_queue] + self._control_queues:
+            q.cancel_join_thread()
+            q.close()
+        self.frame_ring.close()
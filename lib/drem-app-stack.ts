@@ -188,6 +188,15 @@ export class DeepracerEventManagerStack extends cdk.Stack {
       carsHistoryTable: carManager.carsHistoryTable,
     });
 
+    const userManager = new UserManager(this, 'UserManager', {
+      authenticatedUserRole: authenticatedUserRole,
+      lambdaConfig: lambdaConfig,
+      userPoolArn: userPool.userPoolArn,
+      userPoolId: userPool.userPoolId,
+      appsyncApi: appsyncResources,
+      eventbus: eventbus,
+    });
+
     const leaderboard = new Leaderboard(this, 'Leaderboard', {
       logsBucket: logsBucket,
       appsyncApi: appsyncResources,
@@ -197,6 +206,7 @@ export class DeepracerEventManagerStack extends cdk.Stack {
       eventbus: eventbus,
       racerProfileObjectType: racerProfile.profileObjectType,
       racerProfileTable: racerProfile.table,
+      userCacheTable: userManager.userCacheTable,
     });
 
     const landingPage = new LandingPageManager(this, 'LandingPageManager', {
@@ -222,6 +232,7 @@ export class DeepracerEventManagerStack extends cdk.Stack {
       userPoolArn: userPool.userPoolArn,
       raceTable: raceManager.raceTable,
       eventsTable: eventsManager.eventsTable,
+      userCacheTable: userManager.userCacheTable,
     });
 
     new FleetsManager(this, 'FleetsManager', {
@@ -233,15 +244,6 @@ export class DeepracerEventManagerStack extends cdk.Stack {
 
     new SystemsManager(this, 'SystemManager');
 
-    new UserManager(this, 'UserManager', {
-      authenticatedUserRole: authenticatedUserRole,
-      lambdaConfig: lambdaConfig,
-      userPoolArn: userPool.userPoolArn,
-      userPoolId: userPool.userPoolId,
-      appsyncApi: appsyncResources,
-      eventbus: eventbus,
-    });
-
     new LabelPrinter(this, 'LabelPrinter', {
       lambdaConfig: lambdaConfig,
       logsbucket: logsBucket,
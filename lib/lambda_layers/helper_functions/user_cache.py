@@ -0,0 +1,214 @@
+"""
+Shared cache of Cognito users: sub -> username and countryCode.
+
+Cognito ListUsers is rate limited, and resolving racer names with one
+filtered ListUsers call per racer was the main source of throttling during
+events. Users are cached in a DynamoDB table (USER_CACHE_TABLE, partition key
+"sub", TTL attribute "expiresAt") that the users Lambdas fill when a user is
+created or confirmed, and in memory for the lifetime of the Lambda container.
+Subs missing from both are looked up in Cognito and written back.
+
+Racers change their own countryCode directly in Cognito, without going through
+a Lambda, so table entries expire after CACHE_TTL_SECONDS and changes are
+picked up within minutes. A deleted user is removed from the cache right away.
+
+Without USER_CACHE_TABLE only the in-memory tier is used.
+"""
+
+import os
+import time
+
+import boto3
+import dynamo_helpers
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+dynamodb = boto3.resource("dynamodb")
+cognito_client = boto3.client("cognito-idp")
+
+CACHE_TTL_SECONDS = 15 * 60
+MEMORY_TTL_SECONDS = 5 * 60
+BATCH_GET_SIZE = 100  # BatchGetItem limit
+# More misses than this are resolved with one paginated scan of the user pool
+# instead of one filtered ListUsers call per sub.
+FULL_SCAN_THRESHOLD = 60
+
+_memory = {}  # sub -> (expires, user)
+
+
+def get_users(user_pool_id: str, subs) -> dict:
+    """
+    Look up users by sub: in memory, then in the cache table, then in Cognito.
+
+    Args:
+        user_pool_id: Cognito user pool to look up missing users in
+        subs: The subs to look up
+    Returns:
+        dict of sub to {"username": ..., "countryCode": ...}; subs that are not
+        in the user pool are left out
+    """
+    now = time.time()
+    users = {}
+    missing = []
+    for sub in dict.fromkeys(subs):
+        cached = _memory.get(sub)
+        if cached and cached[0] > now:
+            users[sub] = cached[1]
+        else:
+            missing.append(sub)
+
+    if missing:
+        found = _get_from_table(missing, now)
+        _remember(found, now)
+        users.update(found)
+        missing = [sub for sub in missing if sub not in found]
+
+    if len(missing) > FULL_SCAN_THRESHOLD:
+        pool = load_user_pool(user_pool_id)
+        users.update({sub: pool[sub] for sub in missing if sub in pool})
+    elif missing:
+        found = {}
+        for sub in missing:
+            try:
+                response = cognito_client.list_users(
+                    UserPoolId=user_pool_id, Filter=f'sub = "{sub}"'
+                )
+            except Exception as e:
+                logger.warning(f"Cognito lookup failed for {sub}: {e}")
+                continue
+            if response["Users"]:
+                found[sub] = user_from_cognito(response["Users"][0])[1]
+        put_users(found)
+        users.update(found)
+
+    return users
+
+
+def get_user(user_pool_id: str, sub: str) -> dict | None:
+    """
+    Look up a single user by sub, see get_users.
+
+    Returns:
+        {"username": ..., "countryCode": ...} or None if not in the user pool
+    """
+    return get_users(user_pool_id, [sub]).get(sub)
+
+
+def load_user_pool(user_pool_id: str) -> dict:
+    """
+    Scan the whole user pool with paginated ListUsers calls and refresh the
+    cache with the result.
+
+    Returns:
+        dict of sub to {"username": ..., "countryCode": ...}
+    """
+    users = {}
+    paginator = cognito_client.get_paginator("list_users")
+    for page in paginator.paginate(
+        UserPoolId=user_pool_id, PaginationConfig={"PageSize": 60}
+    ):
+        for cognito_user in page.get("Users", []):
+            sub, user = user_from_cognito(cognito_user)
+            if sub:
+                users[sub] = user
+    put_users(users)
+    return users
+
+
+def put_user(sub: str, username: str, country_code: str | None) -> None:
+    """Add or refresh a user in the cache."""
+    put_users({sub: {"username": username, "countryCode": country_code or ""}})
+
+
+def put_users(users: dict) -> None:
+    """
+    Add or refresh users in the cache.
+
+    Args:
+        users: dict of sub to {"username": ..., "countryCode": ...}
+    """
+    if not users:
+        return
+    now = time.time()
+    _remember(users, now)
+    table = _table()
+    if table is None:
+        return
+    expires_at = int(now + CACHE_TTL_SECONDS)
+    try:
+        with table.batch_writer(overwrite_by_pkeys=["sub"]) as batch:
+            for sub, user in users.items():
+                batch.put_item(
+                    Item={
+                        "sub": sub,
+                        "username": user["username"],
+                        "countryCode": user["countryCode"],
+                        "expiresAt": expires_at,
+                    }
+                )
+    except Exception as e:
+        logger.warning(f"User cache update failed: {e}")
+
+
+def remove_user(sub: str) -> None:
+    """Drop a user from the cache, e.g. after it was deleted from Cognito."""
+    _memory.pop(sub, None)
+    table = _table()
+    if table is None:
+        return
+    try:
+        table.delete_item(Key={"sub": sub})
+    except Exception as e:
+        logger.warning(f"User cache delete failed for {sub}: {e}")
+
+
+def user_from_cognito(cognito_user: dict) -> tuple[str, dict]:
+    """
+    Extract sub, username and countryCode from a Cognito user as returned by
+    ListUsers (Attributes) or AdminGetUser (UserAttributes).
+
+    Returns:
+        Tuple of the sub ("" if missing) and {"username": ..., "countryCode": ...}
+    """
+    sub = ""
+    country_code = ""
+    attributes = cognito_user.get("Attributes") or cognito_user.get("UserAttributes")
+    for attribute in attributes or []:
+        if attribute["Name"] == "sub":
+            sub = attribute["Value"]
+        elif attribute["Name"] == "custom:countryCode":
+            country_code = attribute["Value"]
+    return sub, {"username": cognito_user["Username"], "countryCode": country_code}
+
+
+def _table():
+    table_name = os.environ.get("USER_CACHE_TABLE")
+    return dynamodb.Table(table_name) if table_name else None
+
+
+def _remember(users: dict, now: float) -> None:
+    expires = now + MEMORY_TTL_SECONDS
+    for sub, user in users.items():
+        _memory[sub] = (expires, user)
+
+
+def _get_from_table(subs: list, now: float) -> dict:
+    table = _table()
+    if table is None:
+        return {}
+    users = {}
+    for i in range(0, len(subs), BATCH_GET_SIZE):
+        keys = [{"sub": sub} for sub in subs[i : i + BATCH_GET_SIZE]]
+        try:
+            response = dynamo_helpers.batch_get_items({table.name: {"Keys": keys}})
+        except Exception as e:
+            logger.warning(f"User cache lookup failed: {e}")
+            return users
+        for item in response[table.name]:
+            # TTL deletion is lazy, so expired items may still be returned
+            if item.get("expiresAt", 0) > now:
+                users[item["sub"]] = {
+                    "username": item["username"],
+                    "countryCode": item.get("countryCode") or "",
+                }
+    return users
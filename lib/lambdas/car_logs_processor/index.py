@@ -3,6 +3,7 @@ import io
 import os
 import re
 import tarfile
+from typing import Callable
 
 import appsync_helpers
 import boto3
@@ -11,21 +12,28 @@ import yaml
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.data_classes.appsync import scalar_types_utils
 from aws_lambda_powertools.utilities.typing import LambdaContext
+from boto3.s3.transfer import TransferConfig
 
 logger = Logger()
 s3_client = boto3.client("s3")
 
-EXTRACTED_DIR = "/tmp/extracted"
+# Bag files are piped from the tar stream into multipart uploads; memory use is
+# bounded by chunk size * concurrency instead of by the size of the tar file.
+UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+)
+DELETE_BATCH_SIZE = 1000
+
+# Models per user sub, filled by query_user_models and cleared per processed file
+user_models_cache = {}
 
 
 @logger.inject_lambda_context
 def lambda_handler(event: dict, context: LambdaContext) -> str:
     logger.info(json.dumps(event))
 
-    # Create a temporary directory for extraction
-    if not os.path.exists(EXTRACTED_DIR):
-        os.makedirs(EXTRACTED_DIR)
-
     # The output bucket for the processed files
     input_bucket = os.environ["BAGS_UPLOAD_BUCKET"]
     output_bucket = os.environ["OUTPUT_BUCKET"]
@@ -80,6 +88,7 @@ def process_bag_files(
 ) -> tuple[dict, str]:
 
     logger.info(f"Processing file {key} from bucket {input_bucket}")
+    user_models_cache.clear()
 
     # Extract filename from key and strip .tar.gz
     batch_name = key.split("/")[-1].replace(".tar.gz", "")
@@ -109,70 +118,36 @@ def process_bag_files(
         # Get the list of users from AppSync
         all_users = query_users()
         logger.info(f"Input user list: {all_users}")
+        user_index = UsernameIndex(all_users)
 
-    # Iterate over the tar.gz files and process them
-    try:
-        extracted_dirs = download_and_extract_tar(input_bucket, key, EXTRACTED_DIR)
-
-        for bag_dir in extracted_dirs:
-
-            if race_data:
-                user_model_info = confirm_user_and_model(race_user, bag_dir)
-            else:
-                user_model_info = find_user_and_model(all_users.copy(), bag_dir)
+    def match_bag(bag_dir: str) -> dict:
+        if race_data:
+            user_model_info = confirm_user_and_model(race_user, bag_dir)
+        else:
+            user_model_info = find_user_and_model(user_index, bag_dir)
 
-            if user_model_info:
-                logger.info(
-                    "Found user and model match: {} {}".format(
-                        user_model_info["username"],
-                        user_model_info["model"]["name"],
-                    )
+        if user_model_info:
+            logger.info(
+                "Found user and model match: {} {}".format(
+                    user_model_info["username"],
+                    user_model_info["model"]["name"],
                 )
+            )
+        else:
+            logger.warning(f"Could not find user/model match for {bag_dir}")
+        return user_model_info
 
-                # Upload the bag into the user's log and video directory
-                bag_key = f"private/{user_model_info['sub']}/logs/{bag_dir}"
-
-                bag_type = "UNKNOWN"
-                with open(
-                    os.path.join(EXTRACTED_DIR, bag_dir, "metadata.yaml"), "r"
-                ) as yaml_file:
-                    metadata = yaml.safe_load(yaml_file)
-                    bag_type_raw = metadata.get("rosbag2_bagfile_information", {}).get(
-                        "storage_identifier", "unknown"
-                    )
-                    if bag_type_raw == "sqlite3":
-                        bag_type = "BAG_SQLITE"
-                    elif bag_type_raw == "mcap":
-                        bag_type = "BAG_MCAP"
-
-                for root, _, files in os.walk(os.path.join(EXTRACTED_DIR, bag_dir)):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        s3_key = os.path.join(
-                            bag_key,
-                            os.path.relpath(
-                                file_path, os.path.join(EXTRACTED_DIR, bag_dir)
-                            ),
-                        )
-                        s3_client.upload_file(file_path, output_bucket, s3_key)
-                        logger.debug(
-                            f"Uploaded {file_path} to s3://{output_bucket}/{s3_key}"
-                        )
-                user_model_info["bag_key"] = bag_key
-                user_model_info["bag_type"] = bag_type
-                matched_bags["bags"].append(user_model_info)
-            else:
-                logger.warning(f"Could not find user/model match for {bag_dir}")
-
+    # Stream the bags in the tar.gz file into the users' log directories
+    try:
+        matched_bags["bags"] = stream_bags_to_s3(
+            input_bucket, key, output_bucket, match_bag
+        )
         logger.info(f"Matched bags: {matched_bags}")
 
     except Exception as e:
         logger.error(f"Error processing tar.gz file: {str(e)}")
         raise
 
-    finally:
-        clean_directory(EXTRACTED_DIR)
-
     # Create a batch job for the matched bags
     job_queue = os.environ["JOB_QUEUE"]
     job_definition = os.environ["JOB_DEFINITION"]
@@ -317,7 +292,7 @@ def confirm_user_and_model(user: dict, bag_dir: str) -> dict:
     bag_timestamp = match.group(2)  # YYYYMMDD-HHMMSS
 
     # Normalize username (remove non-allowed characters)
-    normalized_username = re.sub("[^0-9a-zA-Z-]+", "", user["username"])
+    normalized_username = normalize_username(user["username"])
 
     # Check if the bag directory starts with the normalized username
     if not prefix.startswith(f"{normalized_username}-"):
@@ -354,7 +329,63 @@ def confirm_user_and_model(user: dict, bag_dir: str) -> dict:
     return matched_model
 
 
-def find_user_and_model(all_users: list[dict], bag_dir: str) -> dict:
+def normalize_username(username: str) -> str:
+    """
+    Strip the characters that can't appear in a bag directory name from a username
+    """
+    return re.sub("[^0-9a-zA-Z-]+", "", username)
+
+
+class UsernameIndex:
+    """
+    Trie of the normalized usernames, with one level per hyphen-separated segment
+
+    Built once per processed file, so matching a bag directory name costs one
+    lookup per segment of the name instead of a pass over all users per segment.
+    """
+
+    class Node:
+        __slots__ = ("children", "users")
+
+        def __init__(self):
+            self.children = {}
+            self.users = []
+
+    def __init__(self, users: list[dict]):
+        """
+        Args:
+            users: List of dictionaries containing user information
+        """
+        self._root = UsernameIndex.Node()
+        for user in users:
+            normalized_username = normalize_username(user["username"])
+            node = self._root
+            for segment in normalized_username.split("-"):
+                node = node.children.setdefault(segment, UsernameIndex.Node())
+            node.users.append((user, normalized_username))
+
+    def match(self, segments: list[str]) -> tuple[int, list[tuple[dict, str]]]:
+        """
+        Find the shortest leading segments that form a normalized username,
+        leaving at least one segment for the model name
+        Args:
+            segments: The hyphen-separated segments of a bag directory name
+        Returns:
+            Tuple of the number of segments matched and the matching users with
+            their normalized username; more than one user means the match is
+            ambiguous. (0, []) if no username matches.
+        """
+        node = self._root
+        for count, segment in enumerate(segments[:-1], start=1):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.users:
+                return count, node.users
+        return 0, []
+
+
+def find_user_and_model(user_index: UsernameIndex, bag_dir: str) -> dict:
     """
     Find the user and model from the bag directory name
     Expected format: <username>-<modelname>-YYYYMMDD-HHMMSS
@@ -362,7 +393,7 @@ def find_user_and_model(all_users: list[dict], bag_dir: str) -> dict:
     If username contains underscore (_) it is stripped during comparison!
 
     Args:
-        all_users: List of dictionaries containing user information
+        user_index: Index of the normalized usernames of all users
         bag_dir: Name of the bag directory
     Returns:
         Dictionary containing user and model information, or None if not found
@@ -385,44 +416,22 @@ def find_user_and_model(all_users: list[dict], bag_dir: str) -> dict:
     # Validate bag directory format
     prefix_split = prefix.split("-")
 
-    # Search for unique username match
-    candidate_user_model = []
-
-    # Try every possible segment division, leaving at least one segment for the model name
-    for segment in range(1, len(prefix_split)):
-        user_prefix = "-".join(prefix_split[:segment])
-        logger.info(f"Checking for user prefix: {user_prefix}")
-
-        matching_users = []
-        remaining_users = []
-
-        # Pre-normalize usernames and create a more efficient lookup structure
-        for user in all_users:
-            username = user["username"]
-            normalized_username = re.sub("[^0-9a-zA-Z-]+", "", username)
-
-            # Store both original user and normalized username
-            if normalized_username == user_prefix:
-                # We have a match - the username exactly matches our prefix
-                model_name = "-".join(prefix_split[segment:])
-                matching_users.append((user, normalized_username, {"name": model_name}))
-            elif normalized_username.startswith(user_prefix):
-                # Keep users that might match a longer prefix
-                remaining_users.append(user)
-
-        # Replace all_users with the filtered list for next iteration
-        all_users = remaining_users
-
-        if matching_users:
-            candidate_user_model.extend(matching_users)
-            logger.info(
-                {
-                    "message": "Found candidate matches",
-                    "bag_dir": bag_dir,
-                    "matches": [u[0]["username"] for u in matching_users],
-                }
-            )
-            break
+    # Search for the shortest username prefix, leaving the rest for the model name
+    segment, matching_users = user_index.match(prefix_split)
+    model_name = "-".join(prefix_split[segment:])
+    candidate_user_model = [
+        (user, normalized_username, {"name": model_name})
+        for user, normalized_username in matching_users
+    ]
+
+    if candidate_user_model:
+        logger.info(
+            {
+                "message": "Found candidate matches",
+                "bag_dir": bag_dir,
+                "matches": [u[0]["username"] for u in candidate_user_model],
+            }
+        )
 
     if not candidate_user_model:
         logger.warning(f"Could not find user / model match for {bag_dir}")
@@ -464,7 +473,7 @@ def find_user_and_model(all_users: list[dict], bag_dir: str) -> dict:
 
 def query_model(sub: str, model_name: str) -> dict:
     """
-    Query AppSync to check if a model exists
+    Look up a model of a user in the models fetched by query_user_models
 
     Args:
         sub: Unique identifier of the user
@@ -474,6 +483,26 @@ def query_model(sub: str, model_name: str) -> dict:
     Raises:
         Exception if error occurs
     """
+    model_data = query_user_models(sub).get(model_name)
+    return dict(model_data) if model_data else None
+
+
+def query_user_models(sub: str) -> dict[str, dict]:
+    """
+    Query AppSync for all models of a user, once per user and invocation
+
+    The result is kept in user_models_cache, so matching any number of bags
+    of a user costs a single getAllModels query.
+
+    Args:
+        sub: Unique identifier of the user
+    Returns:
+        dict of model name to model details
+    Raises:
+        Exception if error occurs
+    """
+    if sub in user_models_cache:
+        return user_models_cache[sub]
 
     query = """
     query getAllModels($user_sub: String!) {
@@ -491,24 +520,28 @@ def query_model(sub: str, model_name: str) -> dict:
     """
 
     try:
-        model_data = {}
+        models = {}
 
         response = appsync_helpers.run_query(query, {"user_sub": sub})
 
         if response.get("data", {}).get("getAllModels"):
             for model in response["data"]["getAllModels"]["models"]:
-                if model["modelname"] == model_name:
-                    model_data["id"] = model["modelId"]
-                    model_data["name"] = model["modelname"]
-                    model_data["key"] = model["fileMetaData"]["key"]
-                    model_data["filename"] = model["fileMetaData"]["filename"]
-                    return model_data
-            return None
-        else:
-            return None
+                # Keep the first model if names are duplicated
+                models.setdefault(
+                    model["modelname"],
+                    {
+                        "id": model["modelId"],
+                        "name": model["modelname"],
+                        "key": model["fileMetaData"]["key"],
+                        "filename": model["fileMetaData"]["filename"],
+                    },
+                )
+
+        user_models_cache[sub] = models
+        return models
 
     except Exception as e:
-        logger.error(f"Error querying for users: {str(e)}")
+        logger.error(f"Error querying for models: {str(e)}")
         raise
 
 
@@ -606,54 +639,143 @@ def get_car_id(car_name: str) -> tuple[str, bool]:
         raise
 
 
-def download_and_extract_tar(bucket: str, key: str, tmp_dir: str) -> list[str]:
+class StreamReader:
+    """
+    Read-only wrapper around a file object from a streamed tar file.
+
+    Only exposes read(), so boto3 uploads it as a non-seekable stream in
+    multipart chunks instead of trying to seek in it.
+    """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def read(self, size: int = -1) -> bytes:
+        return self._fileobj.read(size)
 
-    try:
 
-        # Download the tar.gz file into memory
+def get_bag_type(metadata_yaml: bytes) -> str:
+    """
+    Get the bag type from the contents of a bag's metadata.yaml
+    Args:
+        metadata_yaml: Contents of the metadata.yaml file
+    Returns:
+        BAG_SQLITE, BAG_MCAP or UNKNOWN
+    """
+    metadata = yaml.safe_load(metadata_yaml) or {}
+    bag_type_raw = metadata.get("rosbag2_bagfile_information", {}).get(
+        "storage_identifier", "unknown"
+    )
+    if bag_type_raw == "sqlite3":
+        return "BAG_SQLITE"
+    elif bag_type_raw == "mcap":
+        return "BAG_MCAP"
+    return "UNKNOWN"
+
+
+def stream_bags_to_s3(
+    bucket: str,
+    key: str,
+    output_bucket: str,
+    match_bag: Callable[[str], dict],
+) -> list[dict]:
+    """
+    Stream the bags in a tar.gz file from S3 into the users' log directories
+    without downloading or extracting the file to local storage.
+    Each top-level directory in the tar file is a bag; it is matched to a user
+    and model once, when its first file arrives. The files of matched bags are
+    uploaded while the tar file is read, files of unmatched bags are skipped.
+    If anything fails, the files uploaded so far are deleted again.
+    Args:
+        bucket: Bucket of the tar.gz file
+        key: Key of the tar.gz file
+        output_bucket: Bucket to upload the bag files to
+        match_bag: Returns the user and model information for a bag directory,
+            or None if the bag doesn't match
+    Returns:
+        List of user and model information of the matched bags, with the bag's
+        key and type added
+    Raises:
+        ValueError if the tar file contains unsafe paths
+    """
+
+    bags = {}
+    matched_bags = []
+    uploaded_keys = []
+
+    try:
         tar_obj = s3_client.get_object(Bucket=bucket, Key=key)
-        buffer = io.BytesIO(tar_obj["Body"].read())
 
-        # Extract the tar.gz file
-        with tarfile.open(fileobj=buffer, mode="r:gz") as tar:
-            # Check for path traversal attempts
-            for member in tar.getmembers():
+        # Read the tar.gz file as a stream, one member at a time
+        with tarfile.open(fileobj=tar_obj["Body"], mode="r|gz") as tar:
+            for member in tar:
+                # Check for path traversal attempts
                 if member.name.startswith("/") or ".." in member.name:
                     logger.error(f"Potentially malicious path in tar: {member.name}")
                     raise ValueError("Potentially malicious tar file detected")
-                # Additional security check for absolute paths
-                member_path = os.path.join(tmp_dir, member.name)
-                if not os.path.abspath(member_path).startswith(
-                    os.path.abspath(tmp_dir)
-                ):
-                    logger.error(f"Path traversal attempt detected: {member.name}")
-                    raise ValueError("Path traversal attempt detected")
 
-            # Safe to extract
-            tar.extractall(tmp_dir)
+                path = os.path.normpath(member.name).split(os.sep)
+                if not member.isfile() or len(path) < 2:
+                    continue
 
-            # Process the extracted files here
-            extracted_files = os.listdir(tmp_dir)
-            logger.debug(f"Extracted files: {extracted_files}")
+                bag_dir = path[0]
+                if bag_dir not in bags:
+                    user_model_info = match_bag(bag_dir)
+                    if user_model_info:
+                        user_model_info["bag_key"] = (
+                            f"private/{user_model_info['sub']}/logs/{bag_dir}"
+                        )
+                        user_model_info["bag_type"] = "UNKNOWN"
+                        matched_bags.append(user_model_info)
+                    bags[bag_dir] = user_model_info
+
+                user_model_info = bags[bag_dir]
+                if not user_model_info:
+                    continue
+
+                fileobj = tar.extractfile(member)
+                if path[1:] == ["metadata.yaml"]:
+                    metadata_yaml = fileobj.read()
+                    user_model_info["bag_type"] = get_bag_type(metadata_yaml)
+                    fileobj = io.BytesIO(metadata_yaml)
+                else:
+                    fileobj = StreamReader(fileobj)
+
+                # Upload the file into the user's log and video directory
+                s3_key = "/".join([user_model_info["bag_key"]] + path[1:])
+                s3_client.upload_fileobj(
+                    fileobj, output_bucket, s3_key, Config=UPLOAD_CONFIG
+                )
+                uploaded_keys.append(s3_key)
+                logger.debug(f"Uploaded {member.name} to s3://{output_bucket}/{s3_key}")
 
-            logger.info(f"Successfully extracted files to {tmp_dir}")
-            return extracted_files
+        logger.info(f"Uploaded {len(uploaded_keys)} files from {len(bags)} bags")
+        return matched_bags
 
     except tarfile.ReadError as e:
         logger.error(f"Error reading tar file: {str(e)}")
+        delete_objects(output_bucket, uploaded_keys)
         raise
 
     except Exception as e:
-        logger.error(f"Error extracting tar file: {str(e)}")
+        logger.error(f"Error streaming tar file: {str(e)}")
+        delete_objects(output_bucket, uploaded_keys)
         raise
 
 
-def clean_directory(tmp_dir: str) -> None:
+def delete_objects(bucket: str, keys: list[str]) -> None:
     """
-    Clean up the temporary directory.
+    Delete objects, logging instead of raising errors.
+    Args:
+        bucket: Bucket of the objects
+        keys: Keys of the objects to delete
     """
-    for root, dirs, files in os.walk(tmp_dir, topdown=False):
-        for name in files:
-            os.remove(os.path.join(root, name))
-        for name in dirs:
-            os.rmdir(os.path.join(root, name))
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i : i + DELETE_BATCH_SIZE]
+        try:
+            s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+            )
+        except Exception as e:
+            logger.error(f"Error deleting uploaded files: {str(e)}")
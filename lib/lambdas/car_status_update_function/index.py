@@ -1,6 +1,8 @@
+import hashlib
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 
 import boto3
@@ -15,8 +17,18 @@ client_lambda = boto3.client("lambda")
 _ddb = boto3.resource("dynamodb")
 
 CARS_HISTORY_TABLE = os.environ.get("CARS_HISTORY_TABLE", "")
+CARS_TABLE = os.environ.get("CARS_TABLE", "")
 REGISTER_CAR_SERIAL_FUNCTION = os.environ.get("REGISTER_CAR_SERIAL_FUNCTION", "")
 SERIAL_BACKOFF = timedelta(hours=1)
+ENRICH_CONCURRENCY = 10
+HISTORY_LAST_SEEN_INTERVAL = timedelta(minutes=15)
+# Unchanged cars are still sent when their stored LastPingDateTime is this old
+PING_REFRESH_INTERVAL = timedelta(minutes=15)
+FINGERPRINT_FIELD = "StatusFingerprint"
+BATCH_GET_SIZE = 100  # BatchGetItem limit
+
+# managedInstanceId -> (CarsHistory fields, time) of the last upsert by this container
+_history_written = {}
 
 
 def derive_serial_status(instance: dict) -> str:
@@ -55,27 +67,19 @@ def lambda_handler(event: dict, context: LambdaContext):
         )
         instances = event["Instances"]["InstanceInformationList"]
 
+        # Skip any update if LastPingDateTime is more than 90 days in the past
+        instances = [instance for instance in instances if not stale(instance)]
+        enrich_errors = enrich_online_instances(
+            [instance for instance in instances if instance["PingStatus"] == "Online"]
+        )
+
         update_instance_data = []
         for instance in instances:
             try:
-                # Skip any update if LastPingDateTime is more than 90 days in the past
-                if "LastPingDateTime" in instance:
-                    last_ping = datetime.strptime(
-                        instance["LastPingDateTime"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                    )
-                    if datetime.utcnow() - last_ping > timedelta(days=90):
-                        logger.info(
-                            f"Instance {instance['InstanceId']} last pinged more than 90 days ago, skipping."
-                        )
-                        continue
+                if instance["InstanceId"] in enrich_errors:
+                    raise enrich_errors[instance["InstanceId"]]
 
                 if instance["PingStatus"] == "Online":
-                    # Get core version info and check logging capability
-                    fetch_deepracer_core_version_and_check_logging(instance)
-
-                    # Get and process tags
-                    fetch_and_process_tags(instance)
-
                     now = datetime.now(timezone.utc)
                     instance["ChassisSerialStatus"] = derive_serial_status(instance)
                     if instance.get("ChassisSerial"):
@@ -104,8 +108,13 @@ def lambda_handler(event: dict, context: LambdaContext):
                         f"Error cleaning instance {instance['InstanceId']}: {clean_error}"
                     )
 
-        logger.info(update_instance_data)
-        send_status_update(update_instance_data)
+        changed_instance_data = changed_instances(update_instance_data)
+        logger.info(
+            f"{len(changed_instance_data)} of {len(update_instance_data)} instances changed"
+        )
+        logger.info(changed_instance_data)
+        if changed_instance_data:
+            send_status_update(changed_instance_data)
 
         if "NextToken" in event["Instances"]:
             result = {"result": "success", "NextToken": event["Instances"]["NextToken"]}
@@ -122,6 +131,57 @@ def lambda_handler(event: dict, context: LambdaContext):
     return result
 
 
+def stale(instance: dict) -> bool:
+    """Whether the instance last pinged more than 90 days ago."""
+    if "LastPingDateTime" not in instance:
+        return False
+    try:
+        last_ping = datetime.strptime(
+            instance["LastPingDateTime"], "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid LastPingDateTime for {instance['InstanceId']}: {e}")
+        return False
+    if datetime.utcnow() - last_ping > timedelta(days=90):
+        logger.info(
+            f"Instance {instance['InstanceId']} last pinged more than 90 days ago, skipping."
+        )
+        return True
+    return False
+
+
+def enrich_online_instances(instances: list) -> dict:
+    """
+    Add the DeepRacer core version, logging capability and tags to the online
+    instances, fetching them for several instances at a time.
+
+    Returns:
+        dict of InstanceId to the exception raised while enriching it
+    """
+
+    def enrich(instance):
+        # Get core version info and check logging capability
+        fetch_deepracer_core_version_and_check_logging(instance)
+        # Get and process tags
+        fetch_and_process_tags(instance)
+
+    errors = {}
+    if not instances:
+        return errors
+    with ThreadPoolExecutor(
+        max_workers=min(ENRICH_CONCURRENCY, len(instances))
+    ) as executor:
+        futures = {
+            instance["InstanceId"]: executor.submit(enrich, instance)
+            for instance in instances
+        }
+        for instance_id, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                errors[instance_id] = error
+    return errors
+
+
 def fetch_deepracer_core_version_and_check_logging(instance):
     """Fetch DeepRacer core version from SSM inventory and check logging capability."""
     # Set default values
@@ -179,7 +239,11 @@ def fetch_and_process_tags(instance):
 
 
 def upsert_history(instance: dict, now) -> None:
-    """Keep the CarsHistory row for the current activation complete + fresh."""
+    """Keep the CarsHistory row for the current activation complete + fresh.
+
+    The row is only written when one of its fields changed since this container
+    last wrote it, or lastSeen is older than HISTORY_LAST_SEEN_INTERVAL.
+    """
     if not CARS_HISTORY_TABLE:
         return
     item = {
@@ -192,6 +256,10 @@ def upsert_history(instance: dict, now) -> None:
         if instance.get(src):
             item[dst] = instance[src]
     keys = {"chassisSerial", "managedInstanceId"}
+    fields = tuple((k, v) for k, v in item.items() if k != "lastSeen")
+    written = _history_written.get(item["managedInstanceId"])
+    if written and written[0] == fields and now - written[1] < HISTORY_LAST_SEEN_INTERVAL:
+        return
     try:
         _ddb.Table(CARS_HISTORY_TABLE).update_item(
             Key={"chassisSerial": item["chassisSerial"], "managedInstanceId": item["managedInstanceId"]},
@@ -199,6 +267,7 @@ def upsert_history(instance: dict, now) -> None:
             ExpressionAttributeNames={f"#{k}": k for k in item if k not in keys},
             ExpressionAttributeValues={f":{k}": v for k, v in item.items() if k not in keys},
         )
+        _history_written[item["managedInstanceId"]] = (fields, now)
     except Exception as e:  # noqa: BLE001 — best-effort, never block status update
         logger.warning(f"history upsert failed for {item['managedInstanceId']}: {e}")
 
@@ -251,6 +320,84 @@ def clean_instance_data(instance):
     instance.update(cleaned_instance)
 
 
+def status_fingerprint(instance: dict) -> str:
+    """Hash of the cleaned instance data, apart from LastPingDateTime."""
+    fields = {
+        k: v
+        for k, v in instance.items()
+        if k not in ("LastPingDateTime", FINGERPRINT_FIELD)
+    }
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def changed_instances(instances: list) -> list:
+    """
+    Add the status fingerprint to the cleaned instances and return the ones
+    whose fingerprint differs from the one stored with their car row, or whose
+    stored LastPingDateTime is more than PING_REFRESH_INTERVAL old.
+    """
+    for instance in instances:
+        instance[FINGERPRINT_FIELD] = status_fingerprint(instance)
+    if not CARS_TABLE or not instances:
+        return instances
+
+    try:
+        stored = fetch_stored_status([instance["InstanceId"] for instance in instances])
+    except Exception as e:
+        logger.warning(f"Error reading stored car status, sending all cars: {e}")
+        return instances
+
+    return [
+        instance
+        for instance in instances
+        if status_changed(instance, stored.get(instance["InstanceId"]))
+    ]
+
+
+def status_changed(instance: dict, stored: dict) -> bool:
+    if not stored or stored.get(FINGERPRINT_FIELD) != instance[FINGERPRINT_FIELD]:
+        return True
+    try:
+        last_ping = datetime.strptime(
+            instance["LastPingDateTime"], "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+        stored_ping = datetime.strptime(
+            stored["LastPingDateTime"], "%Y-%m-%dT%H:%M:%S.%fZ"
+        )
+    except (KeyError, ValueError, TypeError):
+        return instance.get("LastPingDateTime") != stored.get("LastPingDateTime")
+    return last_ping - stored_ping >= PING_REFRESH_INTERVAL
+
+
+def fetch_stored_status(instance_ids: list) -> dict:
+    """
+    Read the fingerprint and LastPingDateTime of the car rows.
+
+    Returns:
+        dict of InstanceId to the stored attributes; rows that are missing or
+        weren't returned by DynamoDB are left out, so those cars are sent
+    """
+    stored = {}
+    for i in range(0, len(instance_ids), BATCH_GET_SIZE):
+        response = _ddb.batch_get_item(
+            RequestItems={
+                CARS_TABLE: {
+                    "Keys": [
+                        {"InstanceId": instance_id}
+                        for instance_id in instance_ids[i : i + BATCH_GET_SIZE]
+                    ],
+                    "ProjectionExpression": "InstanceId, LastPingDateTime, #fp",
+                    "ExpressionAttributeNames": {"#fp": FINGERPRINT_FIELD},
+                }
+            }
+        )
+        for item in response.get("Responses", {}).get(CARS_TABLE, []):
+            stored[item["InstanceId"]] = item
+    return stored
+
+
 def send_status_update(instances):
     # Prepare the mutation
     mutation = """
@@ -81,3 +81,79 @@ def test_tagged_car_upserts_history():
     assert "#lastSeen=:lastSeen" in kw["UpdateExpression"]
     assert "#carName=:carName" in kw["UpdateExpression"]
     assert kw["ExpressionAttributeValues"][":carName"] == "deepracer-abc"
+
+
+def test_history_upsert_only_when_tracked_fields_change():
+    idx = _load({"CARS_HISTORY_TABLE": "history-table"})
+    table_mock = MagicMock()
+    idx._ddb.Table = MagicMock(return_value=table_mock)
+    instance = {"ChassisSerial": "AMSS-9QCJ", "InstanceId": "mi-1", "ComputerName": "deepracer-abc"}
+    now = datetime(2026, 5, 25, 12, 0, tzinfo=timezone.utc)
+    idx.upsert_history(instance, now)
+    idx.upsert_history(instance, now.replace(minute=5))
+    assert table_mock.update_item.call_count == 1
+    idx.upsert_history({**instance, "fleetName": "event"}, now.replace(minute=6))
+    assert table_mock.update_item.call_count == 2
+    # lastSeen is still refreshed now and then
+    idx.upsert_history({**instance, "fleetName": "event"}, now.replace(minute=30))
+    assert table_mock.update_item.call_count == 3
+
+
+def test_enrichment_failure_only_affects_its_instance():
+    idx = _load()
+    idx.client_ssm = MagicMock()
+
+    def list_tags_for_resource(ResourceType, ResourceId):
+        if ResourceId == "mi-2":
+            raise RuntimeError("throttled")
+        return {"TagList": [{"Key": "fleetName", "Value": "event"}]}
+
+    idx.client_ssm.list_tags_for_resource.side_effect = list_tags_for_resource
+    idx.client_ssm.list_inventory_entries.return_value = {
+        "Entries": [{"Name": "aws-deepracer-core", "Version": "2.1.3.0+1"}]}
+    event = {"Instances": {"InstanceInformationList": [
+        {"InstanceId": f"mi-{i}", "PingStatus": "Online", "ResourceType": "ManagedInstance"}
+        for i in range(1, 4)]}}
+    with patch.object(idx, "send_status_update") as send:
+        idx.lambda_handler(event, None)
+    cars = {car["InstanceId"]: car for car in send.call_args.args[0]}
+    assert set(cars) == {"mi-1", "mi-2", "mi-3"}
+    assert cars["mi-1"]["fleetName"] == "event" and cars["mi-1"]["LoggingCapable"] is True
+    assert "fleetName" not in cars["mi-2"] and "ChassisSerialStatus" not in cars["mi-2"]
+    assert cars["mi-3"]["ChassisSerialStatus"] == "Pending"
+
+
+def _status(instance_id, ping="2026-05-25T12:00:00.000Z", **fields):
+    return {"InstanceId": instance_id, "PingStatus": "Online", "LastPingDateTime": ping, **fields}
+
+
+def test_only_changed_cars_are_sent():
+    idx = _load({"CARS_TABLE": "cars-table"})
+    unchanged = _status("mi-1", ComputerName="car-1")
+    renamed = _status("mi-2", ComputerName="car-2")
+    pinged = _status("mi-3", ComputerName="car-3")
+    stored = {
+        "mi-1": {**unchanged, "LastPingDateTime": "2026-05-25T11:55:00.000Z",
+                 "StatusFingerprint": idx.status_fingerprint(unchanged)},
+        "mi-2": {**renamed, "StatusFingerprint": idx.status_fingerprint({**renamed, "ComputerName": "old"})},
+        "mi-3": {**pinged, "LastPingDateTime": "2026-05-25T11:40:00.000Z",
+                 "StatusFingerprint": idx.status_fingerprint(pinged)},
+    }
+    idx._ddb = MagicMock()
+    idx._ddb.batch_get_item.return_value = {"Responses": {"cars-table": list(stored.values())}}
+
+    cars = [unchanged, renamed, pinged, _status("mi-4")]
+    changed = idx.changed_instances(cars)
+
+    assert [car["InstanceId"] for car in changed] == ["mi-2", "mi-3", "mi-4"]
+    assert all(car["StatusFingerprint"] for car in changed)
+    keys = idx._ddb.batch_get_item.call_args.kwargs["RequestItems"]["cars-table"]["Keys"]
+    assert keys == [{"InstanceId": f"mi-{i}"} for i in range(1, 5)]
+
+
+def test_all_cars_are_sent_when_the_stored_status_cannot_be_read():
+    idx = _load({"CARS_TABLE": "cars-table"})
+    idx._ddb = MagicMock()
+    idx._ddb.batch_get_item.side_effect = RuntimeError("throttled")
+    cars = [_status("mi-1"), _status("mi-2")]
+    assert idx.changed_instances(cars) == cars
@@ -4,10 +4,12 @@ from datetime import datetime, timedelta
 from typing import List
 
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.event_handler import AppSyncResolver
 from aws_lambda_powertools.logging import correlation_paths
 
+from ssm_dispatch import dispatch_commands, map_instances
 from taillight_colors import PALETTE, color_for
 
 tracer = Tracer()
@@ -23,6 +25,7 @@ CARS_HISTORY_TABLE_NAME = os.environ.get("CARS_HISTORY_TABLE")
 
 dynamodb = boto3.resource("dynamodb")
 client_dynamodb = boto3.client("dynamodb")
+deserializer = TypeDeserializer()
 paginator_dynamodb = client_dynamodb.get_paginator("query")
 client_ssm = boto3.client("ssm")
 client_sfn = boto3.client("stepfunctions")
@@ -189,10 +192,9 @@ def carsUpdateFleet(resourceIds: List[str], fleetId: str, fleetName: str):
             fleetName,
             resourceIds,
         )
-        updated_cars = []
 
-        for resource_id in resourceIds:
-            response = client_ssm.add_tags_to_resource(
+        def moveCar(resource_id: str) -> dict:
+            client_ssm.add_tags_to_resource(
                 ResourceType="ManagedInstance",
                 ResourceId=resource_id,
                 Tags=[
@@ -200,16 +202,27 @@ def carsUpdateFleet(resourceIds: List[str], fleetId: str, fleetName: str):
                     {"Key": "fleetName", "Value": fleetName},
                 ],
             )
-
-            logger.info(response)
-
-            car = ddbTable.update_item(
-                Key={"InstanceId": resource_id},
+            # Only the fleet fields are written, so status updates that land
+            # at the same time are kept. The low-level client is thread-safe.
+            attributes = client_dynamodb.update_item(
+                TableName=DDB_TABLE_NAME,
+                Key={"InstanceId": {"S": resource_id}},
                 UpdateExpression="set fleetId=:fId, fleetName=:fName",
-                ExpressionAttributeValues={":fId": fleetId, ":fName": fleetName},
+                ExpressionAttributeValues={
+                    ":fId": {"S": fleetId},
+                    ":fName": {"S": fleetName},
+                },
                 ReturnValues="ALL_NEW",
-            ).get("Attributes")
-            updated_cars.append(car)
+            )["Attributes"]
+            return {
+                key: deserializer.deserialize(value)
+                for key, value in attributes.items()
+            }
+
+        moved, errors = map_instances(moveCar, list(dict.fromkeys(resourceIds)))
+        if errors:
+            logger.error({"Failed to change fleet": errors})
+        updated_cars = list(moved.values())
 
         logger.info(updated_cars)
         return updated_cars
@@ -223,24 +236,26 @@ def carsUpdateFleet(resourceIds: List[str], fleetId: str, fleetName: str):
 def carsDelete(resourceIds: List[str]):
     try:
         logger.info(resourceIds)
-        deletedIds: List[str] = []
-
-        for instance_id in resourceIds:
-            try:
-                # Deregister the managed instance from SSM
-                client_ssm.deregister_managed_instance(InstanceId=instance_id)
 
-                # Remove from DynamoDB
-                ddbTable.delete_item(Key={"InstanceId": instance_id})
-
-                deletedIds.append(instance_id)
-                logger.info(f"Successfully deleted car with ID: {instance_id}")
+        # Deregister the managed instances from SSM
+        deregistered, errors = map_instances(
+            lambda instance_id: client_ssm.deregister_managed_instance(
+                InstanceId=instance_id
+            ),
+            list(dict.fromkeys(resourceIds)),
+        )
+        for instance_id, car_error in errors.items():
+            # Continue with other cars even if one fails
+            logger.error(f"Error deleting car {instance_id}: {car_error}")
 
-            except Exception as car_error:
-                logger.error(f"Error deleting car {instance_id}: {str(car_error)}")
-                # Continue with other cars even if one fails
+        # Remove from DynamoDB
+        deletedIds: List[str] = list(deregistered)
+        with ddbTable.batch_writer() as carsTable:
+            for instance_id in deletedIds:
+                carsTable.delete_item(Key={"InstanceId": instance_id})
+        logger.info(f"Successfully deleted cars with IDs: {deletedIds}")
 
-        return {"result": "success", "cars": deletedIds}
+        return {"result": "success", "cars": deletedIds, "errors": errors}
 
     except Exception as error:
         logger.exception(error)
@@ -252,27 +267,17 @@ def carDeleteAllModels(resourceIds: List[str], withSystemLogs: bool = False):
     try:
         logger.info(resourceIds)
 
-        for instance_id in resourceIds:
-            # empty the artifacts folder
-            logger.info(instance_id)
-            commands = [
-                "rm -rf /opt/aws/deepracer/artifacts/*",
-                "rm -rf /opt/aws/deepracer/logs/*",
-            ]
-            if withSystemLogs:
-                commands.insert(0, "systemctl stop deepracer-core")
-                commands.append("rm -rf /root/.ros/log/*")
-                commands.append("systemctl start deepracer-core")
-
-            response = client_ssm.send_command(
-                InstanceIds=[instance_id],
-                DocumentName="AWS-RunShellScript",
-                Parameters={"commands": commands},
-            )
-            # command_id = response['Command']['CommandId']
-            logger.info(response)
+        # empty the artifacts folder
+        commands = [
+            "rm -rf /opt/aws/deepracer/artifacts/*",
+            "rm -rf /opt/aws/deepracer/logs/*",
+        ]
+        if withSystemLogs:
+            commands.insert(0, "systemctl stop deepracer-core")
+            commands.append("rm -rf /root/.ros/log/*")
+            commands.append("systemctl start deepracer-core")
 
-        return {"result": "success"}
+        return sendCommands({instance_id: commands for instance_id in resourceIds})
 
     except Exception as error:
         logger.exception(error)
@@ -285,18 +290,16 @@ def carSetTaillightColor(resourceIds: List[str], selectedColor: str):
         logger.info(resourceIds)
 
         color = color_for(selectedColor)
+        rosCommand = (
+            "ros2 service call /servo_pkg/set_led_state"
+            ' deepracer_interfaces_pkg/srv/SetLedCtrlSrv "{red:'
+            f" {color['red_pwm']}, blue: {color['blue_pwm']}, green:"
+            f" {color['green_pwm']}}}\""
+        )
 
-        for instance_id in resourceIds:
-            rosCommand = (
-                "ros2 service call /servo_pkg/set_led_state"
-                ' deepracer_interfaces_pkg/srv/SetLedCtrlSrv "{red:'
-                f" {color['red_pwm']}, blue: {color['blue_pwm']}, green:"
-                f" {color['green_pwm']}}}\""
-            )
-
-            callRosService(instance_id, rosCommand)
-
-        return {"result": "success"}
+        return sendCommands(
+            {instance_id: rosServiceCommands(rosCommand) for instance_id in resourceIds}
+        )
     except Exception as error:
         logger.exception(error)
         return error
@@ -307,21 +310,21 @@ def carEmergencyStop(resourceIds: List[str]):
     try:
         logger.info(resourceIds)
 
-        for instance_id in resourceIds:
-            rosCommand = (
-                "ros2 service call /ctrl_pkg/enable_state"
-                ' deepracer_interfaces_pkg/srv/EnableStateSrv "{is_active: false}"'
-            )
-            callRosService(instance_id, rosCommand)
+        rosCommand = (
+            "ros2 service call /ctrl_pkg/enable_state"
+            ' deepracer_interfaces_pkg/srv/EnableStateSrv "{is_active: false}"'
+        )
 
-        return {"result": "success"}
+        return sendCommands(
+            {instance_id: rosServiceCommands(rosCommand) for instance_id in resourceIds}
+        )
     except Exception as error:
         logger.exception(error)
         return error
 
 
-def callRosService(instaneId: str, rosCommand: str):
-    finalCommand = [
+def rosServiceCommands(rosCommand: str) -> List[str]:
+    return [
         "#!/bin/bash",
         'export HOME="/home/deepracer"',
         "source $(find /opt/intel -name setupvars.sh)",
@@ -329,11 +332,21 @@ def callRosService(instaneId: str, rosCommand: str):
         rosCommand,
     ]
 
-    client_ssm.send_command(
-        InstanceIds=[instaneId],
-        DocumentName="AWS-RunShellScript",
-        Parameters={"commands": finalCommand},
-    )
+
+def sendCommands(commandsByInstance: dict) -> dict:
+    """
+    Send the shell commands to the cars, batching cars with the same commands
+    into one SSM call, and report the CommandId or error of each car.
+    """
+    commandIds, errors = dispatch_commands(client_ssm, commandsByInstance)
+    logger.info({"CommandIds": commandIds})
+    if errors:
+        logger.error({"Failed to send command": errors})
+    return {
+        "result": "error" if errors else "success",
+        "commandIds": commandIds,
+        "errors": errors,
+    }
 
 
 @app.resolver(type_name="Mutation", field_name="carRestartService")
@@ -341,20 +354,13 @@ def carRestartService(resourceIds: List[str]):
     try:
         logger.info(resourceIds)
 
-        for instance_id in resourceIds:
-            client_ssm.send_command(
-                InstanceIds=[instance_id],
-                DocumentName="AWS-RunShellScript",
-                Parameters={
-                    "commands": [
-                        "#!/bin/bash",
-                        'export HOME="/home/deepracer"',
-                        "systemctl restart deepracer-core",
-                    ]
-                },
-            )
+        commands = [
+            "#!/bin/bash",
+            'export HOME="/home/deepracer"',
+            "systemctl restart deepracer-core",
+        ]
 
-        return {"result": "success"}
+        return sendCommands({instance_id: commands for instance_id in resourceIds})
     except Exception as error:
         logger.exception(error)
         return error
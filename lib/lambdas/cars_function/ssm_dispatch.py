@@ -0,0 +1,90 @@
+"""Run SSM calls for many cars concurrently (no AWS deps).
+
+Cars that run the same commands share one SendCommand call of up to
+MAX_INSTANCES_PER_COMMAND instances. Those calls, and per-car calls such as
+tagging or deregistering, are made from a bounded thread pool instead of one
+after another.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_INSTANCES_PER_COMMAND = 50  # SendCommand InstanceIds limit
+MAX_CONCURRENT_COMMANDS = 8
+SHELL_DOCUMENT = "AWS-RunShellScript"
+
+
+def group_commands(commands_by_instance, batch_size=MAX_INSTANCES_PER_COMMAND):
+    """Group cars with identical commands into batches of at most batch_size.
+
+    Returns a list of (commands, instance_ids), in order of first appearance.
+    """
+    groups = {}
+    for instance_id, commands in commands_by_instance.items():
+        groups.setdefault(tuple(commands), []).append(instance_id)
+    return [
+        (list(commands), instance_ids[i : i + batch_size])
+        for commands, instance_ids in groups.items()
+        for i in range(0, len(instance_ids), batch_size)
+    ]
+
+
+def dispatch_commands(
+    ssm_client, commands_by_instance, max_workers=MAX_CONCURRENT_COMMANDS
+):
+    """Send shell commands to cars with AWS-RunShellScript.
+
+    commands_by_instance maps each instance id to its list of commands.
+    Returns (command_ids, errors): {instance_id: CommandId} for the cars the
+    command was sent to and {instance_id: error message} for the others. A
+    failing call only fails the cars of its own batch.
+    """
+    batches = group_commands(commands_by_instance)
+    if not batches:
+        return {}, {}
+
+    def send(batch):
+        commands, instance_ids = batch
+        response = ssm_client.send_command(
+            InstanceIds=instance_ids,
+            DocumentName=SHELL_DOCUMENT,
+            Parameters={"commands": commands},
+        )
+        return response["Command"]["CommandId"]
+
+    command_ids = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        futures = [executor.submit(send, batch) for batch in batches]
+        for (_, instance_ids), future in zip(batches, futures):
+            try:
+                command_id = future.result()
+            except Exception as error:
+                errors.update({instance_id: str(error) for instance_id in instance_ids})
+            else:
+                command_ids.update(
+                    {instance_id: command_id for instance_id in instance_ids}
+                )
+    return command_ids, errors
+
+
+def map_instances(fn, instance_ids, max_workers=MAX_CONCURRENT_COMMANDS):
+    """Call fn(instance_id) for each car from a bounded thread pool.
+
+    Returns (results, errors): {instance_id: return value} for the calls that
+    succeeded and {instance_id: error message} for the ones that raised.
+    """
+    results = {}
+    errors = {}
+    if not instance_ids:
+        return results, errors
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(instance_ids))) as executor:
+        futures = {
+            instance_id: executor.submit(fn, instance_id)
+            for instance_id in instance_ids
+        }
+        for instance_id, future in futures.items():
+            try:
+                results[instance_id] = future.result()
+            except Exception as error:
+                errors[instance_id] = str(error)
+    return results, errors
@@ -0,0 +1,70 @@
+import threading
+
+from ssm_dispatch import (
+    MAX_INSTANCES_PER_COMMAND,
+    dispatch_commands,
+    group_commands,
+    map_instances,
+)
+
+
+class _FakeSsm:
+    def __init__(self, fail_for=()):
+        self.calls = []
+        self.fail_for = set(fail_for)
+        self._lock = threading.Lock()
+
+    def send_command(self, InstanceIds, DocumentName, Parameters):
+        with self._lock:
+            self.calls.append((list(InstanceIds), DocumentName, Parameters))
+            command_id = f"cmd-{len(self.calls)}"
+        if self.fail_for & set(InstanceIds):
+            raise RuntimeError("throttled")
+        return {"Command": {"CommandId": command_id}}
+
+
+def test_group_commands_batches_identical_commands():
+    cars = {f"mi-{i}": ["stop"] for i in range(120)}
+    cars["mi-x"] = ["restart"]
+    batches = group_commands(cars)
+    assert [len(ids) for _, ids in batches] == [MAX_INSTANCES_PER_COMMAND, 50, 20, 1]
+    assert batches[-1] == (["restart"], ["mi-x"])
+
+
+def test_dispatch_sends_one_command_for_a_fleet():
+    ssm = _FakeSsm()
+    cars = [f"mi-{i}" for i in range(30)]
+    command_ids, errors = dispatch_commands(ssm, {car: ["stop"] for car in cars})
+    assert len(ssm.calls) == 1
+    assert ssm.calls[0] == (cars, "AWS-RunShellScript", {"commands": ["stop"]})
+    assert command_ids == {car: "cmd-1" for car in cars}
+    assert errors == {}
+
+
+def test_dispatch_reports_failures_per_car():
+    ssm = _FakeSsm(fail_for={"mi-b"})
+    command_ids, errors = dispatch_commands(
+        ssm, {"mi-a": ["stop"], "mi-b": ["restart"], "mi-c": ["stop"]}
+    )
+    assert set(command_ids) == {"mi-a", "mi-c"}
+    assert command_ids["mi-a"] == command_ids["mi-c"]
+    assert errors == {"mi-b": "throttled"}
+
+
+def test_dispatch_without_cars_sends_nothing():
+    ssm = _FakeSsm()
+    assert dispatch_commands(ssm, {}) == ({}, {})
+    assert ssm.calls == []
+
+
+def test_map_instances_reports_failures_per_car():
+    def tag(instance_id):
+        if instance_id == "mi-2":
+            raise RuntimeError("InvalidResourceId")
+        return {"tagged": instance_id}
+
+    results, errors = map_instances(tag, [f"mi-{i}" for i in range(20)])
+    assert len(results) == 19
+    assert results["mi-3"] == {"tagged": "mi-3"}
+    assert errors == {"mi-2": "InvalidResourceId"}
+    assert map_instances(tag, []) == ({}, {})
@@ -2,6 +2,7 @@ import json
 import os
 
 import boto3
+import user_cache
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
@@ -32,6 +33,7 @@ def lambda_handler(event: dict, context: LambdaContext) -> str:
             UserPoolId=user_pool_id, Username=username
         )
         logger.info(response)
+        user_cache.remove_user(event["identity"]["sub"])
 
         return_data["Deleted"] = True
         return_data["Username"] = username
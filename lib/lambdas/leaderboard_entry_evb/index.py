@@ -5,6 +5,7 @@ import os
 import appsync_helpers
 import boto3
 import dynamo_helpers
+import user_cache
 from aws_lambda_powertools import Logger, Tracer
 
 tracer = Tracer()
@@ -17,7 +18,6 @@ ddbTable = dynamodb.Table(DDB_TABLE_NAME)
 LEADERBOARD_CONFIG_TYPE = "leaderboard_config"
 LEADERBOARD_ENTRY_TYPE = "leaderboard_entry"
 
-cognito_client = boto3.client("cognito-idp")
 USER_POOL_ID = os.environ["USER_POOL_ID"]
 
 
@@ -49,19 +49,13 @@ def lambda_handler(evbEvent, context):
 
 
 def __get_username_by_user_id(userId: str) -> tuple:
-    """Read Cognito username and countryCode for the given userId."""
+    """Read username and countryCode for the given userId from the user cache."""
     logger.info(f"userId = {userId}")
-    response = cognito_client.list_users(
-        UserPoolId=USER_POOL_ID,
-        Filter=f'sub = "{userId}"',
-    )
-    logger.info(response)
-    user = response["Users"][0]
-    username = user["Username"]
-    countryCode = None
-    for attributes in user["Attributes"]:
-        if attributes["Name"] == "custom:countryCode":
-            countryCode = attributes["Value"]
+    user = user_cache.get_user(USER_POOL_ID, userId)
+    if user is None:
+        raise Exception(f"User {userId} not found")
+    username = user["username"]
+    countryCode = user["countryCode"] or None
 
     logger.info(username)
     logger.info(countryCode)
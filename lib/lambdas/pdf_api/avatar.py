@@ -91,6 +91,31 @@ def _to_screaming_snake(camel: str) -> str:
     return out.upper()
 
 
+def avatar_cache_key(config):
+    """Normalise an avatar config into a render cache key.
+
+    Mirrors the branches of render_avatar_data_uri: every config that renders
+    the helmet maps to "helmet", every unrenderable one to "invalid", and
+    anything else to the string fields the renderer reads.
+    """
+    if not config:
+        return "helmet"
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except (json.JSONDecodeError, ValueError):
+            return "invalid"
+    if not isinstance(config, dict):
+        return "invalid"
+    if config.get("topType") == HELMET_TOP:
+        return "helmet"
+    return {
+        json_key: config[json_key]
+        for json_key, _, _ in _ENUM_FIELDS
+        if config.get(json_key) and isinstance(config[json_key], str)
+    }
+
+
 def render_avatar_data_uri(config) -> Optional[str]:
     """Convert an avataaars JSON config into a `data:image/png;base64,…` URI.
 
@@ -0,0 +1,104 @@
+"""Content-addressed cache for the avatar and flag images embedded in PDFs.
+
+A bulk certificate run renders the same few images over and over: every racer
+without an avatar gets the same Cairo-rasterised helmet, and racers share
+avatar configs and countries. Rendered data URIs are keyed by a hash of their
+normalised input and kept in a bounded in-process LRU for the lifetime of a
+warm Lambda.
+
+If RENDER_CACHE_DIR is set (the worker points it at /tmp), rendered images are
+also written there, so a warm container keeps every image it has rendered
+even after it drops out of the LRU. Failed renders (None) are only cached in
+memory, so a transient failure isn't persisted.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from aws_lambda_powertools import Logger
+
+logger = Logger()
+
+MEMORY_CACHE_SIZE = 256
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", "")
+
+_MISSING = object()
+_memory: "OrderedDict[str, Optional[str]]" = OrderedDict()
+
+
+def cache_key(namespace: str, key) -> str:
+    """Hash of a namespace and a JSON-serialisable key; dict order doesn't matter."""
+    payload = json.dumps([namespace, key], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_or_render(namespace: str, key, render: Callable[[], Optional[str]]) -> Optional[str]:
+    """Return the cached image for (namespace, key), rendering it on a miss.
+
+    `key` must be normalised by the caller: inputs that render the same image
+    should produce the same key.
+    """
+    digest = cache_key(namespace, key)
+
+    value = _memory.get(digest, _MISSING)
+    if value is not _MISSING:
+        _memory.move_to_end(digest)
+        return value
+
+    value = _read_disk(digest)
+    if value is None:
+        value = render()
+        if value is not None:
+            _write_disk(digest, value)
+    _remember(digest, value)
+    return value
+
+
+def clear():
+    """Empty the in-process tier (the disk tier is left alone)."""
+    _memory.clear()
+
+
+def _remember(digest: str, value: Optional[str]):
+    _memory[digest] = value
+    _memory.move_to_end(digest)
+    while len(_memory) > MEMORY_CACHE_SIZE:
+        _memory.popitem(last=False)
+
+
+def _disk_path(digest: str) -> Optional[str]:
+    if not RENDER_CACHE_DIR:
+        return None
+    return os.path.join(RENDER_CACHE_DIR, f"{digest}.txt")
+
+
+def _read_disk(digest: str) -> Optional[str]:
+    path = _disk_path(digest)
+    if path is None:
+        return None
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"render cache read failed for {digest}: {e}")
+        return None
+
+
+def _write_disk(digest: str, value: str):
+    path = _disk_path(digest)
+    if path is None:
+        return
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first so a concurrent reader never sees a
+        # partial image.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="ascii") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"render cache write failed for {digest}: {e}")
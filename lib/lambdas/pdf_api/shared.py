@@ -10,6 +10,7 @@ import boto3
 from aws_lambda_powertools import Logger
 from boto3.dynamodb.conditions import Attr, Key
 
+import render_cache
 from race_summary import calculate_racer_summary, rank_racers
 from render import render_pdf
 
@@ -134,7 +135,7 @@ def _lookup_racer_profile(username: str) -> dict:
 
 
 def build_summaries(races: list[dict], user_map: dict[str, dict]) -> list[dict]:
-    from avatar import render_avatar_data_uri
+    from avatar import avatar_cache_key, render_avatar_data_uri
     from flag import flag_data_uri
 
     races_by_user: dict[str, list[dict]] = {}
@@ -147,8 +148,16 @@ def build_summaries(races: list[dict], user_map: dict[str, dict]) -> list[dict]:
         s["username"] = u.get("username", uid[:8])
         s["countryCode"] = u.get("countryCode", "")
         s["highlightColour"] = u.get("highlightColour") or None
-        s["avatarUrl"] = render_avatar_data_uri(u.get("avatarConfig"))
-        s["flagUrl"] = flag_data_uri(s["countryCode"])
+        # Most racers share the helmet avatar and a handful of flags, so the
+        # images are rendered once per distinct input.
+        avatar_config = u.get("avatarConfig")
+        s["avatarUrl"] = render_cache.get_or_render(
+            "avatar", avatar_cache_key(avatar_config), lambda: render_avatar_data_uri(avatar_config)
+        )
+        country_code = s["countryCode"]
+        s["flagUrl"] = render_cache.get_or_render(
+            "flag", str(country_code or "").strip().lower(), lambda: flag_data_uri(country_code)
+        )
         summaries.append(s)
     return summaries
 
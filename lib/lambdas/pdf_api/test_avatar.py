@@ -193,3 +193,14 @@ def test_real_library_smoke():
     # Confirm the payload decodes to a real PNG (8-byte signature).
     payload = base64.b64decode(out.split(",", 1)[1])
     assert payload[:8] == b"\x89PNG\r\n\x1a\n", "decoded payload is not a PNG"
+
+
+def test_cache_key_groups_configs_that_render_the_same():
+    assert avatar.avatar_cache_key(None) == "helmet"
+    assert avatar.avatar_cache_key({}) == "helmet"
+    assert avatar.avatar_cache_key('{"topType": "Helmet", "hairColor": "Brown"}') == "helmet"
+    assert avatar.avatar_cache_key("not json {{{") == "invalid"
+    assert avatar.avatar_cache_key([1, 2]) == "invalid"
+    assert avatar.avatar_cache_key({"topType": "ShortHairShortFlat", "avatarStyle": "Circle", "skinColor": ""}) == (
+        avatar.avatar_cache_key('{"topType": "ShortHairShortFlat"}')
+    )
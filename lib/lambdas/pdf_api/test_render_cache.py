@@ -0,0 +1,57 @@
+"""Tests for render_cache.py — the avatar/flag render cache."""
+import pytest
+
+import render_cache
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache(monkeypatch):
+    monkeypatch.setattr(render_cache, "RENDER_CACHE_DIR", "")
+    render_cache.clear()
+    yield
+    render_cache.clear()
+
+
+def _counting_render(value="data:image/png;base64,AAAA"):
+    calls = []
+
+    def render():
+        calls.append(1)
+        return value
+
+    return render, calls
+
+
+def test_renders_once_per_key():
+    render, calls = _counting_render()
+    for _ in range(200):
+        assert render_cache.get_or_render("avatar", "helmet", render) == "data:image/png;base64,AAAA"
+    assert len(calls) == 1
+
+
+def test_key_is_independent_of_dict_order_and_namespaced():
+    assert render_cache.cache_key("avatar", {"a": 1, "b": 2}) == render_cache.cache_key("avatar", {"b": 2, "a": 1})
+    assert render_cache.cache_key("avatar", "de") != render_cache.cache_key("flag", "de")
+
+
+def test_failed_render_is_cached_in_memory_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_cache, "RENDER_CACHE_DIR", str(tmp_path))
+    render, calls = _counting_render(None)
+    assert render_cache.get_or_render("flag", "xx", render) is None
+    assert render_cache.get_or_render("flag", "xx", render) is None
+    assert len(calls) == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_disk_tier_survives_memory_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(render_cache, "RENDER_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(render_cache, "MEMORY_CACHE_SIZE", 2)
+    render, calls = _counting_render()
+    for cc in ["de", "fr", "gb"]:
+        render_cache.get_or_render("flag", cc, render)
+    assert len(render_cache._memory) == 2
+    assert len(calls) == 3
+
+    # "de" was evicted from memory but is read back from disk
+    assert render_cache.get_or_render("flag", "de", render) == "data:image/png;base64,AAAA"
+    assert len(calls) == 3
@@ -11,7 +11,8 @@ them in, so every branch is unit-testable in isolation.
 
 from __future__ import annotations
 
-from datetime import datetime, timezone
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
 
 
 def _parse_iso(value):
@@ -42,6 +43,10 @@ def _parse_iso(value):
     return dt
 
 
+def _utc_date(dt):
+    return dt.astimezone(timezone.utc).date()
+
+
 def collect_paginated(page_fn):
     """Accumulate `Items` across DynamoDB pages.
 
@@ -85,6 +90,36 @@ def build_activation_windows(history_rows):
     return windows
 
 
+def index_activation_windows(windows):
+    """Group activation windows by carName, sorted by `frm`, for bisection.
+
+    Returns {carName: (frms, windows)} with both lists in ascending `frm`
+    order. Windows with the same `frm` keep their input order reversed, so the
+    backwards walk in match_activation meets the earliest one first.
+    """
+    by_name = {}
+    for position, w in enumerate(windows):
+        by_name.setdefault(w["carName"], []).append((w["frm"], -position, w))
+    index = {}
+    for car_name, entries in by_name.items():
+        entries.sort(key=lambda e: (e[0], e[1]))
+        index[car_name] = ([e[0] for e in entries], [e[2] for e in entries])
+    return index
+
+
+def _match_indexed(car_name, created, window_index):
+    if created is None or car_name not in window_index:
+        return None
+    frms, name_windows = window_index[car_name]
+    # Walk back from the latest window that started at or before the race;
+    # the first one still open at that time has the latest frm.
+    for i in range(bisect_right(frms, created) - 1, -1, -1):
+        w = name_windows[i]
+        if w["to"] is None or created <= w["to"]:
+            return w
+    return None
+
+
 def match_activation(car_name, created_at, windows):
     """Return the activation window a lap belongs to, or None.
 
@@ -93,20 +128,24 @@ def match_activation(car_name, created_at, windows):
     for one chassis — activations are sequential), the one with the latest frm
     wins (most specific).
     """
-    created = _parse_iso(created_at)
-    if created is None:
-        return None
-    best = None
-    for w in windows:
-        if w["carName"] != car_name:
-            continue
-        if created < w["frm"]:
-            continue
-        if w["to"] is not None and created > w["to"]:
-            continue
-        if best is None or w["frm"] > best["frm"]:
-            best = w
-    return best
+    return _match_indexed(
+        car_name, _parse_iso(created_at), index_activation_windows(windows)
+    )
+
+
+def created_at_bounds(window):
+    """Bounds on the race createdAt strings that can match a window.
+
+    Returns (lower, upper) as date strings, upper None for open windows. Race
+    createdAt values and CarsHistory timestamps don't share one ISO format, so
+    the bounds are widened to whole UTC days; match_activation does the exact
+    check on the races read within them.
+    """
+    lower = _utc_date(window["frm"]).isoformat()
+    upper = None
+    if window["to"] is not None:
+        upper = (_utc_date(window["to"]) + timedelta(days=1)).isoformat()
+    return lower, upper
 
 
 def _lap_view(lap):
@@ -131,6 +170,7 @@ def assemble_car_race_history(chassis_serial, history_rows, races):
     converts Decimal->float on the way out; bestLapTime keeps the input type.
     """
     windows = build_activation_windows(history_rows)
+    window_index = index_activation_windows(windows)
 
     acts = {}
     for w in windows:
@@ -144,8 +184,9 @@ def assemble_car_race_history(chassis_serial, history_rows, races):
 
     for race in races or []:
         created_at = race.get("createdAt")
+        created = _parse_iso(created_at)
         for lap in race.get("laps") or []:
-            w = match_activation(lap.get("carName"), created_at, windows)
+            w = _match_indexed(lap.get("carName"), created, window_index)
             if w is None:
                 continue
             bucket = acts[w["managedInstanceId"]]
@@ -5,7 +5,6 @@ import os
 import uuid
 from datetime import datetime
 from functools import reduce
-from statistics import mean
 
 import boto3
 import car_race_history
@@ -23,6 +22,9 @@ app = AppSyncResolver()
 LAPS_DDB_TABLE_NAME = os.environ["DDB_TABLE"]
 dynamodb = boto3.resource("dynamodb")
 ddbTable = dynamodb.Table(LAPS_DDB_TABLE_NAME)
+# Settings and markers of the race manager, kept out of the race table's
+# event keyspace so they never show up as races of an event
+configTable = dynamodb.Table(os.environ["RACE_CONFIG_TABLE"])
 CARS_HISTORY_TABLE_NAME = os.environ.get("CARS_HISTORY_TABLE")
 carsHistoryTable = (
     dynamodb.Table(CARS_HISTORY_TABLE_NAME) if CARS_HISTORY_TABLE_NAME else None
@@ -31,8 +33,28 @@ carsHistoryTable = (
 RACE_LAP_TYPE = "lap"
 RACE_TYPE = "race"
 RACE_SUMMARY_TYPE = "race_summary"
+# One item per (race, carName) of its laps, indexed by carName and createdAt
+CAR_RACE_TYPE = "race_car"
+CAR_RACE_INDEX_NAME = "carName-createdAt-index"
+CAR_RACE_INDEX_MARKER_KEY = {"configKey": "CAR_RACE_INDEX_BACKFILLED"}
+# Where the marker used to be stored, in the race table
+LEGACY_CAR_RACE_INDEX_MARKER_KEY = {"eventId": "CAR_RACE_INDEX", "sk": "BACKFILLED"}
+BATCH_GET_SIZE = 100  # BatchGetItem limit
+# Mergeable running totals kept on the persisted race summary of each racer
+SUMMARY_AGGREGATE_KEYS = (
+    "raceCount",
+    "numberOfValidLaps",
+    "numberOfInvalidLaps",
+    "validLapTimeSum",
+    "fastestLapTime",
+    "fastestAverageLap",
+    "mostConcecutiveLaps",
+    "raceIds",
+)
+SUMMARY_REBUILD_ATTEMPTS = 3
 
 EVENT_BUS_NAME = os.environ["EVENT_BUS_NAME"]
+EVB_BATCH_SIZE = 10  # PutEvents limit
 cloudwatch_events = boto3.client("events")
 
 
@@ -47,9 +69,10 @@ def lambda_handler(event, context):
 def getCarRaceHistory(chassisSerial):
     """#66: every lap a physical car ran across all its hostnames.
 
-    Reads the chassis lineage (CarsHistory), scans the race table, and joins
-    nested-lap carName to each activation window. On-demand admin/operator view
-    — not a hot path (see the design doc's access-pattern note).
+    Reads the chassis lineage (CarsHistory), looks up the races run under each
+    activation's carName and time window in the car race index, and joins
+    nested-lap carName to each activation window. Until the index has been
+    backfilled the race table is scanned once and the index is built from it.
     """
     empty = {
         "chassisSerial": chassisSerial,
@@ -70,14 +93,12 @@ def getCarRaceHistory(chassisSerial):
     if not history_rows:
         return empty
 
-    races = car_race_history.collect_paginated(
-        lambda start_key: ddbTable.scan(
-            **{
-                "FilterExpression": Attr("type").eq(RACE_TYPE),
-                **({"ExclusiveStartKey": start_key} if start_key else {}),
-            }
+    if configTable.get_item(Key=CAR_RACE_INDEX_MARKER_KEY).get("Item"):
+        races = __get_races_by_activation_windows(
+            car_race_history.build_activation_windows(history_rows)
         )
-    )
+    else:
+        races = __backfill_car_race_index()
 
     result = car_race_history.assemble_car_race_history(chassisSerial, history_rows, races)
     return dynamo_helpers.replace_decimal_with_float(result)
@@ -100,7 +121,7 @@ def getRaces(eventId):
 @app.resolver(type_name="Mutation", field_name="deleteRaces")
 def deleteRaces(eventId, racesToDelete):
     event_id = eventId
-    user_ids_to_publish_events_for = []
+    racers_to_publish_events_for = {}  # (track_id, user_id), in order of appearance
     deleted_race_ids = []
     with ddbTable.batch_writer() as batch:
         for race in racesToDelete:
@@ -111,10 +132,11 @@ def deleteRaces(eventId, racesToDelete):
             try:
                 response = batch.delete_item(Key={"eventId": event_id, "sk": sort_key})
                 logger.info(response)
+                for car_race_key in __get_car_race_keys(event_id, sort_key):
+                    batch.delete_item(Key=car_race_key)
                 # TODO add error handling if any of the items can´t be removed
                 deleted_race_ids.append(race_id)
-                if user_id not in user_ids_to_publish_events_for:
-                    user_ids_to_publish_events_for.append(user_id)
+                racers_to_publish_events_for[(track_id, user_id)] = None
             except ClientError as error:
                 logger.error(
                     "Couldn't delete race %s. Here's why: %s: %s",
@@ -123,10 +145,11 @@ def deleteRaces(eventId, racesToDelete):
                     error.response["Error"]["Message"],
                 )
 
-    logger.info(user_ids_to_publish_events_for)
+    logger.info(racers_to_publish_events_for)
 
-    # TODO send one event per userId
-    for user_id in user_ids_to_publish_events_for:
+    # one summary recompute and one event per racer on each track
+    evbEvents = []
+    for track_id, user_id in racers_to_publish_events_for:
         race_info = {
             "eventId": event_id,
             "trackId": track_id,
@@ -141,25 +164,28 @@ def deleteRaces(eventId, racesToDelete):
                 {**race_info, **race_summary}
             )
 
-            evbEvent = {
-                "Detail": json.dumps(race_summary_combined),
-                "DetailType": "raceSummaryUpdated",
-                "Source": "race-manager",
-                "EventBusName": EVENT_BUS_NAME,
-            }
-            __put_evb_events([evbEvent])
+            evbEvents.append(
+                {
+                    "Detail": json.dumps(race_summary_combined),
+                    "DetailType": "raceSummaryUpdated",
+                    "Source": "race-manager",
+                    "EventBusName": EVENT_BUS_NAME,
+                }
+            )
 
         # raised if there are no more race entries for user
         except ValueError as e:
             logger.info(e)
 
-            evbEvent = {
-                "Detail": json.dumps(race_info),
-                "DetailType": "raceSummaryDeleted",
-                "Source": "race-manager",
-                "EventBusName": EVENT_BUS_NAME,
-            }
-            __put_evb_events([evbEvent])
+            evbEvents.append(
+                {
+                    "Detail": json.dumps(race_info),
+                    "DetailType": "raceSummaryDeleted",
+                    "Source": "race-manager",
+                    "EventBusName": EVENT_BUS_NAME,
+                }
+            )
+    __put_evb_events(evbEvents)
 
     return_object = {
         "eventId": event_id,
@@ -184,15 +210,14 @@ def addRace(eventId, userId, laps, racedByProxy, averageLaps, trackId=1):
     }
     logger.info(laps)
     if laps:
-        __store_race(
-            {
-                **race_info,
-                "laps": dynamo_helpers.replace_floats_with_decimal(laps),
-                "averageLaps": dynamo_helpers.replace_floats_with_decimal(averageLaps),
-            }
-        )
+        race = {
+            **race_info,
+            "laps": dynamo_helpers.replace_floats_with_decimal(laps),
+            "averageLaps": dynamo_helpers.replace_floats_with_decimal(averageLaps),
+        }
+        __store_race(race)
 
-        race_summary = __calculate_race_summary(eventId, trackId, userId)
+        race_summary = __add_race_to_summary(eventId, trackId, userId, race)
 
         race_summary_combined = dynamo_helpers.replace_decimal_with_float(
             {**race_info, **race_summary}
@@ -228,6 +253,7 @@ def updateRace(**args):
         )
         sort_key = __generate_sort_key(track_id, user_id, race_id)
         ddb_item = __update_race(event_id, sort_key, update_expressions)
+        __store_car_races([ddb_item])
 
         race_summary = __calculate_race_summary(event_id, track_id, user_id)
         race_summary_combined = dynamo_helpers.replace_decimal_with_float(
@@ -266,6 +292,7 @@ def __store_race(item: dict) -> None:
     logger.info(item_to_store)
     response = ddbTable.put_item(Item=item_to_store)
     logger.info(response)
+    __store_car_races([item_to_store])
 
 
 def __update_race(event_id, sort_key, ddb_update_expressions: dict) -> None:
@@ -280,80 +307,225 @@ def __update_race(event_id, sort_key, ddb_update_expressions: dict) -> None:
 
 
 def __calculate_race_summary(event_id, track_id, user_id) -> dict:
-    stored_races = __get_races_by_event_id_and_user_id(event_id, track_id, user_id)
-    if not stored_races:
-        raise ValueError("No more races entries for user")
-
-    logger.info(stored_races)
-    valid_laps, invalid_laps = __get_laps_by_validity(stored_races)
-    total_number_of_laps = len(valid_laps) + len(invalid_laps)
-    avg_laps_per_attempt = total_number_of_laps / len(stored_races)
-    valid_lap_times = __get_valid_lap_times(valid_laps)
-    average_lap = __get_fastest_average_lap(stored_races)
-    mostConcecutiveLaps = __get_most_concecutive_laps(stored_races)
+    """
+    Rebuild the racer's summary from all of their stored races and persist it.
 
-    summary = {
-        "numberOfValidLaps": len(valid_laps),
-        "numberOfInvalidLaps": len(invalid_laps),
+    The write is conditional on the summary version read before the races, so
+    a rebuild never overwrites a race merged in the meantime; it is retried
+    instead, and the last attempt writes unconditionally.
+
+    Raises:
+        ValueError: if the racer has no races left, the stored summary is removed
+    """
+    for attempt in range(SUMMARY_REBUILD_ATTEMPTS):
+        conditional = attempt < SUMMARY_REBUILD_ATTEMPTS - 1
+        stored_summary = __get_stored_summary(event_id, track_id, user_id)
+        expected_version = stored_summary["version"] if stored_summary else None
+        stored_races = __get_races_by_event_id_and_user_id(event_id, track_id, user_id)
+        try:
+            if not stored_races:
+                if stored_summary:
+                    __delete_summary(
+                        event_id, track_id, user_id, expected_version, conditional
+                    )
+                raise ValueError("No more races entries for user")
+
+            logger.info(stored_races)
+            aggregates = reduce(
+                __merge_aggregates, map(__get_race_aggregates, stored_races)
+            )
+            __store_summary(
+                event_id, track_id, user_id, aggregates, expected_version, conditional
+            )
+            return __get_summary_from_aggregates(aggregates)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            logger.info("Race summary changed during rebuild, rebuilding it again")
+
+
+def __add_race_to_summary(event_id, track_id, user_id, race: dict) -> dict:
+    """
+    Merge a newly stored race into the racer's persisted summary instead of
+    querying all of their races. Falls back to a rebuild when there is no
+    stored summary yet or it was changed concurrently.
+
+    The summary keeps the ids of the races it includes, so a race that a
+    concurrent rebuild already picked up is not merged a second time.
+    """
+    stored_summary = __get_stored_summary(event_id, track_id, user_id)
+    if stored_summary is None or stored_summary.get("raceIds") is None:
+        return __calculate_race_summary(event_id, track_id, user_id)
+
+    stored_aggregates = {key: stored_summary.get(key) for key in SUMMARY_AGGREGATE_KEYS}
+    if race["raceId"] in stored_summary["raceIds"]:
+        return __get_summary_from_aggregates(stored_aggregates)
+
+    aggregates = __merge_aggregates(stored_aggregates, __get_race_aggregates(race))
+    try:
+        __store_summary(
+            event_id, track_id, user_id, aggregates, stored_summary["version"]
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        logger.info("Race summary changed concurrently, rebuilding it")
+        return __calculate_race_summary(event_id, track_id, user_id)
+    return __get_summary_from_aggregates(aggregates)
+
+
+def __get_race_aggregates(race: dict) -> dict:
+    valid_lap_times = []
+    number_of_laps = 0
+    most_concecutive_laps = 0
+    concecutive_laps = 0
+    for lap in race["laps"]:
+        number_of_laps += 1
+        if bool(lap["isValid"]):
+            valid_lap_times.append(float(lap["time"]))
+            concecutive_laps += 1
+            most_concecutive_laps = max(most_concecutive_laps, concecutive_laps)
+        else:
+            concecutive_laps = 0
+
+    return {
+        "raceCount": 1,
+        "numberOfValidLaps": len(valid_lap_times),
+        "numberOfInvalidLaps": number_of_laps - len(valid_lap_times),
+        "validLapTimeSum": round(sum(valid_lap_times), 4),
         "fastestLapTime": min(valid_lap_times) if valid_lap_times else None,
-        "fastestAverageLap": average_lap,
-        "avgLapTime": mean(valid_lap_times),
-        "lapCompletionRatio": round(float(len(valid_laps) / total_number_of_laps), 1)
-        * 100,  # percentage
-        "avgLapsPerAttempt": round(avg_laps_per_attempt, 1),
-        "mostConcecutiveLaps": mostConcecutiveLaps,
+        "fastestAverageLap": __get_fastest_average_lap([race]),
+        "mostConcecutiveLaps": most_concecutive_laps,
+        "raceIds": [race["raceId"]],
     }
-    logger.info(summary)
-    return summary
 
 
-def __get_most_concecutive_laps(races: list) -> int:
-    most_concecutive_laps_over_all_races = []
-    for race in races:
-        most_concecutive_laps_of_race = 0
-        for lap in race["laps"]:
-            if bool(lap["isValid"]):
-                most_concecutive_laps_of_race += 1
-            else:
-                most_concecutive_laps_over_all_races.append(
-                    most_concecutive_laps_of_race
-                )
-                most_concecutive_laps_of_race = 0
-        most_concecutive_laps_over_all_races.append(most_concecutive_laps_of_race)
+def __merge_aggregates(a: dict, b: dict) -> dict:
+    fastest_lap_times = [
+        x["fastestLapTime"] for x in (a, b) if x["fastestLapTime"] is not None
+    ]
+    average_laps = [
+        x["fastestAverageLap"] for x in (a, b) if x["fastestAverageLap"] is not None
+    ]
+    return {
+        "raceCount": a["raceCount"] + b["raceCount"],
+        "numberOfValidLaps": a["numberOfValidLaps"] + b["numberOfValidLaps"],
+        "numberOfInvalidLaps": a["numberOfInvalidLaps"] + b["numberOfInvalidLaps"],
+        "validLapTimeSum": round(a["validLapTimeSum"] + b["validLapTimeSum"], 4),
+        "fastestLapTime": min(fastest_lap_times) if fastest_lap_times else None,
+        "fastestAverageLap": (
+            reduce(lambda x, y: x if x["avgTime"] < y["avgTime"] else y, average_laps)
+            if average_laps
+            else None
+        ),
+        "mostConcecutiveLaps": max(a["mostConcecutiveLaps"], b["mostConcecutiveLaps"]),
+        "raceIds": a["raceIds"] + b["raceIds"],
+    }
 
-    return max(most_concecutive_laps_over_all_races)
+
+def __get_summary_from_aggregates(aggregates: dict) -> dict:
+    number_of_valid_laps = aggregates["numberOfValidLaps"]
+    total_number_of_laps = number_of_valid_laps + aggregates["numberOfInvalidLaps"]
+
+    summary = {
+        "numberOfValidLaps": number_of_valid_laps,
+        "numberOfInvalidLaps": aggregates["numberOfInvalidLaps"],
+        "fastestLapTime": aggregates["fastestLapTime"],
+        "fastestAverageLap": aggregates["fastestAverageLap"],
+        "avgLapTime": (
+            aggregates["validLapTimeSum"] / number_of_valid_laps
+            if number_of_valid_laps
+            else None
+        ),
+        "lapCompletionRatio": round(
+            float(number_of_valid_laps / total_number_of_laps), 1
+        )
+        * 100,  # percentage
+        "avgLapsPerAttempt": round(total_number_of_laps / aggregates["raceCount"], 1),
+        "mostConcecutiveLaps": aggregates["mostConcecutiveLaps"],
+    }
+    logger.info(summary)
+    return summary
 
 
 def __get_fastest_average_lap(races: list) -> {}:
     avg_times = []
     for race in races:
         for avgLap in race["averageLaps"]:
-            avg_times.append(avgLap)
+            avg_times.append(dynamo_helpers.replace_decimal_with_float(dict(avgLap)))
     result = None
     if len(avg_times) > 0:
         result = reduce(lambda x, y: x if x["avgTime"] < y["avgTime"] else y, avg_times)
     return result
 
 
-def __get_laps_by_validity(races: list) -> tuple[list, list]:
-    valid_laps = []
-    invalid_laps = []
-    for race in races:
-        for lap in race["laps"]:
-            if bool(lap["isValid"]):
-                valid_laps.append(lap)
-            else:
-                invalid_laps.append(lap)
-    return valid_laps, invalid_laps
-
-
-def __get_valid_lap_times(laps: list) -> list:
-    if len(laps) > 0:
-        times = [x["time"] for x in laps]
-        logger.info(times)
-        return times
+def __get_stored_summary(event_id: str, track_id: str, user_id: str) -> dict:
+    response = ddbTable.get_item(
+        Key={"eventId": event_id, "sk": __generate_summary_sort_key(track_id, user_id)}
+    )
+    item = response.get("Item")
+    return dynamo_helpers.replace_decimal_with_float(item) if item else None
+
+
+def __store_summary(
+    event_id: str,
+    track_id: str,
+    user_id: str,
+    aggregates: dict,
+    expected_version: str = None,
+    conditional: bool = True,
+) -> None:
+    """
+    Write the summary with a new version. Unless conditional is False the
+    write only succeeds if the stored summary still has expected_version, or
+    doesn't exist when expected_version is None.
+    """
+    item = dynamo_helpers.replace_floats_with_decimal(
+        {
+            **aggregates,
+            "fastestAverageLap": (
+                dict(aggregates["fastestAverageLap"])
+                if aggregates["fastestAverageLap"]
+                else None
+            ),
+            "raceIds": list(aggregates["raceIds"]),
+            "eventId": event_id,
+            "sk": __generate_summary_sort_key(track_id, user_id),
+            "type": RACE_SUMMARY_TYPE,
+            "trackId": track_id,
+            "userId": user_id,
+            "version": str(uuid.uuid4()),
+        }
+    )
+    if not conditional:
+        ddbTable.put_item(Item=item)
+    else:
+        ddbTable.put_item(
+            Item=item,
+            ConditionExpression=__summary_version_condition(expected_version),
+        )
+
+
+def __delete_summary(
+    event_id: str,
+    track_id: str,
+    user_id: str,
+    expected_version: str,
+    conditional: bool = True,
+) -> None:
+    key = {"eventId": event_id, "sk": __generate_summary_sort_key(track_id, user_id)}
+    if not conditional:
+        ddbTable.delete_item(Key=key)
     else:
-        return None
+        ddbTable.delete_item(
+            Key=key, ConditionExpression=__summary_version_condition(expected_version)
+        )
+
+
+def __summary_version_condition(expected_version: str):
+    if expected_version is None:
+        return Attr("version").not_exists()
+    return Attr("version").eq(expected_version)
 
 
 def __get_races_by_event_id_and_user_id(
@@ -370,8 +542,108 @@ def __get_races_by_event_id_and_user_id(
     return dynamo_helpers.replace_decimal_with_float(response["Items"])
 
 
-def __put_evb_events(evbEvents: list) -> dict:
-    return cloudwatch_events.put_events(Entries=evbEvents)
+def __get_car_race_items(race: dict) -> list:
+    car_names = {lap.get("carName") for lap in race.get("laps") or []}
+    car_names.discard(None)
+    car_names.discard("")
+    if not race.get("createdAt") or not race.get("sk"):
+        return []
+    return [
+        {
+            "eventId": race["eventId"],
+            "sk": f"{race['sk']}#CAR#{car_name}",
+            "type": CAR_RACE_TYPE,
+            "carName": car_name,
+            "createdAt": race["createdAt"],
+            "raceSk": race["sk"],
+        }
+        for car_name in sorted(car_names)
+    ]
+
+
+def __get_car_race_keys(event_id: str, race_sort_key: str) -> list:
+    """Keys of the car race index items of a race."""
+    return car_race_history.collect_paginated(
+        lambda start_key: ddbTable.query(
+            **{
+                "KeyConditionExpression": Key("eventId").eq(event_id)
+                & Key("sk").begins_with(f"{race_sort_key}#CAR#"),
+                "ProjectionExpression": "eventId, sk",
+                **({"ExclusiveStartKey": start_key} if start_key else {}),
+            }
+        )
+    )
+
+
+def __store_car_races(races: list) -> None:
+    """
+    Add the car race index items of the races. Items of car names that were
+    edited out of a race are left behind; they are skipped when the races are
+    read. deleteRaces removes the items of the races it deletes.
+    """
+    with ddbTable.batch_writer(overwrite_by_pkeys=["eventId", "sk"]) as batch:
+        for race in races:
+            for item in __get_car_race_items(race):
+                batch.put_item(Item=item)
+
+
+def __backfill_car_race_index() -> list:
+    races = car_race_history.collect_paginated(
+        lambda start_key: ddbTable.scan(
+            **{
+                "FilterExpression": Attr("type").eq(RACE_TYPE),
+                **({"ExclusiveStartKey": start_key} if start_key else {}),
+            }
+        )
+    )
+    __store_car_races(races)
+    configTable.put_item(Item=CAR_RACE_INDEX_MARKER_KEY)
+    ddbTable.delete_item(Key=LEGACY_CAR_RACE_INDEX_MARKER_KEY)
+    logger.info(f"Backfilled the car race index from {len(races)} races")
+    return races
+
+
+def __get_races_by_activation_windows(windows: list) -> list:
+    race_keys = {}
+    for window in windows:
+        lower, upper = car_race_history.created_at_bounds(window)
+        key_condition = Key("carName").eq(window["carName"]) & (
+            Key("createdAt").between(lower, upper)
+            if upper
+            else Key("createdAt").gte(lower)
+        )
+        for item in car_race_history.collect_paginated(
+            lambda start_key: ddbTable.query(
+                **{
+                    "IndexName": CAR_RACE_INDEX_NAME,
+                    "KeyConditionExpression": key_condition,
+                    **({"ExclusiveStartKey": start_key} if start_key else {}),
+                }
+            )
+        ):
+            race_keys[(item["eventId"], item["raceSk"])] = None
+
+    keys = [{"eventId": event_id, "sk": sk} for event_id, sk in race_keys]
+    races = []
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        response = dynamo_helpers.batch_get_items(
+            {ddbTable.name: {"Keys": keys[i : i + BATCH_GET_SIZE]}}
+        )
+        races.extend(response[ddbTable.name])
+    return races
+
+
+def __put_evb_events(evbEvents: list) -> None:
+    for i in range(0, len(evbEvents), EVB_BATCH_SIZE):
+        response = cloudwatch_events.put_events(
+            Entries=evbEvents[i : i + EVB_BATCH_SIZE]
+        )
+        if response.get("FailedEntryCount"):
+            logger.error(
+                "Failed to put %s events: %s",
+                response["FailedEntryCount"],
+                [entry for entry in response["Entries"] if "ErrorCode" in entry],
+            )
 
 
 def __generate_sort_key(track_id: str, user_id: str, race_id: str = None) -> str:
@@ -381,3 +653,7 @@ def __generate_sort_key(track_id: str, user_id: str, race_id: str = None) -> str
     if race_id:
         sort_key = sort_key + f"#RACE#{race_id}"
     return sort_key
+
+
+def __generate_summary_sort_key(track_id: str, user_id: str) -> str:
+    return __generate_sort_key(track_id, user_id) + "#SUMMARY"
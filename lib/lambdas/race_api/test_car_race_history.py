@@ -1,3 +1,5 @@
+import random
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 
 import car_race_history as crh
@@ -66,6 +68,27 @@ def test_match_activation_is_time_bounded():
     assert crh.match_activation("OTHER", "2026-01-15T00:00:00Z", windows) is None
 
 
+def test_match_activation_picks_latest_matching_window():
+    random.seed(7)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    windows = []
+    for i in range(40):
+        frm = start + timedelta(days=random.randint(0, 60))
+        to = None if random.random() < 0.2 else frm + timedelta(days=random.randint(0, 20))
+        windows.append({"managedInstanceId": f"mi-{i}", "carName": random.choice("AB"),
+                        "frm": frm, "to": to})
+
+    for _ in range(500):
+        name = random.choice("ABC")
+        created = start + timedelta(hours=random.randint(-24, 24 * 90))
+        expected = None
+        for w in windows:
+            if w["carName"] == name and w["frm"] <= created and (w["to"] is None or created <= w["to"]):
+                if expected is None or w["frm"] > expected["frm"]:
+                    expected = w
+        assert crh.match_activation(name, created.isoformat(), windows) is expected
+
+
 def test_assemble_joins_two_hostnames_for_one_chassis():
     history = [
         {"managedInstanceId": "mi-1", "carName": "LGW01",
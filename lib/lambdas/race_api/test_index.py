@@ -1,12 +1,16 @@
+import json
 import os
 import sys
 from decimal import Decimal
 
+import pytest
+
 # index.py builds boto3 resources + reads required env at import time.
 os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-1")
 os.environ.setdefault("DDB_TABLE", "race-table-test")
 os.environ.setdefault("EVENT_BUS_NAME", "bus-test")
 os.environ.setdefault("CARS_HISTORY_TABLE", "cars-history-test")
+os.environ.setdefault("RACE_CONFIG_TABLE", "race-config-test")
 # dynamo_helpers ships as a Lambda layer; add it to the path for local import.
 sys.path.insert(
     0,
@@ -29,6 +33,25 @@ class _FakeTable:
         self.calls.append(("scan", kwargs))
         return {"Items": self._items}
 
+    def get_item(self, Key):
+        self.calls.append(("get_item", Key))
+        return {}
+
+    def put_item(self, Item):
+        self.calls.append(("put_item", Item))
+
+    def delete_item(self, Key):
+        self.calls.append(("delete_item", Key))
+
+    def batch_writer(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
 
 def test_get_car_race_history_joins_and_converts_decimals(monkeypatch):
     history = [
@@ -42,6 +65,7 @@ def test_get_car_race_history_joins_and_converts_decimals(monkeypatch):
     ]
     monkeypatch.setattr(index, "carsHistoryTable", _FakeTable(history))
     monkeypatch.setattr(index, "ddbTable", _FakeTable(races))
+    monkeypatch.setattr(index, "configTable", _FakeTable([]))
 
     out = index.getCarRaceHistory("AMSS-9QCJ")
 
@@ -51,9 +75,380 @@ def test_get_car_race_history_joins_and_converts_decimals(monkeypatch):
     assert isinstance(out["activations"][0]["races"][0]["laps"][0]["time"], float)
 
 
+def test_get_car_race_history_backfills_the_car_race_index(monkeypatch):
+    history = [
+        {"chassisSerial": "AMSS-9QCJ", "managedInstanceId": "mi-1", "carName": "LGW01",
+         "registrationDate": "2026-01-01T00:00:00Z", "deregisteredAt": None},
+    ]
+    races = [
+        {"raceId": "r1", "eventId": "e1", "trackId": "1", "type": "race",
+         "sk": "TRACK#1#USER#u1#RACE#r1", "createdAt": "2026-01-10T00:00:00Z",
+         "laps": [{"lapId": "l1", "carName": "LGW01", "time": Decimal("12.5"), "isValid": True},
+                  {"lapId": "l2", "carName": "LGW01", "time": Decimal("13.5"), "isValid": True}]},
+    ]
+    table = _FakeTable(races)
+    config = _FakeTable([])
+    monkeypatch.setattr(index, "carsHistoryTable", _FakeTable(history))
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "configTable", config)
+
+    index.getCarRaceHistory("AMSS-9QCJ")
+
+    puts = [item for call, item in table.calls if call == "put_item"]
+    assert puts == [
+        {"eventId": "e1", "sk": "TRACK#1#USER#u1#RACE#r1#CAR#LGW01",
+         "type": "race_car", "carName": "LGW01",
+         "createdAt": "2026-01-10T00:00:00Z", "raceSk": "TRACK#1#USER#u1#RACE#r1"},
+    ]
+    # The marker lives in the config table, not as a fake event in the race table
+    assert ("put_item", {"configKey": "CAR_RACE_INDEX_BACKFILLED"}) in config.calls
+    assert ("delete_item", {"eventId": "CAR_RACE_INDEX", "sk": "BACKFILLED"}) in table.calls
+
+
+def test_get_car_race_history_reads_races_through_the_car_race_index(monkeypatch):
+    history = [
+        {"chassisSerial": "AMSS-9QCJ", "managedInstanceId": "mi-1", "carName": "LGW01",
+         "registrationDate": "2026-01-01T00:00:00Z", "deregisteredAt": "2026-02-01T00:00:00Z"},
+    ]
+    race = {"raceId": "r1", "eventId": "e1", "trackId": "1", "type": "race",
+            "sk": "TRACK#1#USER#u1#RACE#r1", "createdAt": "2026-01-10T00:00:00Z",
+            "laps": [{"lapId": "l1", "carName": "LGW01", "time": Decimal("12.5"), "isValid": True}]}
+
+    class _IndexedTable(_FakeTable):
+        name = "race-table-test"
+
+        def scan(self, **kwargs):
+            raise AssertionError("the race table must not be scanned")
+
+    table = _IndexedTable(
+        [{"eventId": "e1", "raceSk": race["sk"]}, {"eventId": "e1", "raceSk": "deleted"}]
+    )
+    batch_keys = []
+
+    def batch_get_items(keys):
+        batch_keys.extend(keys["race-table-test"]["Keys"])
+        return {"race-table-test": [race]}
+
+    class _BackfilledConfig(_FakeTable):
+        def get_item(self, Key):
+            return {"Item": dict(Key)}
+
+    monkeypatch.setattr(index, "carsHistoryTable", _FakeTable(history))
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "configTable", _BackfilledConfig([]))
+    monkeypatch.setattr(index.dynamo_helpers, "batch_get_items", batch_get_items)
+
+    out = index.getCarRaceHistory("AMSS-9QCJ")
+
+    (call, query), = [c for c in table.calls if c[0] == "query"]
+    assert query["IndexName"] == "carName-createdAt-index"
+    _, created_at = query["KeyConditionExpression"].get_expression()["values"]
+    assert created_at.get_expression()["values"][1:] == ("2026-01-01", "2026-02-02")
+    assert batch_keys == [
+        {"eventId": "e1", "sk": race["sk"]},
+        {"eventId": "e1", "sk": "deleted"},
+    ]
+    assert out["summary"]["totalRaces"] == 1
+
+
 def test_get_car_race_history_empty_when_no_lineage(monkeypatch):
     monkeypatch.setattr(index, "carsHistoryTable", _FakeTable([]))
     monkeypatch.setattr(index, "ddbTable", _FakeTable([]))
     out = index.getCarRaceHistory("UNKNOWN")
     assert out["activations"] == []
     assert out["summary"]["totalRaces"] == 0
+
+
+class _RaceTable:
+    """In-memory race table keyed by (eventId, sk) for the summary tests."""
+
+    def __init__(self):
+        self.items = {}
+        self.queries = 0
+
+    def _check(self, key, condition):
+        # version = :v, or attribute_not_exists(version)
+        if condition is None:
+            return
+        expression = condition.get_expression()
+        expected = expression["values"][1] if len(expression["values"]) > 1 else None
+        if self.items.get(key, {}).get("version") != expected:
+            raise index.ClientError(
+                {"Error": {"Code": "ConditionalCheckFailedException", "Message": ""}},
+                "PutItem",
+            )
+
+    def put_item(self, Item, ConditionExpression=None):
+        key = (Item["eventId"], Item["sk"])
+        self._check(key, ConditionExpression)
+        self.items[key] = Item
+
+    def get_item(self, Key):
+        item = self.items.get((Key["eventId"], Key["sk"]))
+        return {"Item": item} if item else {}
+
+    def delete_item(self, Key, ConditionExpression=None):
+        key = (Key["eventId"], Key["sk"])
+        self._check(key, ConditionExpression)
+        self.items.pop(key, None)
+
+    def batch_writer(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def query(self, KeyConditionExpression, FilterExpression=None, **kwargs):
+        self.queries += 1
+        # eventId = :e AND begins_with(sk, :prefix), optionally type = :t
+        event_key, sk_key = KeyConditionExpression.get_expression()["values"]
+        event_id = event_key.get_expression()["values"][1]
+        prefix = sk_key.get_expression()["values"][1]
+        item_type = (
+            FilterExpression.get_expression()["values"][1] if FilterExpression else None
+        )
+        return {
+            "Items": [
+                dict(item)
+                for item in self.items.values()
+                if item_type in (None, item["type"])
+                and item["eventId"] == event_id
+                and item["sk"].startswith(prefix)
+            ]
+        }
+
+
+class _FakeEvents:
+    def __init__(self):
+        self.entries = []
+
+        self.batches = []
+
+    def put_events(self, Entries):
+        self.batches.append(len(Entries))
+        self.entries.extend(Entries)
+        return {"FailedEntryCount": 0}
+
+
+_RACES = [
+    (
+        [(9000.5, True), (8800.25, True), (12000.0, False), (8700.0, True)],
+        [{"startLapId": 0, "endLapId": 2, "avgTime": 8900.375}],
+    ),
+    ([(15000.0, False)], []),
+    (
+        [(8650.75, True), (8660.0, True), (8670.5, True), (8800.0, True)],
+        [{"startLapId": 1, "endLapId": 3, "avgTime": 8660.25}],
+    ),
+]
+
+
+def _add_races(races, user_id="u1", track_id="1"):
+    added = []
+    for laps, average_laps in races:
+        added.append(
+            index.addRace(
+                eventId="e1",
+                userId=user_id,
+                laps=[
+                    {"lapId": i, "time": time, "isValid": valid}
+                    for i, (time, valid) in enumerate(laps)
+                ],
+                racedByProxy=False,
+                averageLaps=[dict(avg) for avg in average_laps],
+                trackId=track_id,
+            )
+        )
+    return added
+
+
+def test_add_race_updates_summary_incrementally(monkeypatch):
+    table = _RaceTable()
+    events = _FakeEvents()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", events)
+
+    _add_races(_RACES)
+
+    # Only the first race, without a stored summary yet, queries the races
+    assert table.queries == 1
+    incremental = json.loads(events.entries[-1]["Detail"])
+    rebuilt = getattr(index, "__calculate_race_summary")("e1", "1", "u1")
+
+    assert incremental["numberOfValidLaps"] == rebuilt["numberOfValidLaps"] == 7
+    assert incremental["numberOfInvalidLaps"] == rebuilt["numberOfInvalidLaps"] == 2
+    assert incremental["fastestLapTime"] == rebuilt["fastestLapTime"] == 8650.75
+    assert incremental["fastestAverageLap"] == rebuilt["fastestAverageLap"]
+    assert rebuilt["fastestAverageLap"]["avgTime"] == 8660.25
+    assert incremental["avgLapTime"] == pytest.approx(rebuilt["avgLapTime"])
+    assert incremental["avgLapTime"] == pytest.approx(
+        (9000.5 + 8800.25 + 8700.0 + 8650.75 + 8660.0 + 8670.5 + 8800.0) / 7
+    )
+    assert incremental["lapCompletionRatio"] == rebuilt["lapCompletionRatio"]
+    assert incremental["avgLapsPerAttempt"] == rebuilt["avgLapsPerAttempt"] == 3.0
+    assert incremental["mostConcecutiveLaps"] == rebuilt["mostConcecutiveLaps"] == 4
+
+
+def test_add_race_rebuilds_summary_changed_concurrently(monkeypatch):
+    table = _RaceTable()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", _FakeEvents())
+    _add_races(_RACES[:1])
+
+    get_item = table.get_item
+
+    def stale_get_item(Key):
+        # only the first read after the race is stored sees a stale summary
+        monkeypatch.setattr(table, "get_item", get_item)
+        response = get_item(Key)
+        return {"Item": {**response["Item"], "version": "stale"}}
+
+    monkeypatch.setattr(table, "get_item", stale_get_item)
+    _add_races(_RACES[1:2])
+
+    assert table.queries == 2
+    summary = table.items[("e1", "TRACK#1#USER#u1#SUMMARY")]
+    assert summary["raceCount"] == 2
+    assert summary["numberOfInvalidLaps"] == 2
+
+
+def test_add_race_does_not_merge_a_race_a_rebuild_already_included(monkeypatch):
+    table = _RaceTable()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", _FakeEvents())
+    _add_races(_RACES[:1])
+
+    get_stored_summary = getattr(index, "__get_stored_summary")
+    rebuilds = []
+
+    def rebuild_then_get_stored_summary(event_id, track_id, user_id):
+        # a concurrent rebuild runs after the race is stored, before it is merged
+        if not rebuilds:
+            rebuilds.append(1)
+            getattr(index, "__calculate_race_summary")(event_id, track_id, user_id)
+        return get_stored_summary(event_id, track_id, user_id)
+
+    monkeypatch.setattr(index, "__get_stored_summary", rebuild_then_get_stored_summary)
+    _add_races(_RACES[1:3])
+
+    summary = table.items[("e1", "TRACK#1#USER#u1#SUMMARY")]
+    assert rebuilds == [1]
+    assert summary["raceCount"] == 3
+    assert len(summary["raceIds"]) == 3
+    assert summary["numberOfValidLaps"] == 7
+    assert summary["numberOfInvalidLaps"] == 2
+
+
+def test_rebuild_retries_when_a_race_is_merged_meanwhile(monkeypatch):
+    table = _RaceTable()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", _FakeEvents())
+    _add_races(_RACES[:1])
+
+    query = table.query
+    merged = []
+
+    def query_then_merge(**kwargs):
+        response = query(**kwargs)
+        # another race is added and merged after the rebuild read the races
+        if not merged:
+            merged.append(1)
+            _add_races(_RACES[2:3])
+        return response
+
+    monkeypatch.setattr(table, "query", query_then_merge)
+    getattr(index, "__calculate_race_summary")("e1", "1", "u1")
+
+    summary = table.items[("e1", "TRACK#1#USER#u1#SUMMARY")]
+    assert summary["raceCount"] == 2
+    assert summary["numberOfValidLaps"] == 7
+
+
+def test_summary_is_removed_with_the_last_race(monkeypatch):
+    table = _RaceTable()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", _FakeEvents())
+    _add_races(_RACES[1:2])
+
+    for key in [key for key, item in table.items.items() if item["type"] == "race"]:
+        del table.items[key]
+
+    with pytest.raises(ValueError):
+        getattr(index, "__calculate_race_summary")("e1", "1", "u1")
+    assert table.items == {}
+
+
+def test_delete_races_publishes_one_event_per_racer_and_track(monkeypatch):
+    table = _RaceTable()
+    events = _FakeEvents()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", events)
+
+    to_delete = []
+    for i in range(12):
+        for race in _add_races(_RACES[:2], user_id=f"u{i}", track_id=str(i % 2 + 1)):
+            to_delete.append(race)
+    kept = _add_races(_RACES[2:], user_id="u0", track_id="1")
+    events.entries.clear()
+    events.batches.clear()
+    table.queries = 0
+
+    out = index.deleteRaces(
+        "e1",
+        [
+            {"userId": r["userId"], "raceId": r["raceId"], "trackId": r["trackId"]}
+            for r in to_delete
+        ],
+    )
+
+    assert len(out["raceIds"]) == 24
+    # One car race index lookup per race, one summary rebuild per racer
+    assert table.queries == 24 + 12
+    assert events.batches == [10, 2]
+    details = [json.loads(entry["Detail"]) for entry in events.entries]
+    assert [(d["userId"], d["trackId"]) for d in details] == [
+        (f"u{i}", str(i % 2 + 1)) for i in range(12)
+    ]
+    assert [entry["DetailType"] for entry in events.entries] == [
+        "raceSummaryUpdated"
+    ] + ["raceSummaryDeleted"] * 11
+    assert details[0]["numberOfValidLaps"] == 4
+    assert kept[0]["raceId"] in {item.get("raceId") for item in table.items.values()}
+
+
+def test_delete_races_removes_their_car_race_index_items(monkeypatch):
+    table = _RaceTable()
+    monkeypatch.setattr(index, "ddbTable", table)
+    monkeypatch.setattr(index, "cloudwatch_events", _FakeEvents())
+
+    races = [
+        index.addRace(
+            eventId="e1",
+            userId="u1",
+            laps=[
+                {"lapId": 0, "time": 9000.0, "isValid": True, "carName": "LGW01"},
+                {"lapId": 1, "time": 9100.0, "isValid": True, "carName": "LGW02"},
+            ],
+            racedByProxy=False,
+            averageLaps=[],
+            trackId="1",
+        )
+        for _ in range(2)
+    ]
+    car_race_items = [item for item in table.items.values() if item["type"] == "race_car"]
+    assert len(car_race_items) == 4
+
+    deleted, kept = races
+    index.deleteRaces(
+        "e1",
+        [{"userId": "u1", "raceId": deleted["raceId"], "trackId": "1"}],
+    )
+
+    remaining = [item for item in table.items.values() if item["type"] == "race_car"]
+    assert sorted(item["carName"] for item in remaining) == ["LGW01", "LGW02"]
+    assert {item["raceSk"] for item in remaining} == {
+        f"TRACK#1#USER#u1#RACE#{kept['raceId']}"
+    }
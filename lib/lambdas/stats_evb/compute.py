@@ -5,7 +5,7 @@ No I/O, no network calls. Ported from drem-api-stats/compute.py.
 from typing import Optional
 from models import (
     RacerStats, TrackStats, EventStats, RacerEventSummary,
-    MIN_VALID_LAP_MS,
+    MIN_VALID_LAP_MS, FASTEST_LAPS_MAX,
 )
 
 
@@ -41,30 +41,38 @@ def compute_event_stats(
         total_races=len(races),
     )
 
+    # Single pass over all laps, grouped by (track, racer). Lookups are
+    # hoisted out of the lap loop, which runs once per lap of the event.
+    user_map = user_map or {}
     for race in races:
         track_id = race.get("trackId") or "unknown"
-        if track_id not in stats.tracks:
-            stats.tracks[track_id] = TrackStats(track_id=track_id)
-        track = stats.tracks[track_id]
+        track = stats.tracks.get(track_id)
+        if track is None:
+            track = stats.tracks[track_id] = TrackStats(track_id=track_id)
 
         uid = race["userId"]
-        if uid not in track.racers:
-            user_info = (user_map or {}).get(uid, {})
-            track.racers[uid] = RacerStats(
+        racer = track.racers.get(uid)
+        if racer is None:
+            user_info = user_map.get(uid, {})
+            racer = track.racers[uid] = RacerStats(
                 user_id=uid,
                 username=user_info.get("username"),
                 country_code=user_info.get("countryCode"),
             )
-        racer = track.racers[uid]
         racer.race_count += 1
 
+        valid_lap_times = racer.valid_lap_times
+        invalid_laps = 0
+        resets = 0
         for lap in (race.get("laps") or []):
             t = lap.get("time")
             if lap.get("isValid") and t is not None and t >= MIN_VALID_LAP_MS:
-                racer.valid_lap_times.append(float(t))
+                valid_lap_times.append(float(t))
             else:
-                racer.invalid_lap_count += 1
-            racer.total_resets += lap.get("resets") or 0
+                invalid_laps += 1
+            resets += lap.get("resets") or 0
+        racer.invalid_lap_count += invalid_laps
+        racer.total_resets += resets
 
         for window in (race.get("averageLaps") or []):
             avg = window.get("avgTime")
@@ -109,3 +117,147 @@ def build_racer_event_summary(
             total_resets=racer.total_resets,
         ))
     return summaries
+
+
+def build_event_partial(event_stats: EventStats) -> dict:
+    """
+    Reduce an event's stats to its contribution to the global stats.
+
+    Partials are stored per event, so a race change only recomputes the
+    partial of its own event; merge_event_partials() then combines the
+    partials of all events into the global stats. Only the event's top
+    FASTEST_LAPS_MAX laps are kept: the global lists never need more from a
+    single event.
+    """
+    track_type = event_stats.race_config.get("trackType") or ""
+    racer_ids = []
+    total_laps = 0
+    fastest_laps = []
+    for uid, racer in event_stats.merged_racers.items():
+        racer_ids.append(uid)
+        total_laps += racer.total_lap_count
+        if racer.best_lap_time_ms is not None:
+            fastest_laps.append({
+                "username": racer.username or uid[:8],
+                "eventName": event_stats.event_name,
+                # `event_type` may be None for legacy events without a
+                # typeOfEvent; fall back to "OTHER" so the field is
+                # never null (matches the GraphQL `String!` type) and
+                # frontend filters can still bucket those entries.
+                "typeOfEvent": event_stats.event_type or "OTHER",
+                "trackType": track_type,
+                "lapTimeMs": racer.best_lap_time_ms,
+                "eventDate": event_stats.event_date,
+            })
+    fastest_laps.sort(key=lambda x: x["lapTimeMs"])
+
+    return {
+        "eventId": event_stats.event_id,
+        "countryCode": event_stats.country_code,
+        "month": (event_stats.event_date or "")[:7],
+        "eventType": event_stats.event_type,
+        "trackType": track_type,
+        "totalRaces": event_stats.total_races,
+        "totalLaps": total_laps,
+        "totalValidLaps": event_stats.total_valid_laps,
+        "bestLapMs": event_stats.overall_best_lap_ms,
+        "racerIds": racer_ids,
+        "fastestLaps": fastest_laps[:FASTEST_LAPS_MAX],
+    }
+
+
+def merge_event_partials(partials: list[dict]) -> dict:
+    """
+    Combine per-event partials (see build_event_partial) into the global
+    stats, i.e. the GLOBAL/TOTALS item without its keys.
+    """
+    total_racers = set()
+    total_laps = 0
+    total_valid_laps = 0
+    countries = set()
+    events_by_country = {}
+    events_by_month = {}
+    event_type_counts = {}
+    track_type_counts = {}
+    fastest_laps = []
+
+    for partial in partials:
+        racer_count = len(partial["racerIds"])
+        country = partial["countryCode"]
+        if country:
+            countries.add(country)
+            events_by_country.setdefault(country, {"events": 0, "racers": 0, "laps": 0})
+            events_by_country[country]["events"] += 1
+            events_by_country[country]["racers"] += racer_count
+            events_by_country[country]["laps"] += partial["totalValidLaps"]
+
+        month = partial["month"]
+        if month:
+            events_by_month.setdefault(month, {"events": 0, "races": 0, "laps": 0})
+            events_by_month[month]["events"] += 1
+            events_by_month[month]["races"] += partial["totalRaces"]
+            events_by_month[month]["laps"] += partial["totalValidLaps"]
+
+        event_type = partial["eventType"]
+        if event_type:
+            event_type_counts[event_type] = event_type_counts.get(event_type, 0) + 1
+
+        track_type = partial["trackType"]
+        if track_type:
+            track_type_counts.setdefault(track_type, {"count": 0, "bestLapMs": None})
+            track_type_counts[track_type]["count"] += 1
+            best = partial["bestLapMs"]
+            if best is not None:
+                current = track_type_counts[track_type]["bestLapMs"]
+                if current is None or best < current:
+                    track_type_counts[track_type]["bestLapMs"] = best
+
+        total_racers.update(partial["racerIds"])
+        total_laps += partial["totalLaps"]
+        total_valid_laps += partial["totalValidLaps"]
+        fastest_laps.extend(partial["fastestLaps"])
+
+    fastest_laps.sort(key=lambda x: x["lapTimeMs"])
+
+    # Group by trackType and keep the top N for each. Cheap to compute here
+    # — the full sorted list is already in memory — and lets the UI flip
+    # between tracks without a per-track query. Empty-string trackTypes
+    # (events with no trackType set on raceConfig) are skipped so the
+    # UI's track-selector doesn't show a blank tab.
+    fastest_laps_by_track: dict[str, list[dict]] = {}
+    for lap in fastest_laps:
+        track_type = lap.get("trackType") or ""
+        if not track_type:
+            continue
+        bucket = fastest_laps_by_track.setdefault(track_type, [])
+        if len(bucket) < FASTEST_LAPS_MAX:
+            bucket.append(lap)
+
+    return {
+        "totalEvents": len(partials),
+        "totalRacers": len(total_racers),
+        "totalLaps": total_laps,
+        "totalValidLaps": total_valid_laps,
+        "totalCountries": len(countries),
+        "eventsByCountry": [
+            {"countryCode": cc, **data}
+            for cc, data in sorted(events_by_country.items())
+        ],
+        "eventsByMonth": [
+            {"month": m, **data}
+            for m, data in sorted(events_by_month.items())
+        ],
+        "eventTypeBreakdown": [
+            {"typeOfEvent": t, "count": c}
+            for t, c in sorted(event_type_counts.items())
+        ],
+        "trackTypeBreakdown": [
+            {"trackType": t, **data}
+            for t, data in sorted(track_type_counts.items())
+        ],
+        "fastestLapsEver": fastest_laps[:FASTEST_LAPS_MAX],
+        "fastestLapsByTrack": [
+            {"trackType": track_type, "entries": entries}
+            for track_type, entries in sorted(fastest_laps_by_track.items())
+        ],
+    }
@@ -1,19 +1,40 @@
 #!/usr/bin/python3
 # encoding=utf-8
 """
-Stats EVB Lambda — triggered by raceSummary EventBridge events.
+Stats EVB Lambda — triggered by raceSummary and event EventBridge events.
 Reads race + event data, computes stats, writes to StatsTable.
+
+Race summary and event changes only mark their event as dirty
+(DIRTY / <eventId>); a deleted event also loses its partial right away. A
+scheduled flush recomputes each dirty event once, however many races it
+received since the last flush, so a burst of submitted races costs one
+recompute per event instead of one per race.
+
+Global stats are aggregated incrementally: each event's contribution is
+stored as a partial item (EVENT#<eventId> / EVENT_PARTIAL), a flush
+recomputes only the partials of the dirty events, and the partials are
+merged into GLOBAL/TOTALS. A full rebuild (scripts/drem_rebuild_stats.py)
+recomputes every partial from the events and race tables.
 """
+import copy
 import json
 import os
+import uuid
 from decimal import Decimal
 
 import boto3
 import dynamo_helpers
+import user_cache
 from aws_lambda_powertools import Logger, Tracer
 from boto3.dynamodb.conditions import Attr, Key
-
-from compute import compute_event_stats, build_racer_event_summary
+from botocore.exceptions import ClientError
+
+from compute import (
+    build_event_partial,
+    build_racer_event_summary,
+    compute_event_stats,
+    merge_event_partials,
+)
 from models import MIN_VALID_LAP_MS
 
 tracer = Tracer()
@@ -31,7 +52,14 @@ stats_table = dynamodb.Table(STATS_TABLE_NAME)
 race_table = dynamodb.Table(RACE_TABLE_NAME)
 events_table = dynamodb.Table(EVENTS_TABLE_NAME)
 
-FASTEST_LAPS_MAX = 10
+PARTIAL_SK = "EVENT_PARTIAL"
+PARTIALS_INDEX = "sk-pk-index"
+# Written by a full rebuild once the partials of all events exist
+PARTIALS_MARKER_KEY = {"pk": "GLOBAL", "sk": "PARTIALS"}
+EXCLUDED_EVENT_TYPES = {"TEST_EVENT"}
+REBUILD_DETAIL_TYPE = "statsRebuildRequested"
+FLUSH_DETAIL_TYPE = "Scheduled Event"
+DIRTY_PK = "DIRTY"
 
 
 @tracer.capture_lambda_handler
@@ -40,46 +68,117 @@ def lambda_handler(evb_event, context):
 
     detail_type = evb_event["detail-type"]
     detail = evb_event["detail"]
+    if detail_type == REBUILD_DETAIL_TYPE:
+        _rebuild_global_stats()
+        return
+    if detail_type == FLUSH_DETAIL_TYPE:
+        _flush_dirty_events()
+        return
+
     event_id = detail["eventId"]
-    user_id = detail["userId"]
-    track_id = detail.get("trackId", "unknown")
 
-    if "raceSummaryDeleted" in detail_type:
-        _handle_delete(event_id, user_id, track_id)
-    elif "raceSummaryAdded" in detail_type or "raceSummaryUpdated" in detail_type:
-        _handle_upsert(event_id, user_id)
+    if (
+        "raceSummaryDeleted" in detail_type
+        or "raceSummaryAdded" in detail_type
+        or "raceSummaryUpdated" in detail_type
+        # An edited event may have changed type, country, date or track type
+        or "eventAdded" in detail_type
+        or "eventUpdated" in detail_type
+    ):
+        _mark_event_dirty(event_id)
+    elif "eventDeleted" in detail_type:
+        # Drop the partial right away; the flush then merges the totals without it
+        stats_table.delete_item(Key=_partial_key(event_id))
+        _mark_event_dirty(event_id)
     else:
         logger.warning(f"Unsupported detail_type: {detail_type}")
 
 
-def _handle_upsert(event_id: str, user_id: str):
-    """Recompute stats for the racer and update global aggregates."""
+def _mark_event_dirty(event_id: str):
+    """Queue the event for the next flush; repeated marks coalesce into one."""
+    stats_table.put_item(
+        Item={"pk": DIRTY_PK, "sk": event_id, "token": str(uuid.uuid4())}
+    )
+
+
+def _flush_dirty_events():
+    """
+    Recompute the partial of every dirty event once and merge all partials
+    into the global stats. A marker is only cleared if the event wasn't
+    marked again during the flush, so races arriving meanwhile are picked up
+    by the next flush.
+    """
+    markers = _query_dirty_markers()
+    if not markers:
+        return
+
+    if "Item" in stats_table.get_item(Key=PARTIALS_MARKER_KEY):
+        partials = {p["eventId"]: p for p in _query_event_partials()}
+        for marker in markers:
+            event_id = marker["sk"]
+            partial = _compute_event_partial(event_id)
+            if partial:
+                _put_event_partial(partial)
+                partials[event_id] = partial
+            else:
+                stats_table.delete_item(Key=_partial_key(event_id))
+                partials.pop(event_id, None)
+        _put_global_stats(list(partials.values()))
+    else:
+        logger.info("No event partials yet, rebuilding global stats")
+        _rebuild_global_stats()
+
+    for marker in markers:
+        _clear_dirty_marker(marker)
+    logger.info(f"Flushed {len(markers)} dirty events")
+
+
+def _query_dirty_markers() -> list[dict]:
+    items = []
+    kwargs = {"KeyConditionExpression": Key("pk").eq(DIRTY_PK)}
+    while True:
+        response = stats_table.query(**kwargs)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    return items
+
+
+def _clear_dirty_marker(marker: dict):
+    try:
+        stats_table.delete_item(
+            Key={"pk": DIRTY_PK, "sk": marker["sk"]},
+            ConditionExpression=Attr("token").eq(marker["token"]),
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        logger.info(f"Event {marker['sk']} marked again during flush, keeping it")
+
+
+def _compute_event_partial(event_id: str) -> dict | None:
+    """
+    Recompute an event's partial from its races, or None if the event no
+    longer counts towards the global stats.
+    """
     event = _get_event(event_id)
     if not event:
-        logger.warning(f"Event {event_id} not found, skipping")
-        return
+        logger.warning(f"Event {event_id} not found, removing its stats")
+        return None
 
     races = _get_all_races_for_event(event_id)
-
-    unique_user_ids = list({r["userId"] for r in races})
-    user_map = {}
-    for uid in unique_user_ids:
-        username, country_code = _get_username_by_user_id(uid)
-        user_map[uid] = {"username": username, "countryCode": country_code}
+    user_map = _get_user_map({r["userId"] for r in races})
 
     event_data = dynamo_helpers.replace_decimal_with_float(event)
     races_data = dynamo_helpers.replace_decimal_with_float(races)
     event_stats = compute_event_stats(event_data, races_data, user_map=user_map)
     if not event_stats:
         logger.info(f"No stats computed for event {event_id}")
-        return
-
-    _rebuild_global_stats()
-
-
-def _handle_delete(event_id: str, user_id: str, track_id: str):
-    """Handle race deletion — recompute from scratch."""
-    _handle_upsert(event_id, user_id)
+        return None
+    if event_stats.event_type in EXCLUDED_EVENT_TYPES:
+        return None
+    return build_event_partial(event_stats)
 
 
 def _get_event(event_id: str) -> dict | None:
@@ -106,25 +205,16 @@ def _get_all_races_for_event(event_id: str) -> list[dict]:
     return items
 
 
-def _get_username_by_user_id(user_id: str) -> tuple[str, str]:
-    """Look up username and countryCode from Cognito (single-user path)."""
-    try:
-        response = cognito_client.list_users(
-            UserPoolId=USER_POOL_ID,
-            Filter=f'sub = "{user_id}"',
-        )
-        if not response["Users"]:
-            return user_id[:8], ""
-        user = response["Users"][0]
-        username = user["Username"]
-        country_code = ""
-        for attr in user["Attributes"]:
-            if attr["Name"] == "custom:countryCode":
-                country_code = attr["Value"]
-        return username, country_code
-    except Exception as e:
-        logger.warning(f"Cognito lookup failed for {user_id}: {e}")
-        return user_id[:8], ""
+def _get_user_map(user_ids) -> dict[str, dict]:
+    """
+    Look up usernames and countryCodes in the shared user cache, in bulk.
+    Racers no longer in Cognito fall back to the sub prefix.
+    """
+    users = user_cache.get_users(USER_POOL_ID, user_ids)
+    return {
+        uid: users.get(uid) or {"username": uid[:8], "countryCode": ""}
+        for uid in user_ids
+    }
 
 
 def _load_user_pool_index() -> dict[str, dict]:
@@ -163,37 +253,24 @@ def _load_user_pool_index() -> dict[str, dict]:
         pagination_token = response.get("PaginationToken")
         if not pagination_token:
             break
+    # Refresh the shared user cache while we have the whole pool anyway
+    user_cache.put_users(index)
     return index
 
 
 def _rebuild_global_stats():
     """
-    Scan ALL events + races to rebuild global aggregates.
-
-    For Phase 1 this is a full scan. Acceptable because:
-    - Stats Lambda runs async (EVB trigger, not in request path)
-    - Typical DREM deployment has <100 events, <10k races
-    - Timeout is 5 minutes
+    Scan ALL events + races to rebuild every event partial and the global
+    aggregates. Also removes partials of events that no longer exist.
     """
     events = _scan_all_events()
 
-    total_events = 0
-    total_racers = set()
-    total_laps = 0
-    total_valid_laps = 0
-    countries = set()
-    events_by_country = {}
-    events_by_month = {}
-    event_type_counts = {}
-    track_type_counts = {}
-    fastest_laps = []
     # One paginated ListUsers scan up front — turns N sub-filter calls
     # (one per racer, ~50ms each) into ~N/60 paginated pages, keeping
     # the rebuild well inside the 5-minute Lambda timeout.
     user_index = _load_user_pool_index()
 
-    EXCLUDED_EVENT_TYPES = {"TEST_EVENT"}
-
+    partials = []
     for event in events:
         event_id = event["eventId"]
         event_data = dynamo_helpers.replace_decimal_with_float(event)
@@ -210,7 +287,8 @@ def _rebuild_global_stats():
         # rather than the truncated Cognito sub (matches the leaderboard).
         # user_index is the whole user pool keyed by sub — a missing sub
         # (deleted racer) is left out, and the `racer.username or uid[:8]`
-        # fallback below preserves the previous behaviour for those rows.
+        # fallback in build_event_partial preserves the previous behaviour
+        # for those rows.
         user_map = {
             uid: user_index[uid]
             for uid in {r["userId"] for r in races}
@@ -220,109 +298,67 @@ def _rebuild_global_stats():
         event_stats = compute_event_stats(event_data, races_data, user_map=user_map)
         if not event_stats:
             continue
-
-        total_events += 1
-        country = event_stats.country_code
-        if country:
-            countries.add(country)
-            events_by_country.setdefault(country, {"events": 0, "racers": 0, "laps": 0})
-            events_by_country[country]["events"] += 1
-            events_by_country[country]["racers"] += event_stats.total_racers
-            events_by_country[country]["laps"] += event_stats.total_valid_laps
-
-        month = (event_stats.event_date or "")[:7]
-        if month:
-            events_by_month.setdefault(month, {"events": 0, "races": 0, "laps": 0})
-            events_by_month[month]["events"] += 1
-            events_by_month[month]["races"] += event_stats.total_races
-            events_by_month[month]["laps"] += event_stats.total_valid_laps
-
-        event_type = event_stats.event_type
-        if event_type:
-            event_type_counts[event_type] = event_type_counts.get(event_type, 0) + 1
-
-        track_type = (event_stats.race_config.get("trackType") or "")
-        if track_type:
-            track_type_counts.setdefault(track_type, {"count": 0, "bestLapMs": None})
-            track_type_counts[track_type]["count"] += 1
-            best = event_stats.overall_best_lap_ms
-            if best is not None:
-                current = track_type_counts[track_type]["bestLapMs"]
-                if current is None or best < current:
-                    track_type_counts[track_type]["bestLapMs"] = best
-
-        for uid, racer in event_stats.merged_racers.items():
-            total_racers.add(uid)
-            total_laps += racer.total_lap_count
-            total_valid_laps += racer.valid_lap_count
-
-            if racer.best_lap_time_ms is not None:
-                fastest_laps.append({
-                    "username": racer.username or uid[:8],
-                    "eventName": event_stats.event_name,
-                    # `event_type` may be None for legacy events without a
-                    # typeOfEvent; fall back to "OTHER" so the field is
-                    # never null (matches the GraphQL `String!` type) and
-                    # frontend filters can still bucket those entries.
-                    "typeOfEvent": event_type or "OTHER",
-                    "trackType": track_type,
-                    "lapTimeMs": racer.best_lap_time_ms,
-                    "eventDate": event_stats.event_date,
-                })
-
-    fastest_laps.sort(key=lambda x: x["lapTimeMs"])
-
-    # Group by trackType and keep the top N for each. Cheap to compute here
-    # — the full sorted list is already in memory — and lets the UI flip
-    # between tracks without a per-track query. Empty-string trackTypes
-    # (events with no trackType set on raceConfig) are skipped so the
-    # UI's track-selector doesn't show a blank tab.
-    fastest_laps_by_track: dict[str, list[dict]] = {}
-    for lap in fastest_laps:
-        track_type = lap.get("trackType") or ""
-        if not track_type:
-            continue
-        bucket = fastest_laps_by_track.setdefault(track_type, [])
-        if len(bucket) < FASTEST_LAPS_MAX:
-            bucket.append(lap)
-
-    fastest_laps = fastest_laps[:FASTEST_LAPS_MAX]
-
-    global_stats = {
-        "pk": "GLOBAL",
-        "sk": "TOTALS",
-        "totalEvents": total_events,
-        "totalRacers": len(total_racers),
-        "totalLaps": total_laps,
-        "totalValidLaps": total_valid_laps,
-        "totalCountries": len(countries),
-        "eventsByCountry": [
-            {"countryCode": cc, **data}
-            for cc, data in sorted(events_by_country.items())
-        ],
-        "eventsByMonth": [
-            {"month": m, **data}
-            for m, data in sorted(events_by_month.items())
-        ],
-        "eventTypeBreakdown": [
-            {"typeOfEvent": t, "count": c}
-            for t, c in sorted(event_type_counts.items())
-        ],
-        "trackTypeBreakdown": [
-            {"trackType": t, **data}
-            for t, data in sorted(track_type_counts.items())
-        ],
-        "fastestLapsEver": fastest_laps,
-        "fastestLapsByTrack": [
-            {"trackType": track_type, "entries": entries}
-            for track_type, entries in sorted(fastest_laps_by_track.items())
-        ],
-    }
-
+        partials.append(build_event_partial(event_stats))
+
+    current_event_ids = {p["eventId"] for p in partials}
+    stale_event_ids = [
+        p["eventId"]
+        for p in _query_event_partials()
+        if p["eventId"] not in current_event_ids
+    ]
+    with stats_table.batch_writer() as batch:
+        for partial in partials:
+            batch.put_item(Item=_partial_item(partial))
+        for event_id in stale_event_ids:
+            batch.delete_item(Key=_partial_key(event_id))
+
+    stats_table.put_item(Item={**PARTIALS_MARKER_KEY, "events": len(partials)})
+    _put_global_stats(partials)
+
+
+def _put_global_stats(partials: list[dict]):
+    """Merge the event partials and write the GLOBAL/TOTALS item."""
+    global_stats = {"pk": "GLOBAL", "sk": "TOTALS", **merge_event_partials(partials)}
     stats_table.put_item(
         Item=dynamo_helpers.replace_floats_with_decimal(global_stats)
     )
-    logger.info(f"Global stats written: {total_events} events, {len(total_racers)} racers")
+    logger.info(
+        f"Global stats written: {global_stats['totalEvents']} events, "
+        f"{global_stats['totalRacers']} racers"
+    )
+
+
+def _partial_key(event_id: str) -> dict:
+    return {"pk": f"EVENT#{event_id}", "sk": PARTIAL_SK}
+
+
+def _partial_item(partial: dict) -> dict:
+    """Stats table item for an event partial."""
+    item = {**_partial_key(partial["eventId"]), **copy.deepcopy(partial)}
+    return dynamo_helpers.replace_floats_with_decimal(item)
+
+
+def _put_event_partial(partial: dict):
+    stats_table.put_item(Item=_partial_item(partial))
+
+
+def _query_event_partials() -> list[dict]:
+    """Read the partials of all events through the sk-pk GSI."""
+    items = []
+    kwargs = {
+        "IndexName": PARTIALS_INDEX,
+        "KeyConditionExpression": Key("sk").eq(PARTIAL_SK),
+    }
+    while True:
+        response = stats_table.query(**kwargs)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    for item in items:
+        item.pop("pk", None)
+        item.pop("sk", None)
+    return dynamo_helpers.replace_decimal_with_float(items)
 
 
 def _scan_all_events() -> list[dict]:
@@ -1,9 +1,11 @@
 """Data models for stats computation. Pure dataclasses, no I/O."""
 import statistics
 from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Optional
 
 MIN_VALID_LAP_MS = 5000  # sub-5s laps are data artefacts
+FASTEST_LAPS_MAX = 10  # entries kept per fastest-laps list
 
 
 @dataclass
@@ -71,9 +73,15 @@ class EventStats:
     tracks: dict = field(default_factory=dict)  # track_id -> TrackStats
     total_races: int = 0
 
-    @property
+    @cached_property
     def merged_racers(self) -> dict:
-        """Single merged view of all racers across all tracks."""
+        """
+        Single merged view of all racers across all tracks.
+
+        Built on first access and cached: the global stats read it (and the
+        properties based on it) several times per event, and the tracks are
+        not modified once compute_event_stats has returned.
+        """
         merged: dict[str, RacerStats] = {}
         for track in self.tracks.values():
             for uid, rs in track.racers.items():
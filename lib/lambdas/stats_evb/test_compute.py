@@ -3,8 +3,11 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 
-from compute import compute_event_stats, build_racer_event_summary
-from models import MIN_VALID_LAP_MS
+from compute import (
+    compute_event_stats, build_racer_event_summary,
+    build_event_partial, merge_event_partials,
+)
+from models import MIN_VALID_LAP_MS, FASTEST_LAPS_MAX
 
 
 def _make_event(**overrides):
@@ -107,6 +110,18 @@ class TestComputeEventStats:
         racer = stats.merged_racers["user-1"]
         assert racer.total_resets == 3
 
+    def test_merged_racers_combines_tracks_once(self):
+        race1 = _make_race(track_id="track-1", laps=[_make_lap(7000)])
+        race2 = _make_race(track_id="track-2", laps=[_make_lap(6500, resets=1)])
+        stats = compute_event_stats(_make_event(), [race1, race2])
+        merged = stats.merged_racers
+        assert merged is stats.merged_racers
+        racer = merged["user-1"]
+        assert racer.race_count == 2
+        assert racer.valid_lap_times == [7000, 6500]
+        assert racer.total_resets == 1
+        assert stats.tracks["track-1"].racers["user-1"].valid_lap_times == [7000]
+
     def test_user_map_populates_username(self):
         race = _make_race(user_id="user-1", laps=[_make_lap(7000)])
         user_map = {"user-1": {"username": "alice", "countryCode": "US"}}
@@ -133,3 +148,33 @@ class TestBuildRacerEventSummary:
         assert s.valid_lap_count == 2
         assert s.track_type == "REINVENT_2018"
         assert s.country_code == "GB"
+
+
+class TestEventPartials:
+    def test_partial_keeps_top_fastest_laps(self):
+        races = [
+            _make_race(user_id=f"user-{i}", laps=[_make_lap(6000 + i * 100)])
+            for i in range(FASTEST_LAPS_MAX + 5)
+        ]
+        partial = build_event_partial(compute_event_stats(_make_event(), races))
+        assert len(partial["racerIds"]) == FASTEST_LAPS_MAX + 5
+        assert len(partial["fastestLaps"]) == FASTEST_LAPS_MAX
+        assert partial["fastestLaps"][0]["lapTimeMs"] == 6000
+
+    def test_merge_counts_racers_once_across_events(self):
+        race = _make_race(laps=[_make_lap(7000), _make_lap(3000, is_valid=False)])
+        partials = [
+            build_event_partial(compute_event_stats(_make_event(eventId=eid), [race]))
+            for eid in ("evt-1", "evt-2")
+        ]
+        merged = merge_event_partials(partials)
+        assert merged["totalEvents"] == 2
+        assert merged["totalRacers"] == 1
+        assert merged["totalLaps"] == 4
+        assert merged["totalValidLaps"] == 2
+        assert merged["eventsByCountry"] == [
+            {"countryCode": "GB", "events": 2, "racers": 2, "laps": 2}
+        ]
+        assert merged["trackTypeBreakdown"] == [
+            {"trackType": "REINVENT_2018", "count": 2, "bestLapMs": 7000.0}
+        ]
@@ -1,6 +1,9 @@
 """Tests for the stats EVB global rebuild — racer name resolution."""
 import os
 import sys
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
 
 sys.path.insert(0, os.path.dirname(__file__))
 sys.path.insert(
@@ -20,11 +23,46 @@ import index  # noqa: E402
 
 
 class _FakeTable:
+    """
+    In-memory stats table: get/put/delete (with an equality condition),
+    batch writes, and queries on pk or on the sk GSI.
+    """
+
     def __init__(self):
         self.put_items = []
+        self.items = {}
 
     def put_item(self, Item):
         self.put_items.append(Item)
+        self.items[(Item["pk"], Item["sk"])] = Item
+
+    def get_item(self, Key):
+        item = self.items.get((Key["pk"], Key["sk"]))
+        return {"Item": item} if item else {}
+
+    def delete_item(self, Key, ConditionExpression=None):
+        key = (Key["pk"], Key["sk"])
+        if ConditionExpression is not None:
+            attr, value = ConditionExpression.get_expression()["values"]
+            if self.items.get(key, {}).get(attr.name) != value:
+                raise ClientError(
+                    {"Error": {"Code": "ConditionalCheckFailedException"}},
+                    "DeleteItem",
+                )
+        self.items.pop(key, None)
+
+    def query(self, KeyConditionExpression, IndexName=None, **kwargs):
+        attr, value = KeyConditionExpression.get_expression()["values"]
+        position = 0 if attr.name == "pk" else 1
+        return {
+            "Items": [
+                dict(item) for key, item in self.items.items() if key[position] == value
+            ]
+        }
+
+    @contextmanager
+    def batch_writer(self):
+        yield self
 
 
 class _FakeCognito:
@@ -124,6 +162,202 @@ def test_rebuild_loads_user_pool_once(monkeypatch):
     assert calls["n"] == 1, f"expected one pool scan, got {calls['n']}"
 
 
+def _setup_incremental(monkeypatch, events, races):
+    """Point the handler at in-memory events/races and a fake stats table."""
+    fake_stats = _FakeTable()
+    monkeypatch.setattr(index, "stats_table", fake_stats)
+    monkeypatch.setattr(index, "_scan_all_events", lambda: list(events.values()))
+    monkeypatch.setattr(index, "_get_event", lambda eid: events.get(eid))
+    monkeypatch.setattr(index, "_get_all_races_for_event", lambda eid: races[eid])
+    monkeypatch.setattr(
+        index, "_load_user_pool_index", lambda: {"u1": {"username": "alice"}}
+    )
+    monkeypatch.setattr(
+        index,
+        "_get_user_map",
+        lambda uids: {uid: {"username": "alice", "countryCode": ""} for uid in uids},
+    )
+    return fake_stats
+
+
+def _summary_event(event_id):
+    return {
+        "detail-type": "raceSummaryAdded",
+        "detail": {"eventId": event_id, "userId": "u1", "trackId": "track-1"},
+    }
+
+
+_FLUSH_EVENT = {"detail-type": "Scheduled Event", "detail": {}}
+
+
+def test_first_upsert_rebuilds_when_no_partials(monkeypatch):
+    """Without partials from a full rebuild, an upsert falls back to one."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+
+    index.lambda_handler(_summary_event("evt-1"), None)
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert ("GLOBAL", "PARTIALS") in fake_stats.items
+    assert ("EVENT#evt-2", "EVENT_PARTIAL") in fake_stats.items
+    assert fake_stats.items[("GLOBAL", "TOTALS")]["totalEvents"] == 2
+
+
+def test_upsert_recomputes_only_the_changed_event(monkeypatch):
+    """Once partials exist, only the event of the race change is re-read."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+
+    races["evt-1"] = [_race("u1"), _race("u3")]
+    queried = []
+    monkeypatch.setattr(
+        index,
+        "_get_all_races_for_event",
+        lambda eid: queried.append(eid) or races[eid],
+    )
+    index.lambda_handler(_summary_event("evt-1"), None)
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert queried == ["evt-1"]
+    totals = fake_stats.items[("GLOBAL", "TOTALS")]
+    assert totals["totalEvents"] == 2
+    assert totals["totalRacers"] == 3
+    assert totals["totalValidLaps"] == 3
+
+
+def test_upsert_without_races_removes_event_partial(monkeypatch):
+    """An event whose races were all deleted drops out of the totals."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+
+    races["evt-2"] = []
+    index.lambda_handler(_summary_event("evt-2"), None)
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert ("EVENT#evt-2", "EVENT_PARTIAL") not in fake_stats.items
+    assert fake_stats.items[("GLOBAL", "TOTALS")]["totalEvents"] == 1
+
+
+def test_burst_of_races_is_recomputed_once(monkeypatch):
+    """Summary events only mark the event; the flush recomputes it once."""
+    events = {"evt-1": _event("evt-1")}
+    races = {"evt-1": [_race("u1")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+    totals_before = fake_stats.items[("GLOBAL", "TOTALS")]
+
+    queried = []
+    monkeypatch.setattr(
+        index,
+        "_get_all_races_for_event",
+        lambda eid: queried.append(eid) or races[eid],
+    )
+    for user_id in ("u2", "u3", "u4"):
+        races["evt-1"].append(_race(user_id))
+        index.lambda_handler(_summary_event("evt-1"), None)
+
+    assert queried == []
+    assert fake_stats.items[("GLOBAL", "TOTALS")] is totals_before
+
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert queried == ["evt-1"]
+    assert fake_stats.items[("GLOBAL", "TOTALS")]["totalRacers"] == 4
+    assert ("DIRTY", "evt-1") not in fake_stats.items
+
+    index.lambda_handler(_FLUSH_EVENT, None)
+    assert queried == ["evt-1"], "a flush without dirty events recomputes nothing"
+
+
+def test_event_marked_during_flush_stays_dirty(monkeypatch):
+    """A race arriving while the flush runs is left for the next flush."""
+    events = {"evt-1": _event("evt-1")}
+    races = {"evt-1": [_race("u1")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+    index.lambda_handler(_summary_event("evt-1"), None)
+
+    def _races_with_new_summary(eid):
+        index.lambda_handler(_summary_event(eid), None)
+        return races[eid]
+
+    monkeypatch.setattr(index, "_get_all_races_for_event", _races_with_new_summary)
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert ("DIRTY", "evt-1") in fake_stats.items
+
+
+def test_deleted_event_drops_out_of_the_totals(monkeypatch):
+    """Deleting an event removes its partial and, after a flush, its totals."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+
+    del events["evt-2"]
+    index.lambda_handler(
+        {"detail-type": "eventDeleted", "detail": {"eventId": "evt-2"}}, None
+    )
+
+    assert ("EVENT#evt-2", "EVENT_PARTIAL") not in fake_stats.items
+
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    totals = fake_stats.items[("GLOBAL", "TOTALS")]
+    assert totals["totalEvents"] == 1
+    assert totals["totalRacers"] == 1
+
+
+def test_updated_event_is_recomputed_with_its_new_type(monkeypatch):
+    """An event switched to a test event no longer counts after the flush."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+
+    events["evt-2"] = {**events["evt-2"], "typeOfEvent": "TEST_EVENT"}
+    index.lambda_handler(
+        {"detail-type": "eventUpdated", "detail": events["evt-2"]}, None
+    )
+    index.lambda_handler(_FLUSH_EVENT, None)
+
+    assert ("EVENT#evt-2", "EVENT_PARTIAL") not in fake_stats.items
+    assert fake_stats.items[("GLOBAL", "TOTALS")]["totalEvents"] == 1
+
+
+def test_rebuild_request_removes_stale_partials(monkeypatch):
+    """A full rebuild drops partials of events that no longer exist."""
+    events = {"evt-1": _event("evt-1"), "evt-2": _event("evt-2")}
+    races = {"evt-1": [_race("u1")], "evt-2": [_race("u2")]}
+    fake_stats = _setup_incremental(monkeypatch, events, races)
+    index._rebuild_global_stats()
+
+    del events["evt-2"]
+    index.lambda_handler({"detail-type": "statsRebuildRequested", "detail": {}}, None)
+
+    assert ("EVENT#evt-2", "EVENT_PARTIAL") not in fake_stats.items
+    assert fake_stats.items[("GLOBAL", "TOTALS")]["totalEvents"] == 1
+
+
+def test_user_map_falls_back_for_unknown_users(monkeypatch):
+    """Subs missing from the user cache and Cognito get the sub-prefix name."""
+    monkeypatch.setattr(
+        index.user_cache,
+        "get_users",
+        lambda pool, subs: {"sub-1": {"username": "alice", "countryCode": "GB"}},
+    )
+
+    assert index._get_user_map({"sub-1", "ghost-user-deleted"}) == {
+        "sub-1": {"username": "alice", "countryCode": "GB"},
+        "ghost-user-deleted": {"username": "ghost-us", "countryCode": ""},
+    }
+
+
 def test_load_user_pool_index_paginates(monkeypatch):
     """ListUsers is paginated; both pages contribute to the returned index."""
     pages = [
@@ -168,3 +402,102 @@ def test_load_user_pool_index_skips_users_without_sub(monkeypatch):
     pages = [{"Users": [{"Username": "no-sub", "Attributes": []}]}]
     monkeypatch.setattr(index, "cognito_client", _FakeCognito(pages))
     assert index._load_user_pool_index() == {}
+
+
+class _FakeUserCacheTable:
+    """In-memory user cache table, read through dynamo_helpers.batch_get_items."""
+
+    name = "user-cache"
+
+    def __init__(self):
+        self.items = {}
+
+    @contextmanager
+    def batch_writer(self, overwrite_by_pkeys=None):
+        yield self
+
+    def put_item(self, Item):
+        self.items[Item["sub"]] = Item
+
+    def delete_item(self, Key):
+        self.items.pop(Key["sub"], None)
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.name]["Keys"]
+        return {
+            "Responses": {
+                self.name: [
+                    self.items[key["sub"]] for key in keys if key["sub"] in self.items
+                ]
+            },
+            "UnprocessedKeys": {},
+        }
+
+
+class _FakeUserPool:
+    """Answers sub-filtered ListUsers calls from a dict of sub -> user."""
+
+    def __init__(self, users):
+        self.users = users
+        self.calls = 0
+
+    def list_users(self, UserPoolId, Filter):
+        self.calls += 1
+        sub = Filter.split('"')[1]
+        user = self.users.get(sub)
+        if not user:
+            return {"Users": []}
+        return {
+            "Users": [
+                {
+                    "Username": user["username"],
+                    "Attributes": [
+                        {"Name": "sub", "Value": sub},
+                        {"Name": "custom:countryCode", "Value": user["countryCode"]},
+                    ],
+                }
+            ]
+        }
+
+
+def _setup_user_cache(monkeypatch, users):
+    user_cache = index.user_cache
+    table = _FakeUserCacheTable()
+    pool = _FakeUserPool(users)
+    now = {"t": 1_000_000.0}
+    monkeypatch.setattr(user_cache, "_memory", {})
+    monkeypatch.setattr(user_cache, "_table", lambda: table)
+    monkeypatch.setattr(user_cache.dynamo_helpers, "dynamodb", table)
+    monkeypatch.setattr(user_cache, "cognito_client", pool)
+    monkeypatch.setattr(user_cache.time, "time", lambda: now["t"])
+    return table, pool, now
+
+
+def test_user_cache_picks_up_changed_country_code(monkeypatch):
+    """A countryCode changed in Cognito is served within the hour."""
+    users = {"sub-1": {"username": "alice", "countryCode": "GB"}}
+    _, pool, now = _setup_user_cache(monkeypatch, users)
+    user_cache = index.user_cache
+    user_cache.put_user("sub-1", "alice", "GB")
+
+    users["sub-1"] = {"username": "alice", "countryCode": "SE"}
+    now["t"] += user_cache.MEMORY_TTL_SECONDS + 1
+    assert user_cache.get_user("pool", "sub-1")["countryCode"] == "GB"
+    assert pool.calls == 0
+
+    now["t"] += 3600
+    assert user_cache.get_user("pool", "sub-1")["countryCode"] == "SE"
+    assert pool.calls == 1
+
+
+def test_user_cache_forgets_removed_user(monkeypatch):
+    """A user removed from the cache is looked up in Cognito again."""
+    table, pool, _ = _setup_user_cache(monkeypatch, {})
+    user_cache = index.user_cache
+    user_cache.put_user("sub-1", "alice", "GB")
+
+    user_cache.remove_user("sub-1")
+
+    assert "sub-1" not in table.items
+    assert user_cache.get_user("pool", "sub-1") is None
+    assert pool.calls == 1
@@ -1,11 +1,15 @@
+import os
+
 import appsync_helpers
 import boto3
+import user_cache
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
 logger = Logger()
 
 client_cognito = boto3.client("cognito-idp")
+user_pool_id = os.environ["user_pool_id"]
 
 
 @logger.inject_lambda_context
@@ -41,6 +45,18 @@ def lambda_handler(event: dict, context: LambdaContext) -> str:
             query, {"roles": [default_group_name], "username": username}
         )
 
+        # Refresh the user in the shared user cache, attributes such as the
+        # country may have been completed during sign up
+        response = client_cognito.list_users(
+            UserPoolId=user_pool_id,
+            Limit=1,
+            Filter='username = "{}"'.format(username),
+        )
+        for cognito_user in response["Users"]:
+            sub, cached_user = user_cache.user_from_cognito(cognito_user)
+            if sub:
+                user_cache.put_users({sub: cached_user})
+
     except Exception as error:
         logger.exception(error)
         return error
@@ -5,6 +5,7 @@ import time
 import appsync_helpers
 import boto3
 import http_response
+import user_cache
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
@@ -56,6 +57,11 @@ def lambda_handler(event: dict, context: LambdaContext) -> str:
                 break
         logger.info(user)
 
+        # Add the new user to the shared user cache
+        sub, cached_user = user_cache.user_from_cognito(user)
+        if sub:
+            user_cache.put_users({sub: cached_user})
+
     query = """ mutation UserCreated(
         $Attributes: [UserObjectAttributesInput]
         $Enabled: Boolean
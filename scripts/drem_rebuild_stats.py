@@ -53,32 +53,12 @@ def main():
     print(f"Stats Lambda: {fn_name}")
     print()
 
-    # Build a synthetic EventBridge event to trigger a rebuild.
-    # The Lambda's _handle_upsert looks up the event first, then calls
-    # _rebuild_global_stats(). We need a real eventId that exists in
-    # the events table, so we grab the first one.
-    tables = config["tables"]
-    if "events" not in tables:
-        sys.exit("ERROR: Events table not found. Run discovery first.")
-
-    print("Finding an event to trigger rebuild...")
-    ddb = boto3.resource("dynamodb", region_name=config["region"])
-    events_table = ddb.Table(tables["events"])
-    scan = events_table.scan(Limit=1)
-    if not scan.get("Items"):
-        sys.exit("ERROR: Events table is empty. Import data first.")
-
-    event = scan["Items"][0]
-    event_id = event["eventId"]
-    print(f"  Using event: {event.get('eventName', event_id)}\n")
-
+    # The Lambda normally updates the global stats incrementally, from the
+    # stored per-event partials. This detail-type makes it recompute every
+    # partial from the events and race tables instead.
     payload = {
-        "detail-type": "raceSummaryAdded",
-        "detail": {
-            "eventId": event_id,
-            "userId": "stats-rebuild-trigger",
-            "trackId": "1",
-        },
+        "detail-type": "statsRebuildRequested",
+        "detail": {},
     }
 
     print("Invoking stats rebuild...")